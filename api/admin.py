@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, DoctorProfile, PatientProfile, Appointment, Prescription
+from .models import User, DoctorProfile, DoctorAvailability, PatientProfile, Appointment, Prescription
 
 class UserAdmin(BaseUserAdmin):
     list_display = ('id', 'username', 'email', 'role', 'is_staff', 'is_active')
@@ -10,6 +10,7 @@ class UserAdmin(BaseUserAdmin):
 
 admin.site.register(User, UserAdmin)
 admin.site.register(DoctorProfile)
+admin.site.register(DoctorAvailability)
 admin.site.register(PatientProfile)
 admin.site.register(Appointment)
 admin.site.register(Prescription)
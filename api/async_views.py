@@ -0,0 +1,97 @@
+"""
+Async variants of the read-heavy list endpoints, for ASGI deployments.
+
+Each view reuses its synchronous counterpart in api/views.py for everything
+that does not touch the database (queryset construction, permissions,
+serializer and keyset paginator) and only swaps the I/O: token-claims
+authentication, the page query (async ORM) and the directory cache are all
+awaited, so an ASGI worker keeps many slow requests in flight on one thread.
+Responses are byte-identical to the synchronous views. `?since=` change feeds
+run the synchronous feed in a worker thread. Only Bearer tokens are accepted
+(no session authentication).
+"""
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import views
+from .audit import AuditedMixin, arecord, response_ids
+from .authentication import ClaimsJWTAuthentication
+from .cache import _headers, acached_directory
+from .sync import DeltaSyncMixin
+
+
+def _json_response(data, status=200, headers=None):
+    return HttpResponse(JSONRenderer().render(data), status=status, headers=headers, content_type='application/json')
+
+
+class AsyncListView(View):
+    """Serve the GET of `sync_view` through the async ORM."""
+    sync_view = None
+    # Build the queryset in a worker thread (filter backends may introspect the database).
+    queryset_in_thread = False
+
+    async def get(self, request, *args, **kwargs):
+        authenticator = ClaimsJWTAuthentication()
+        try:
+            request = Request(request)
+            result = await authenticator.aauthenticate(request._request)
+            if result is not None:
+                request.user, request.auth = result
+            view = self.sync_view(request=request, args=args, kwargs=kwargs, format_kwarg=None, headers={})
+            view.check_permissions(request)
+            return await self.list(view, request)
+        except exceptions.APIException as exc:
+            headers = {}
+            if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                headers['WWW-Authenticate'] = authenticator.authenticate_header(request)
+            return _json_response(
+                exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail},
+                status=exc.status_code,
+                headers=headers,
+            )
+
+    async def get_queryset(self, view):
+        if self.queryset_in_thread:
+            return await sync_to_async(lambda: view.filter_queryset(view.get_queryset()))()
+        return view.filter_queryset(view.get_queryset())
+
+    async def get_data(self, view, request):
+        if isinstance(view, DeltaSyncMixin) and 'since' in request.query_params:
+            # The change feed (api/sync.py) is synchronous; run it in a worker thread.
+            return (await sync_to_async(view.list)(request)).data
+        queryset = await self.get_queryset(view)
+        paginator = view.paginator
+        if paginator is None:
+            return view.get_serializer([obj async for obj in queryset], many=True).data
+        rows = paginator.build_page([obj async for obj in paginator.get_page_queryset(queryset, request)])
+        return paginator.get_paginated_response(view.get_serializer(rows, many=True).data).data
+
+    async def list(self, view, request):
+        data = await self.get_data(view, request)
+        if isinstance(view, AuditedMixin):
+            await arecord(request.user.id, view.audit_kind, 'read', response_ids(data))
+        return _json_response(data)
+
+
+class AppointmentListView(AsyncListView):
+    sync_view = views.AppointmentListView
+
+
+class PrescriptionListView(AsyncListView):
+    sync_view = views.PrescriptionListView
+
+
+class DoctorProfileListView(AsyncListView):
+    """Cached like the sync directory; serves 304 on a matching If-None-Match."""
+    sync_view = views.DoctorProfileListView
+    queryset_in_thread = True
+
+    async def list(self, view, request):
+        etag, data, not_modified = await acached_directory(request, lambda: self.get_data(view, request))
+        if not_modified:
+            return HttpResponse(status=304, headers=_headers(etag))
+        return _json_response(data, headers=_headers(etag) if etag else None)
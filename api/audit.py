@@ -0,0 +1,254 @@
+"""
+Audit trail of access to medical records: who read or changed which patient
+profiles (medical history), appointments and prescriptions, and when.
+
+Views record events with `record()`; AuditedMixin does it for every successful
+response of a view, from the ids in the response. Recording appends a tuple to
+an in-process buffer and costs the request no query. The buffer is written to
+AuditEvent in bulk, one row per event and patient, the patients being looked up
+at that point (one query per kind, falling back to tombstones for rows deleted
+since).
+
+Server processes flush in a background thread: wsgi.py and asgi.py call
+`start()`, and each worker starts its thread on its first event (so
+`gunicorn --preload` forks work). The thread flushes when the buffer holds
+AUDIT_BUFFER_SIZE events and at least every AUDIT_FLUSH_SECONDS, and the
+process flushes what is left at exit; a killed worker loses what it buffered.
+Other processes (tests, shell, management commands) keep events buffered until
+`flush()` is called or the buffer holds AUDIT_BUFFER_SIZE events, when the
+recording call writes them. A failed write puts its events back in the buffer
+(the recording call and the thread log the error; only `flush()` raises it).
+While writes keep failing the buffer holds at most AUDIT_BUFFER_MAX events:
+newer ones are dropped, counted in `dropped` and logged.
+
+AuditEvent is append-only (updates and deletes are refused) and partitioned by
+month: `month` leads its index and every lookup (`events()`) names the months
+it covers, so a compliance query reads only its months' part of the index and
+old months can be archived month by month.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import Appointment, AuditEvent, PatientProfile, Prescription, Tombstone
+
+logger = logging.getLogger(__name__)
+
+# kind -> (model, path from the model to the patient's user id)
+PATIENT_LOOKUPS = {
+    'patient': (PatientProfile, 'user_id'),
+    'appointment': (Appointment, 'patient_id'),
+    'prescription': (Prescription, 'patient_id'),
+}
+ACTIONS = {'GET': 'read', 'POST': 'create', 'PUT': 'update', 'PATCH': 'update'}
+
+_lock = threading.Lock()
+_buffer = []  # (at, actor id, kind, action, object ids)
+_wake = threading.Event()
+_background = False
+_flusher_pid = None  # pid of the process whose flusher thread is running
+dropped = 0  # events dropped because the buffer was full
+_overflowing = False  # whether events were dropped since the last successful write
+
+
+def month_of(at):
+    """Partition key of a datetime: year * 100 + month, in UTC."""
+    at = at.astimezone(datetime.timezone.utc)
+    return at.year * 100 + at.month
+
+
+def months(start, end):
+    """Partition keys covering [start, end)."""
+    first, last = month_of(start), month_of(end - datetime.timedelta(microseconds=1))
+    keys = []
+    while first <= last:
+        keys.append(first)
+        first = first + 1 if first % 100 < 12 else (first // 100 + 1) * 100 + 1
+    return keys
+
+
+def record(actor_id, kind, action, object_ids):
+    """Buffer an event: `actor_id` did `action` on the `kind` rows `object_ids`."""
+    if _append(actor_id, kind, action, object_ids):
+        _flush_logged()
+
+
+async def arecord(actor_id, kind, action, object_ids):
+    """`record` for async views."""
+    if _append(actor_id, kind, action, object_ids):
+        await sync_to_async(_flush_logged)()
+
+
+def _append(actor_id, kind, action, object_ids):
+    """Buffer an event; return True if the caller must flush (no flusher thread and the buffer is full)."""
+    if not settings.AUDIT_LOG or not object_ids:
+        return False
+    with _lock:
+        _buffer.append((timezone.now(), actor_id, kind, action, list(object_ids)))
+        _trim()
+        full = len(_buffer) >= settings.AUDIT_BUFFER_SIZE
+    if not _background:
+        # Write the batch in the recording call rather than grow the buffer without bound.
+        return full
+    if _flusher_pid != os.getpid():
+        _start_flusher()
+    if full:
+        _wake.set()
+    return False
+
+
+def response_ids(data):
+    """Ids of the rows in a response: a page ({"results": [...]}), a list or a single row."""
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        data = data['results']
+    if isinstance(data, list):
+        return [row['id'] for row in data if isinstance(row, dict) and 'id' in row]
+    if isinstance(data, dict) and 'id' in data:
+        return [data['id']]
+    return []
+
+
+def _patients(kind, object_ids):
+    """{object id: patient user id} of `kind` rows, deleted ones included."""
+    model, path = PATIENT_LOOKUPS[kind]
+    patients = dict(model.objects.filter(pk__in=object_ids).values_list('pk', path))
+    missing = set(object_ids) - patients.keys()
+    if missing:
+        patients.update(
+            Tombstone.objects.filter(kind=kind, object_id__in=missing).values_list('object_id', 'patient_id')
+        )
+    return patients
+
+
+def _trim():
+    """Drop the events beyond AUDIT_BUFFER_MAX, newest first; call with _lock held."""
+    global dropped, _overflowing
+    overflow = len(_buffer) - settings.AUDIT_BUFFER_MAX
+    if overflow <= 0:
+        return
+    del _buffer[settings.AUDIT_BUFFER_MAX:]
+    dropped += overflow
+    if not _overflowing:
+        _overflowing = True
+        logger.error("Audit log buffer full (%s events): dropping new events until a write succeeds.", len(_buffer))
+
+
+def flush():
+    """Write the buffered events; return how many rows were written."""
+    global _overflowing
+    with _lock:
+        events = _buffer[:]
+        _buffer.clear()
+    if not events:
+        return 0
+    try:
+        written = _write(events)
+    except Exception:
+        # Keep the events, ahead of those recorded meanwhile, for the next flush.
+        with _lock:
+            _buffer[:0] = events
+            _trim()
+        raise
+    if _overflowing:
+        _overflowing = False
+        logger.warning("Audit log written again; %s events have been dropped in all.", dropped)
+    return written
+
+
+def _flush_logged():
+    """flush() for the recording call and the flusher thread: a failed write is logged, not raised."""
+    try:
+        # In a savepoint, so a failed write doesn't break a transaction the caller is in.
+        with transaction.atomic():
+            flush()
+    except Exception:
+        logger.exception("Could not write the audit log buffer.")
+
+
+def _write(events):
+    ids = defaultdict(set)
+    for _, _, kind, _, object_ids in events:
+        ids[kind].update(object_ids)
+    patients = {kind: _patients(kind, object_ids) for kind, object_ids in ids.items()}
+
+    rows = []
+    for at, actor_id, kind, action, object_ids in events:
+        by_patient = defaultdict(list)
+        for object_id in object_ids:
+            by_patient[patients[kind].get(object_id)].append(object_id)
+        rows.extend(
+            AuditEvent(
+                month=month_of(at), at=at, actor_id=actor_id, patient_id=patient_id,
+                kind=kind, action=action, object_ids=patient_object_ids,
+            )
+            for patient_id, patient_object_ids in by_patient.items()
+        )
+    AuditEvent.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def _flush_forever():
+    while True:
+        _wake.wait(settings.AUDIT_FLUSH_SECONDS)
+        _wake.clear()
+        close_old_connections()
+        _flush_logged()
+
+
+def _start_flusher():
+    global _flusher_pid
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+    threading.Thread(target=_flush_forever, name='audit-flusher', daemon=True).start()
+
+
+def start():
+    """Flush in a background thread of each process, and at exit (server entry points; see module docstring)."""
+    global _background
+    if not _background:
+        _background = True
+        atexit.register(flush)
+
+
+def reset():
+    """Drop the buffered events and the count of dropped ones."""
+    global dropped, _overflowing
+    with _lock:
+        _buffer.clear()
+        dropped, _overflowing = 0, False
+
+
+def events(patient_id, start, end):
+    """The AuditEvents of `patient_id` at `start` or later and before `end` (datetimes), oldest first."""
+    return AuditEvent.objects.filter(
+        month__in=months(start, end), patient_id=patient_id, at__gte=start, at__lt=end,
+    ).order_by('at', 'id')
+
+
+class AuditedMixin:
+    """Record the successful responses of a view (see module docstring)."""
+    # Kind of the rows the view reads or writes (a PATIENT_LOOKUPS key)
+    audit_kind = None
+    # Action recorded for every request, instead of the one of its method (ACTIONS)
+    audit_action = None
+
+    def get_audit_ids(self, response):
+        """Ids of the rows `response` reads or writes; by default those in its data."""
+        return response_ids(getattr(response, 'data', None))
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if 200 <= response.status_code < 300 and request.method in ACTIONS:
+            action = self.audit_action or ACTIONS[request.method]
+            record(request.user.id, self.audit_kind, action, self.get_audit_ids(response))
+        return response
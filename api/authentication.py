@@ -0,0 +1,160 @@
+"""
+Token-claims JWT authentication.
+
+Access tokens carry the user's `role`, `is_staff` and `profile_id` (see
+`ClaimsTokenObtainPairSerializer`). With `JWT_CLAIMS_AUTH` enabled, views using
+`ClaimsAuthenticationMixin` build a `ClaimsUser` from those claims instead of
+loading the `User` row on every request. Revocation (deactivated users, role
+or staff changes) is still honoured through a per-process cache of each user's
+`is_active`/`role`/`is_staff`, refreshed at most every `JWT_CLAIMS_REVOCATION_TTL` seconds,
+so steady-state requests cost zero authentication queries.
+"""
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User, DoctorProfile, PatientProfile
+
+# User fields whose change must be seen by the next request, in the order they are cached.
+STATE_FIELDS = ('is_active', 'role', 'is_staff')
+REVOCATION_USER_FIELDS = frozenset(STATE_FIELDS)
+
+# Claims a token must carry to be authenticated without loading the user.
+CLAIMS = ('role', 'is_staff')
+
+_state_lock = threading.Lock()
+_user_state = {}  # str(user id), as carried in tokens -> (expires at, is_active, role, is_staff)
+
+
+def forget_user(user_id):
+    """Drop the cached revocation state of a user (called when the user changes)."""
+    with _state_lock:
+        _user_state.pop(str(user_id), None)
+
+
+def clear_user_state():
+    with _state_lock:
+        _user_state.clear()
+
+
+def _cached_state(user_id):
+    with _state_lock:
+        cached = _user_state.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1:]
+    return None
+
+
+def _store_state(user_id, row):
+    state = row or (False, None, False)
+    with _state_lock:
+        _user_state[user_id] = (time.monotonic() + settings.JWT_CLAIMS_REVOCATION_TTL, *state)
+    return state
+
+
+def _current_state(user_id):
+    user_id = str(user_id)
+    state = _cached_state(user_id)
+    if state is None:
+        state = _store_state(user_id, User.objects.filter(pk=user_id).values_list(*STATE_FIELDS).first())
+    return state
+
+
+async def _acurrent_state(user_id):
+    user_id = str(user_id)
+    state = _cached_state(user_id)
+    if state is None:
+        state = _store_state(user_id, await User.objects.filter(pk=user_id).values_list(*STATE_FIELDS).afirst())
+    return state
+
+
+class ClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Embed the role, staff flag and profile id in issued tokens (refreshed access tokens inherit them)."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        profile_model = DoctorProfile if user.role == 'doctor' else PatientProfile
+        token['username'] = user.username
+        token['role'] = user.role
+        token['is_staff'] = user.is_staff
+        token['profile_id'] = profile_model.objects.filter(user_id=user.pk).values_list('id', flat=True).first()
+        return token
+
+
+class ClaimsUser(TokenUser):
+    """Lightweight request.user built from token claims."""
+
+    @cached_property
+    def id(self):
+        # TokenUser returns the claim as a string; views compare it with integer foreign keys.
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+    @cached_property
+    def pk(self):
+        return self.id
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def profile_id(self):
+        return self.token.get('profile_id')
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in CLAIMS):
+            # Token issued before these claims were embedded: fall back to the database.
+            return super().get_user(validated_token)
+        user = ClaimsUser(validated_token)
+        return self._check_state(user, *_current_state(user.id))
+
+    async def aauthenticate(self, request):
+        """`authenticate` for plain Django async views (see api/async_views.py)."""
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        if not all(claim in validated_token for claim in CLAIMS):
+            return await sync_to_async(super().get_user)(validated_token), validated_token
+        user = ClaimsUser(validated_token)
+        return self._check_state(user, *await _acurrent_state(user.id)), validated_token
+
+    @staticmethod
+    def _check_state(user, is_active, role, is_staff):
+        if not is_active:
+            raise AuthenticationFailed("User is inactive or no longer exists.", code='user_inactive')
+        if role != user.role:
+            raise AuthenticationFailed("User role changed; please log in again.", code='role_changed')
+        if is_staff != user.is_staff:
+            raise AuthenticationFailed("User permissions changed; please log in again.", code='staff_changed')
+        return user
+
+
+class ClaimsAuthenticationMixin:
+    """
+    For read-only views that only need the user's id and role. When
+    JWT_CLAIMS_AUTH is on, Bearer tokens are authenticated from their claims.
+    """
+
+    def get_authenticators(self):
+        authenticators = super().get_authenticators()
+        if not settings.JWT_CLAIMS_AUTH:
+            return authenticators
+        return [
+            ClaimsJWTAuthentication() if type(authenticator) is JWTAuthentication else authenticator
+            for authenticator in authenticators
+        ]
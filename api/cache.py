@@ -0,0 +1,137 @@
+"""
+Response cache for the doctor directory (DoctorProfileListView, AvailableDoctorsView).
+
+Entries are stored under a directory "version" that signal handlers bump on any
+change to a DoctorProfile or a doctor's User row, so invalidation is a single
+increment and stale entries simply age out. Each entry keeps the serialized
+payload and its ETag, so conditional requests are answered with 304 without
+touching the database or the serializers.
+
+The version must be seen by every worker, so the cache only runs with
+DIRECTORY_CACHE on (by default when the cache backend isn't per-process LocMem);
+otherwise lists are served uncached, without an ETag.
+"""
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .routers import read_from_primary
+
+VERSION_KEY = 'directory:version'
+
+# User fields rendered by DoctorProfileSerializer; saves touching only others (e.g. last_login) are ignored.
+DIRECTORY_USER_FIELDS = frozenset({'id', 'username', 'email', 'first_name', 'last_name', 'role'})
+
+_stats_lock = threading.Lock()
+stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'invalidations': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+
+def get_cache():
+    return caches[settings.DIRECTORY_CACHE_ALIAS]
+
+
+def invalidate_directory():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, timeout=None)
+    _count('invalidations')
+
+
+def _params_digest(request):
+    params = sorted((key, value) for key, value in request.query_params.lists() if key != 'format')
+    return hashlib.md5(json.dumps(params).encode(), usedforsecurity=False).hexdigest()
+
+
+def _cache_key(request):
+    cache = get_cache()
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return f'directory:{version}:{_params_digest(request)}'
+
+
+async def _acache_key(request):
+    cache = get_cache()
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(VERSION_KEY, 1)
+    return f'directory:{version}:{_params_digest(request)}'
+
+
+def _etag(data):
+    body = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()
+    return f'"{hashlib.md5(body, usedforsecurity=False).hexdigest()}"'
+
+
+class CachedDirectoryMixin:
+    """Serve list() from the directory cache, honouring If-None-Match."""
+
+    def list(self, request, *args, **kwargs):
+        if not settings.DIRECTORY_CACHE:
+            return super().list(request, *args, **kwargs)
+        cache = get_cache()
+        key = _cache_key(request)
+        entry = cache.get(key)
+        if entry is None:
+            _count('misses')
+            with read_from_primary():
+                # A replica's rows could be older than the version they'd be cached under.
+                data = super().list(request, *args, **kwargs).data
+            entry = (_etag(data), data)
+            cache.set(key, entry, settings.DIRECTORY_CACHE_TIMEOUT)
+        else:
+            _count('hits')
+
+        etag, data = entry
+        headers = _headers(etag)
+        if _not_modified(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
+
+
+async def acached_directory(request, build):
+    """
+    Async counterpart of CachedDirectoryMixin.list: return (etag, data, not_modified),
+    awaiting `build()` for the serialized data on a miss; the etag is None when the cache is off.
+    """
+    if not settings.DIRECTORY_CACHE:
+        return None, await build(), False
+    cache = get_cache()
+    key = await _acache_key(request)
+    entry = await cache.aget(key)
+    if entry is None:
+        _count('misses')
+        data = await build()
+        entry = (_etag(data), data)
+        await cache.aset(key, entry, settings.DIRECTORY_CACHE_TIMEOUT)
+    else:
+        _count('hits')
+    etag, data = entry
+    return etag, data, _not_modified(request, etag)
+
+
+def _headers(etag):
+    return {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+
+
+def _not_modified(request, etag):
+    if_none_match = request.headers.get('If-None-Match', '')
+    if if_none_match == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+        _count('not_modified')
+        return True
+    return False
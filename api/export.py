@@ -0,0 +1,73 @@
+"""
+Streaming export of a patient's full record.
+
+`export_lines` yields the record as JSON Lines: first the patient's profile,
+then one line per appointment (oldest first) with its prescription embedded,
+or null. Appointments are read with `iterator(chunk_size=...)`, which uses a
+server-side cursor where the database has them, and each chunk goes through
+the compiled row serializers (api/row_serializers.py), or the regular ones
+when those can't be compiled, with one query for its prescriptions. Memory stays flat however long the history is, and the first
+lines are sent before the last rows are read.
+"""
+from itertools import islice
+
+from rest_framework.renderers import JSONRenderer
+
+from .models import Appointment, Prescription
+from .row_serializers import compile_serializer
+from .serializers import AppointmentSerializer, PatientProfileSerializer, PrescriptionSerializer
+
+CHUNK_SIZE = 500
+
+
+def export_lines(profile, chunk_size=CHUNK_SIZE):
+    """Yield `profile`'s record as JSON Lines, in bytes: the profile line, then one piece per chunk."""
+    renderer = JSONRenderer()
+    yield renderer.render({'patient': PatientProfileSerializer(profile).data}) + b'\n'
+
+    queryset = Appointment.objects.filter(patient_id=profile.user_id).order_by('date', 'id')
+    appointments = compile_serializer(AppointmentSerializer)
+    prescriptions = compile_serializer(PrescriptionSerializer)
+    if appointments is None or prescriptions is None:
+        chunks = _serialized_chunks(queryset, chunk_size)
+    else:
+        chunks = _compiled_chunks(appointments, prescriptions, queryset, chunk_size)
+    for chunk in chunks:
+        yield b''.join(renderer.render({'appointment': data}) + b'\n' for data in chunk)
+
+
+def _compiled_chunks(appointments, prescriptions, queryset, chunk_size):
+    """Serialized appointments with their prescription embedded, `chunk_size` at a time."""
+    rows = appointments.values(queryset).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        prescription_rows = prescriptions.fetch(
+            Prescription.objects.filter(appointment_id__in=[row['pk'] for row in chunk]), ['appointment_id'],
+        )
+        issued = {
+            row['appointment_id']: data
+            for row, data in zip(prescription_rows, prescriptions.serialize(prescription_rows))
+        }
+        data = appointments.serialize(chunk)
+        for row, item in zip(chunk, data):
+            item['prescription'] = issued.get(row['pk'])
+        yield data
+
+
+def _serialized_chunks(queryset, chunk_size):
+    """The same chunks through the regular serializers, for when either can't be compiled."""
+    instances = AppointmentSerializer.shape_queryset(queryset).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(instances, chunk_size)):
+        issued_prescriptions = list(
+            PrescriptionSerializer.shape_queryset(Prescription.objects.filter(appointment__in=chunk))
+            .only(*PrescriptionSerializer.only_fields, 'appointment')
+        )
+        issued = {
+            prescription.appointment_id: data
+            for prescription, data in zip(
+                issued_prescriptions, PrescriptionSerializer(issued_prescriptions, many=True).data,
+            )
+        }
+        data = AppointmentSerializer(chunk, many=True).data
+        for appointment, item in zip(chunk, data):
+            item['prescription'] = issued.get(appointment.pk)
+        yield data
@@ -0,0 +1,27 @@
+import django_filters
+
+from .models import DoctorProfile
+from .search import search_doctors
+
+
+class DoctorProfileFilter(django_filters.FilterSet):
+    """
+    Doctor directory filters:
+    ?specialty=Cardiology  exact specialty
+    ?tag=pediatrics,asthma doctors with any of the tags
+    ?q=ada card            full-text prefix search over name, specialty and bio
+    """
+    specialty = django_filters.CharFilter(field_name='specialty')
+    tag = django_filters.CharFilter(method='filter_tag')
+    q = django_filters.CharFilter(method='filter_search')
+
+    class Meta:
+        model = DoctorProfile
+        fields = ['specialty', 'tag', 'q']
+
+    def filter_tag(self, queryset, name, value):
+        tags = [tag.strip() for tag in value.split(',') if tag.strip()]
+        return queryset.filter(tags__name__in=tags).distinct() if tags else queryset
+
+    def filter_search(self, queryset, name, value):
+        return search_doctors(queryset, value)
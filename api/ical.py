@@ -0,0 +1,248 @@
+"""
+iCalendar feed of a doctor's confirmed appointments (GET /api/doctors/<id>/calendar.ics).
+
+Each doctor's feed is cached in three entries of the CALENDAR_CACHE_ALIAS cache:
+`meta` (ETag, Last-Modified and the version of the appointments it was made
+from), `body` (the rendered feed and the ids in it) and `events` (the rendered
+VEVENT of each appointment). A poll reads the version from the database (the
+count and latest updated_at of the doctor's appointments: one index-only
+aggregate) and `meta`, and is answered 304 when the cached feed is of that
+version and the client's If-None-Match (or, without one, If-Modified-Since)
+still matches it. A changed feed costs a second lookup for `body`; a missing or
+outdated one is built from the database and cached for CALENDAR_CACHE_TIMEOUT
+seconds. The version check keeps a per-process cache (LocMem) from serving a
+feed that another process changed.
+
+With CALENDAR_PATCHING on (by default when the cache is shared, i.e. not
+LocMem), changes patch the cached feed instead of having the next poll rebuild
+it. When an appointment of a doctor whose feed is cached is saved or deleted
+(post_save/post_delete, and the bulk update, which saves without signals), a
+'calendar-refresh' job (api/jobs.py) runs `refresh()` after the commit: it
+re-reads the appointment and re-renders, adds or removes its one VEVENT. Builds
+and patches of a doctor's feed hold a short cache lock, so a patch never races
+a build that read the rows before the change; a patch that can't get the lock
+drops the feed. Both need the cache the web processes read, which a job worker
+doesn't share with LocMem.
+"""
+import datetime
+import hashlib
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.http import http_date, parse_http_date_safe
+
+from .jobs import enqueue, job
+from .models import Appointment, DoctorAvailability
+from .scheduling import DEFAULT_SLOT_MINUTES
+
+CONTENT_TYPE = 'text/calendar; charset=utf-8'
+HEADER = (
+    'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//Hospital Management API//Appointments//EN\r\n'
+    'CALSCALE:GREGORIAN\r\nMETHOD:PUBLISH\r\n'
+)
+FOOTER = 'END:VCALENDAR\r\n'
+EVENT_FIELDS = ('id', 'date', 'time', 'notes', 'updated_at', 'patient__username')
+# Seconds a build or patch may hold a doctor's lock
+LOCK_SECONDS = 5
+
+
+def get_cache():
+    return caches[settings.CALENDAR_CACHE_ALIAS]
+
+
+def _keys(doctor_id):
+    return {part: f'calendar:{doctor_id}:{part}' for part in ('meta', 'body', 'events', 'lock')}
+
+
+def _escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _fold(line):
+    """Split a content line into lines of at most 75 octets (RFC 5545, 3.1)."""
+    parts, current, size = [], '', 0
+    for char in line:
+        width = len(char.encode())
+        if size + width > 75:
+            parts.append(current)
+            current, size = ' ', 1
+        current += char
+        size += width
+    parts.append(current)
+    return '\r\n'.join(parts) + '\r\n'
+
+
+def _utc(moment):
+    return moment.astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _slot_minutes(windows, day, start_time):
+    """Length of the availability slot starting at `start_time` on `day` (see DoctorCalendar.slot_length)."""
+    minute = start_time.hour * 60 + start_time.minute
+    for window in windows:
+        begin = window.start_time.hour * 60 + window.start_time.minute
+        end = window.end_time.hour * 60 + window.end_time.minute
+        if (
+            window.weekday == day.weekday()
+            and begin <= minute
+            and minute + window.slot_minutes <= end
+            and (minute - begin) % window.slot_minutes == 0
+        ):
+            return window.slot_minutes
+    return DEFAULT_SLOT_MINUTES
+
+
+def render_event(row, windows):
+    """(sort key, VEVENT text) of an appointment row (a dict of EVENT_FIELDS)."""
+    start = timezone.make_aware(datetime.datetime.combine(row['date'], row['time']))
+    end = start + datetime.timedelta(minutes=_slot_minutes(windows, row['date'], row['time']))
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:appointment-{row['id']}@hospital-management-api",
+        f"DTSTAMP:{_utc(row['updated_at'])}",
+        f'DTSTART:{_utc(start)}',
+        f'DTEND:{_utc(end)}',
+        f"SUMMARY:{_escape('Appointment with ' + row['patient__username'])}",
+    ]
+    if row['notes']:
+        lines.append(f"DESCRIPTION:{_escape(row['notes'])}")
+    lines += ['STATUS:CONFIRMED', 'END:VEVENT']
+    return f"{_utc(start)}:{row['id']:020d}", ''.join(_fold(line) for line in lines)
+
+
+def _rows(doctor_id, ids=None):
+    appointments = Appointment.objects.filter(
+        doctor_id=doctor_id, status='confirmed', date__isnull=False, time__isnull=False,
+    )
+    if ids is not None:
+        appointments = appointments.filter(pk__in=ids)
+    return appointments.values(*EVENT_FIELDS)
+
+
+def _version(doctor_id):
+    """(count, latest updated_at) of all the doctor's appointments: changes whenever one is saved or deleted."""
+    version = Appointment.objects.filter(doctor_id=doctor_id).aggregate(count=Count('id'), changed=Max('updated_at'))
+    return version['count'], version['changed']
+
+
+def _windows(doctor_id):
+    return list(DoctorAvailability.objects.filter(doctor__user_id=doctor_id))
+
+
+def _assemble(events, last_modified, version):
+    """(meta, body) of the feed made of `events` ({id: (sort key, text)})."""
+    text = HEADER + ''.join(event for _, event in sorted(events.values())) + FOOTER
+    body = (text.encode(), sorted(events))
+    return (f'"{hashlib.md5(body[0], usedforsecurity=False).hexdigest()}"', last_modified, version), body
+
+
+def _store(doctor_id, events, last_modified, version):
+    """Cache the feed made of `events`; return (meta, body)."""
+    meta, body = _assemble(events, last_modified, version)
+    keys = _keys(doctor_id)
+    get_cache().set_many(
+        {keys['events']: events, keys['body']: body, keys['meta']: meta}, settings.CALENDAR_CACHE_TIMEOUT,
+    )
+    return meta, body
+
+
+def _lock(doctor_id, wait):
+    """Take the doctor's feed lock, waiting up to `wait` seconds; return whether it was taken."""
+    cache, key = get_cache(), _keys(doctor_id)['lock']
+    deadline = time.monotonic() + wait
+    while not cache.add(key, 1, LOCK_SECONDS):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _unlock(doctor_id):
+    get_cache().delete(_keys(doctor_id)['lock'])
+
+
+def build(doctor_id, version=None):
+    """Render the doctor's feed from the database and cache it; return (meta, body)."""
+    # Locked before reading, so a patch for a change committed meanwhile waits and applies on top.
+    locked = _lock(doctor_id, wait=0)
+    try:
+        # The version is read before the rows: a change in between makes the next poll rebuild.
+        version = version or _version(doctor_id)
+        windows = _windows(doctor_id)
+        events = {row['id']: render_event(row, windows) for row in _rows(doctor_id)}
+        last_modified = (version[1] or timezone.now()).timestamp()
+        if not locked:
+            return _assemble(events, last_modified, version)  # a patch is under way: don't cache this build
+        return _store(doctor_id, events, last_modified, version)
+    finally:
+        if locked:
+            _unlock(doctor_id)
+
+
+def refresh(doctor_id, appointment_ids):
+    """Re-render the VEVENTs of `appointment_ids` in the doctor's cached feed (after a commit)."""
+    cache, keys = get_cache(), _keys(doctor_id)
+    if not _lock(doctor_id, wait=LOCK_SECONDS):
+        cache.delete_many([keys['meta'], keys['body'], keys['events']])
+        return
+    try:
+        events = cache.get(keys['events'])
+        if events is None:
+            return  # not cached: the next poll builds it
+        version = _version(doctor_id)
+        rows = list(_rows(doctor_id, appointment_ids))
+        windows = _windows(doctor_id) if rows else []
+        for pk in appointment_ids:
+            events.pop(pk, None)
+        events.update((row['id'], render_event(row, windows)) for row in rows)
+        _store(doctor_id, events, timezone.now().timestamp(), version)
+    finally:
+        _unlock(doctor_id)
+
+
+def schedule_refresh(doctor_id, appointment_ids, using=None):
+    """Patch the doctor's cached feed in a job once the current transaction commits (if CALENDAR_PATCHING)."""
+    if settings.CALENDAR_PATCHING and get_cache().get(_keys(doctor_id)['meta']) is not None:
+        enqueue('calendar-refresh', {'doctor': doctor_id, 'appointments': appointment_ids}, using=using)
+
+
+@job('calendar-refresh', batch=True)
+def refresh_feeds(payloads):
+    """Payloads: {"doctor": user id, "appointments": [ids]}; one patch per doctor."""
+    appointment_ids = defaultdict(set)
+    for payload in payloads:
+        appointment_ids[payload['doctor']].update(payload['appointments'])
+    for doctor_id, ids in appointment_ids.items():
+        refresh(doctor_id, sorted(ids))
+
+
+def feed(request, doctor_id):
+    """(status, headers, body, appointment ids) of a poll: 304 with no body, or 200 with the feed."""
+    cache, keys = get_cache(), _keys(doctor_id)
+    version = _version(doctor_id)
+    meta, body = cache.get(keys['meta']), None
+    if meta is not None and meta[2] == version:
+        if not _modified(request, *meta[:2]):
+            return 304, _headers(*meta[:2]), b'', []
+        body = cache.get(keys['body'])
+    if body is None:
+        meta, body = build(doctor_id, version)
+        if not _modified(request, *meta[:2]):
+            return 304, _headers(*meta[:2]), b'', []
+    return 200, _headers(*meta[:2]), *body
+
+
+def _modified(request, etag, last_modified):
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match != '*' and etag not in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is None or int(last_modified) > if_modified_since
+
+
+def _headers(etag, last_modified):
+    return {'ETag': etag, 'Last-Modified': http_date(last_modified), 'Cache-Control': 'private, no-cache'}
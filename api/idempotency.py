@@ -0,0 +1,98 @@
+"""
+Idempotency keys for create endpoints.
+
+A client that may retry a POST (flaky mobile networks) sends an
+`Idempotency-Key` header. The first request with a key runs the create and
+stores its response in the same transaction; repeats with the same key, user
+and path get that response back (with `Idempotent-Replayed: true`) without
+running the create again. The unique (user, path, key) constraint serializes
+concurrent repeats: the second insert waits for the first transaction and then
+replays its committed response. A request that fails with an error (validation,
+permission, ...) rolls its key back, so the client can fix it and retry.
+
+Keys expire after IDEMPOTENCY_KEY_TTL seconds; `python manage.py
+purge_idempotency_keys` deletes the expired rows.
+"""
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):  # QueryDict from form data
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method} {request.path} {body}'.encode()).hexdigest()
+
+
+def expired_before():
+    return timezone.now() - datetime.timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def purge_expired():
+    """Delete expired keys; return how many."""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expired_before()).delete()
+    return deleted
+
+
+class IdempotentCreateMixin:
+    """Honor the Idempotency-Key header on create() (see module docstring)."""
+
+    def create(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return super().create(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"error": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = _fingerprint(request)
+        lookup = {'user_id': request.user.id, 'path': request.path, 'key': key}
+        with transaction.atomic():
+            record = self._claim(lookup, fingerprint)
+            if record.status_code is not None:
+                return self._replay(record, fingerprint)
+            response = super().create(request, *args, **kwargs)
+            record.status_code = response.status_code
+            record.response = json.loads(JSONRenderer().render(response.data) or 'null')
+            record.save(update_fields=['status_code', 'response'])
+        return response
+
+    @staticmethod
+    def _claim(lookup, fingerprint):
+        """Insert the key (waiting for a concurrent holder to commit), or return its stored response."""
+        for _ in range(2):
+            try:
+                with transaction.atomic():
+                    return IdempotencyKey.objects.create(fingerprint=fingerprint, **lookup)
+            except IntegrityError:
+                record = IdempotencyKey.objects.filter(**lookup).first()
+                if record is None:
+                    continue  # the holder rolled back in the meantime
+                if record.created_at >= expired_before():
+                    return record
+                record.delete()
+        raise IntegrityError(f"Could not claim idempotency key {lookup['key']!r}.")
+
+    @staticmethod
+    def _replay(record, fingerprint):
+        if record.fingerprint != fingerprint:
+            return Response(
+                {"error": f"This {HEADER} was already used for a different request."},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            )
+        return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
@@ -0,0 +1,263 @@
+"""
+Bulk user import for onboarding a hospital.
+
+Rows are streamed from CSV or JSON Lines, passwords are hashed in a process
+pool (hashing dominates the cost of registration), and each batch of `User`
+rows plus their doctor/patient profiles is written with `bulk_create` in one
+transaction. After every committed batch the input position is reported (and
+optionally checkpointed), so an interrupted import can resume where it stopped.
+"""
+import csv
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
+from django.utils.dateparse import parse_date
+
+from .cache import invalidate_directory
+from .models import User, DoctorProfile, PatientProfile
+from .search import index_profiles
+
+MAX_REPORTED_ERRORS = 100
+# Row values imported into text columns
+TEXT_FIELDS = (
+    'username', 'password', 'role', 'email', 'first_name', 'last_name', 'specialty', 'bio', 'date_of_birth',
+    'medical_history',
+)
+
+# Row values stored in length-limited columns -> their max_length
+MAX_LENGTHS = {
+    name: model._meta.get_field(name).max_length
+    for model, names in ((User, ('username', 'email', 'first_name', 'last_name')), (DoctorProfile, ('specialty',)))
+    for name in names
+}
+
+
+class InvalidRow:
+    """An input line that isn't a row (bad JSON); reported as that row's error."""
+
+    def __init__(self, message):
+        self.message = message
+
+
+def read_rows(lines, fmt):
+    """
+    Yield one dict per user from an iterable of text lines in `csv` or `jsonl`
+    format; JSON lines that aren't objects are yielded as InvalidRow.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(lines)
+    elif fmt == 'jsonl':
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as exc:
+                yield InvalidRow(f"Line {number}: invalid JSON ({exc.msg}).")
+                continue
+            yield row if isinstance(row, dict) else InvalidRow(f"Line {number}: expected a JSON object.")
+    else:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+
+class FileCheckpoint:
+    """Persists the number of input rows already committed."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as handle:
+                return json.load(handle)['position']
+        except FileNotFoundError:
+            return 0
+
+    def save(self, position):
+        with open(self.path, 'w') as handle:
+            json.dump({'position': position}, handle)
+
+
+class ImportReport:
+    def __init__(self, start_position):
+        self.position = start_position
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.created / self.elapsed if self.elapsed else 0.0
+
+    def error(self, row_number, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'error': message})
+
+    def as_dict(self):
+        return {
+            'position': self.position,
+            'created': self.created,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def import_users(rows, batch_size=1000, workers=1, start=0, checkpoint=None, on_batch=None):
+    """
+    Import users from `rows` (dicts), skipping the first `start` rows.
+
+    `workers` > 1 hashes passwords in a process pool of that size. `on_batch` is
+    called with the report after each committed batch.
+    """
+    report = ImportReport(start)
+    rows = islice(rows, start, None)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            _import_batch(batch, report, pool)
+            report.position += len(batch)
+            if checkpoint is not None:
+                checkpoint.save(report.position)
+            if on_batch is not None:
+                on_batch(report)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return report
+
+
+def _valid_date(value):
+    try:
+        return parse_date(value) is not None
+    except ValueError:
+        return False
+
+
+def _taken(usernames):
+    return set(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+
+
+def _reject_taken(accepted, taken, report):
+    """Report the `accepted` entries whose username is `taken`; return the others."""
+    for row_number, username, *_ in accepted:
+        if username in taken:
+            report.error(row_number, f"Username already exists: {username}.")
+    return [entry for entry in accepted if entry[1] not in taken]
+
+
+def _import_batch(batch, report, pool):
+    accepted = []
+    seen = set()
+    for offset, row in enumerate(batch):
+        row_number = report.position + offset + 1
+        if isinstance(row, InvalidRow):
+            report.error(row_number, row.message)
+            continue
+        not_text = [name for name in TEXT_FIELDS if row.get(name) is not None and not isinstance(row[name], str)]
+        if not_text:
+            report.error(row_number, f"Expected text for: {', '.join(not_text)}.")
+            continue
+        username = (row.get('username') or '').strip()
+        role = (row.get('role') or '').strip()
+        too_long = [
+            name for name, limit in MAX_LENGTHS.items()
+            if len(username if name == 'username' else row.get(name) or '') > limit
+        ]
+        if too_long:
+            limits = ', '.join(f"{name} (max {MAX_LENGTHS[name]})" for name in too_long)
+            report.error(row_number, f"Too long: {limits}.")
+        elif not username or not row.get('password'):
+            report.error(row_number, "username and password are required.")
+        elif role not in dict(User.ROLES):
+            report.error(row_number, f"Invalid role: {role!r}.")
+        elif row.get('date_of_birth') and not _valid_date(row['date_of_birth']):
+            report.error(row_number, f"Invalid date_of_birth: {row['date_of_birth']!r}.")
+        elif username in seen:
+            report.error(row_number, f"Duplicate username in import: {username}.")
+        else:
+            seen.add(username)
+            accepted.append((row_number, username, role, row))
+
+    accepted = _reject_taken(accepted, _taken(seen), report)
+    if not accepted:
+        return
+
+    passwords = [row['password'] for _, _, _, row in accepted]
+    if pool is not None:
+        hashes = list(pool.map(make_password, passwords, chunksize=max(len(passwords) // 32, 1)))
+    else:
+        hashes = [make_password(password) for password in passwords]
+    accepted = [(*entry, hashed) for entry, hashed in zip(accepted, hashes)]
+
+    while accepted:
+        try:
+            with transaction.atomic():
+                _create_users(accepted)
+        except IntegrityError:
+            # Usernames taken since the check above, by a concurrent import or registration.
+            taken = _taken([entry[1] for entry in accepted])
+            if not taken:
+                raise
+            accepted = _reject_taken(accepted, taken, report)
+        else:
+            report.created += len(accepted)
+            return
+
+
+def _create_users(accepted):
+    """Write the users and profiles of `accepted` (row number, username, role, row, password hash)."""
+    users = [
+        User(
+            username=username,
+            role=role,
+            password=hashed,
+            email=row.get('email') or '',
+            first_name=row.get('first_name') or '',
+            last_name=row.get('last_name') or '',
+        )
+        for _, username, role, row, hashed in accepted
+    ]
+    users = User.objects.bulk_create(users)
+    if any(user.pk is None for user in users):
+        # Backends without RETURNING (MySQL) don't set primary keys on bulk_create.
+        ids = dict(User.objects.filter(username__in=[u.username for u in users]).values_list('username', 'id'))
+        for user in users:
+            user.pk = ids[user.username]
+
+    doctors, patients = [], []
+    for user, (_, _, role, row, _) in zip(users, accepted):
+        if role == 'doctor':
+            doctor = DoctorProfile(user=user, specialty=row.get('specialty') or '', bio=row.get('bio') or None)
+            doctor.search_text = doctor.build_search_text()
+            doctors.append(doctor)
+        else:
+            patients.append(PatientProfile(
+                user=user,
+                date_of_birth=row.get('date_of_birth') or None,
+                medical_history=row.get('medical_history') or None,
+            ))
+    doctors = DoctorProfile.objects.bulk_create(doctors)
+    PatientProfile.objects.bulk_create(patients)
+    if doctors:
+        # bulk_create sends no post_save signals
+        if any(doctor.pk is None for doctor in doctors):
+            ids = dict(DoctorProfile.objects.filter(user__in=[d.user_id for d in doctors]).values_list('user_id', 'id'))
+            for doctor in doctors:
+                doctor.pk = ids[doctor.user_id]
+        index_profiles(doctors)
+        transaction.on_commit(invalidate_directory)
@@ -0,0 +1,186 @@
+"""
+Background jobs for side effects that shouldn't hold up a write (notifications, ...).
+
+A job is a function registered under a name with `@job('name')`, taking a
+JSON-serializable payload. A view hands it work with
+`enqueue('name', payload)`: the job is passed to the JOB_BACKEND when the
+current transaction commits (transaction.on_commit), so a write that rolls back
+enqueues nothing and a job never runs before the rows it reads are committed.
+Outside a transaction it is passed on at once. `enqueue_many` hands over many
+payloads as one insert.
+
+JOB_BACKEND is pluggable (an import path to a class with `push(name, payloads)`):
+
+- DatabaseBackend (default) stores a Job row per job, and `python manage.py
+  run_jobs` workers run them. Workers claim due jobs in batches with
+  SELECT ... FOR UPDATE SKIP LOCKED where the database has it (PostgreSQL), so
+  several workers never claim the same job; on SQLite run a single worker.
+  A claimed job is due again after JOB_LEASE_SECONDS, in case its worker dies.
+- ImmediateBackend runs the jobs in the process that enqueued them, right after
+  the commit, and lets exceptions propagate: for development without a worker.
+
+A job that raises is retried after JOB_RETRY_DELAY * 2 ** (attempt - 1)
+seconds (at most JOB_MAX_RETRY_DELAY), up to its `max_attempts`; it is then
+kept with status 'failed' and its last error for inspection. Jobs run at least
+once, so handlers must tolerate running again.
+
+A job registered with `batch=True` receives the list of payloads of all the
+jobs of its name in a claimed batch instead (e.g. to send many emails over one
+connection); if it raises, all of them are retried, unless it raises
+PartialFailure naming the payloads that failed: only those are retried (its
+transaction is rolled back either way).
+"""
+import datetime
+import logging
+import traceback
+from collections import defaultdict
+from functools import lru_cache, partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+class PartialFailure(Exception):
+    """Raised by a batch task when only some payloads failed: `errors` maps their positions to an error."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} of the batch's payloads failed.")
+        self.errors = errors
+
+
+class Task:
+    def __init__(self, name, func, batch, max_attempts):
+        self.name = name
+        self.func = func
+        self.batch = batch
+        self.max_attempts = max_attempts
+
+
+registry = {}  # job name -> Task
+
+
+def job(name, batch=False, max_attempts=5):
+    """Register the decorated function as the job `name`."""
+    def register(func):
+        registry[name] = Task(name, func, batch, max_attempts)
+        return func
+    return register
+
+
+@lru_cache(maxsize=None)
+def _backend(path):
+    return import_string(path)()
+
+
+def get_backend():
+    return _backend(settings.JOB_BACKEND)
+
+
+def enqueue(name, payload, using=None):
+    """Run job `name` with `payload` once the current transaction commits."""
+    enqueue_many(name, [payload], using=using)
+
+
+def enqueue_many(name, payloads, using=None):
+    """Run job `name` once per payload once the current transaction commits."""
+    if name not in registry:
+        raise LookupError(f"Unknown job {name!r}.")
+    if payloads:
+        transaction.on_commit(partial(get_backend().push, name, list(payloads)), using=using)
+
+
+def run(task, payloads):
+    """Call `task` with `payloads` (all at once for a batch task), each call in its own transaction."""
+    calls = [payloads] if task.batch else payloads
+    for argument in calls:
+        with transaction.atomic():
+            task.func(argument)
+
+
+def retry_delay(attempts):
+    """Seconds before a job that failed its `attempts`-th attempt is due again."""
+    return min(settings.JOB_RETRY_DELAY * 2 ** (attempts - 1), settings.JOB_MAX_RETRY_DELAY)
+
+
+class ImmediateBackend:
+    """Run jobs in-process as soon as they are enqueued (after the commit)."""
+
+    def push(self, name, payloads):
+        run(registry[name], payloads)
+
+
+class DatabaseBackend:
+    """Queue jobs as Job rows for `python manage.py run_jobs`."""
+
+    def push(self, name, payloads):
+        now = timezone.now()
+        Job.objects.bulk_create([Job(name=name, payload=payload, run_at=now) for payload in payloads])
+
+
+def claim(batch_size):
+    """Claim up to `batch_size` due jobs, oldest first, for JOB_LEASE_SECONDS; return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=now)
+            .order_by('run_at', 'id')[:batch_size]
+        )
+        Job.objects.filter(pk__in=[claimed.pk for claimed in jobs]).update(
+            run_at=now + datetime.timedelta(seconds=settings.JOB_LEASE_SECONDS), attempts=F('attempts') + 1,
+        )
+    for claimed in jobs:
+        claimed.attempts += 1
+    return jobs
+
+
+def _failed(jobs, task, error):
+    now = timezone.now()
+    for failed in jobs:
+        failed.last_error = error
+        if task is None or failed.attempts >= task.max_attempts:
+            failed.status = 'failed'
+            logger.error("Job %s %s failed after %s attempts: %s", failed.name, failed.pk, failed.attempts, error)
+        else:
+            failed.run_at = now + datetime.timedelta(seconds=retry_delay(failed.attempts))
+    Job.objects.bulk_update(jobs, ['status', 'run_at', 'last_error'])
+
+
+def run_batch(batch_size=100):
+    """Claim and run a batch of due jobs; return (jobs run, jobs that failed)."""
+    jobs = claim(batch_size)
+    by_name = defaultdict(list)
+    for claimed in jobs:
+        by_name[claimed.name].append(claimed)
+
+    done, failures = [], 0
+    for name, group in by_name.items():
+        task = registry.get(name)
+        if task is None:
+            _failed(group, None, f"Unknown job {name!r}.")
+            failures += len(group)
+            continue
+        for chunk in [group] if task.batch else [[single] for single in group]:
+            try:
+                run(task, [claimed.payload for claimed in chunk])
+            except PartialFailure as error:
+                for position, claimed in enumerate(chunk):
+                    if position in error.errors:
+                        _failed([claimed], task, error.errors[position])
+                        failures += 1
+                    else:
+                        done.append(claimed.pk)
+            except Exception:
+                _failed(chunk, task, traceback.format_exc())
+                failures += len(chunk)
+            else:
+                done.extend(claimed.pk for claimed in chunk)
+    Job.objects.filter(pk__in=done).delete()
+    return len(jobs), failures
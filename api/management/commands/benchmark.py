@@ -0,0 +1,331 @@
+import datetime
+import json
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api import audit
+from api.authentication import ClaimsTokenObtainPairSerializer
+from api.models import User, DoctorProfile, DoctorAvailability, PatientProfile, Appointment, Prescription
+from api.search import index_profiles
+from api.stats import rebuild as rebuild_stats
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+SPECIALTIES = ['Cardiology', 'Dermatology', 'General', 'Neurology', 'Pediatrics']
+STATUSES = ['pending', 'confirmed', 'cancelled', 'completed']
+PASSWORD = 'benchmark-password'
+
+# url name -> role of the client that calls it (None: anonymous)
+ENDPOINTS = {
+    'user-register': None,
+    'user-import': 'admin',
+    'doctor-list': 'patient',
+    'doctor-detail': 'doctor',
+    'doctor-cache-stats': 'admin',
+    'metrics': 'admin',
+    'audit-log': 'admin',
+    'patient-list': 'doctor',
+    'patient-detail': 'patient',
+    'patient-export': 'patient',
+    'available-doctors': 'patient',
+    'doctor-availability': 'doctor',
+    'doctor-slots': 'patient',
+    'specialty-slots': 'patient',
+    'doctor-stats': 'doctor',
+    'doctor-calendar': 'doctor',
+    'appointment-request': 'patient',
+    'appointment-list': 'doctor',
+    'appointment-update': 'doctor',
+    'appointment-bulk-update': 'doctor',
+    'appointment-timeline': 'patient',
+    'prescription-list': 'patient',
+    'prescription-create': 'doctor',
+    'async-doctor-list': 'patient',
+    'async-appointment-list': 'doctor',
+    'async-prescription-list': 'patient',
+    'token_obtain_pair': None,
+    'token_refresh': None,
+}
+
+# Endpoints dominated by password hashing run a tenth as many requests.
+HASHING_ENDPOINTS = {'user-register', 'user-import', 'token_obtain_pair'}
+
+
+def seed_dataset(doctors, patients, appointments, prescriptions):
+    """
+    Bulk-create `bench-` prefixed doctors (with weekday availability), patients,
+    appointments and prescriptions; return the first doctor and patient users.
+    """
+    today = timezone.localdate()
+    doctor_users = User.objects.bulk_create(
+        User(username=f'bench-doctor-{i}', role='doctor', password='!', first_name='Doctor', last_name=str(i))
+        for i in range(doctors)
+    )
+    patient_users = User.objects.bulk_create(
+        User(username=f'bench-patient-{i}', role='patient', password='!') for i in range(patients)
+    )
+    profiles = [
+        DoctorProfile(user=user, specialty=SPECIALTIES[i % len(SPECIALTIES)], bio='Benchmark doctor')
+        for i, user in enumerate(doctor_users)
+    ]
+    for profile in profiles:
+        profile.search_text = profile.build_search_text()
+    profiles = DoctorProfile.objects.bulk_create(profiles)
+    index_profiles(profiles)
+    PatientProfile.objects.bulk_create(PatientProfile(user=user) for user in patient_users)
+    DoctorAvailability.objects.bulk_create(
+        DoctorAvailability(
+            doctor=profile, weekday=weekday, start_time=datetime.time(9), end_time=datetime.time(17),
+        )
+        for profile in profiles for weekday in range(5)
+    )
+
+    count = len(doctor_users)
+    rows = Appointment.objects.bulk_create(
+        Appointment(
+            doctor=doctor_users[n % count],
+            patient=patient_users[n * 7 % len(patient_users)],
+            # Each doctor's appointments fall on distinct days, so confirmed slots never collide.
+            date=today - datetime.timedelta(days=n // count),
+            time=datetime.time(9),
+            status=STATUSES[n // count % len(STATUSES)],
+            notes='Benchmark appointment',
+        )
+        for n in range(appointments)
+    )
+    completed = [appointment for appointment in rows if appointment.status == 'completed']
+    Prescription.objects.bulk_create(
+        Prescription(
+            appointment=appointment, doctor_id=appointment.doctor_id, patient_id=appointment.patient_id,
+            medicine_name='Paracetamol', dosage='500mg', instructions='Twice daily',
+        )
+        for appointment in completed[:prescriptions]
+    )
+    rebuild_stats([user.id for user in doctor_users])
+    return doctor_users[0], patient_users[0]
+
+
+def _percentile(ordered, q):
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a database, call every API route in-process with JWT-authenticated clients and report "
+        "throughput, latency percentiles and query counts; fails on regressions against a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--patients', type=int, default=500)
+        parser.add_argument('--appointments', type=int, default=5000)
+        parser.add_argument('--prescriptions', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=50, help="Measured requests per endpoint.")
+        parser.add_argument('--warmup', type=int, default=3, help="Unmeasured requests per endpoint.")
+        parser.add_argument('--only', nargs='+', metavar='URL_NAME', help="Benchmark only these routes.")
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument('--save-baseline', action='store_true', help="Write the results as the new baseline.")
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help="Allowed p95 latency growth over the baseline, as a fraction (default 0.5).",
+        )
+        parser.add_argument(
+            '--ignore-latency', action='store_true',
+            help="Only compare query counts (for machines unlike the one that recorded the baseline).",
+        )
+        parser.add_argument('--output', help="Also write the results as JSON to this path.")
+
+    def handle(self, *args, **options):
+        missing = self.route_names() - set(ENDPOINTS)
+        if missing:
+            raise CommandError(f"Routes without a benchmark: {', '.join(sorted(missing))}")
+        names = options['only'] or list(ENDPOINTS)
+        unknown = set(names) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f"Unknown routes: {', '.join(sorted(unknown))}")
+        if min(options['doctors'], options['patients'], options['appointments']) < 1:
+            raise CommandError("Need at least one doctor, patient and appointment.")
+
+        # Rate limits would answer the repeated calls with 429s; measure the endpoints themselves. One process
+        # sees all its invalidations, so the directory cache is measured on whatever the cache backend.
+        unthrottled = override_settings(
+            REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {}}, DIRECTORY_CACHE=True,
+        )
+        with unthrottled, transaction.atomic():
+            # Everything is seeded and measured in one transaction that is rolled back.
+            self.seed(options)
+            self.prepare(options)
+            results, errors = {}, []
+            for name in names:
+                count = options['requests']
+                if name in HASHING_ENDPOINTS:
+                    count = max(count // 10, 1)
+                results[name] = self.measure(name, count, options['warmup'], errors)
+            transaction.set_rollback(True)
+
+        self.report(results)
+        if options['output']:
+            self.write_json(options['output'], results)
+        if errors:
+            raise CommandError("Unexpected responses: " + '; '.join(errors))
+        if options['save_baseline']:
+            self.write_json(options['baseline'], results)
+            self.stdout.write(f"Baseline written to {options['baseline']}")
+        elif os.path.exists(options['baseline']):
+            self.compare(results, options)
+
+    @staticmethod
+    def route_names():
+        return {
+            pattern.name for pattern in get_resolver('api.urls').url_patterns if getattr(pattern, 'name', None)
+        }
+
+    # -------------------- fixtures --------------------
+    def seed(self, options):
+        self.doctor, self.patient = seed_dataset(
+            options['doctors'], options['patients'], options['appointments'], options['prescriptions'],
+        )
+
+    def prepare(self, options):
+        """Clients, and the per-request objects that write endpoints consume."""
+        cache.clear()
+        admin = User.objects.create(username='bench-admin', is_staff=True, is_superuser=True)
+        self.doctor.set_password(PASSWORD)
+        self.doctor.save(update_fields=['password'])
+        self.refresh = str(RefreshToken.for_user(self.doctor))
+        self.clients = {None: APIClient(SERVER_NAME='localhost')}
+        for role, user in (('doctor', self.doctor), ('patient', self.patient), ('admin', admin)):
+            client = APIClient(SERVER_NAME='localhost')
+            token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+            client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.clients[role] = client
+
+        self.doctor_profile = self.doctor.doctor_profile
+        self.patient_profile = self.patient.patient_profile
+        self.owned = list(
+            Appointment.objects.filter(doctor_id=self.doctor.id).order_by('-date', '-id').values_list('id', flat=True)[:50]
+        )
+        # One fresh appointment per prescription-create request.
+        self.unprescribed = [
+            appointment.id for appointment in Appointment.objects.bulk_create(
+                Appointment(doctor=self.doctor, patient=self.patient, status='completed')
+                for _ in range(options['requests'] + options['warmup'])
+            )
+        ]
+
+    def build_request(self, name, n):
+        """Return (method, path, data, format) for the n-th call of route `name`."""
+        if name == 'user-register':
+            return 'post', reverse(name), {'username': f'bench-register-{n}', 'password': PASSWORD, 'role': 'patient'}, 'json'
+        if name == 'user-import':
+            rows = ''.join(f'bench-import-{n}-{i},{PASSWORD},patient\n' for i in range(10))
+            upload = SimpleUploadedFile('users.csv', f'username,password,role\n{rows}'.encode())
+            return 'post', reverse(name), {'file': upload}, 'multipart'
+        if name in ('doctor-detail', 'doctor-slots', 'doctor-stats', 'doctor-calendar'):
+            return 'get', reverse(name, args=[self.doctor_profile.pk]), None, None
+        if name in ('patient-detail', 'patient-export'):
+            return 'get', reverse(name, args=[self.patient_profile.pk]), None, None
+        if name in ('available-doctors', 'specialty-slots'):
+            return 'get', reverse(name), {'specialty': self.doctor_profile.specialty}, None
+        if name == 'appointment-request':
+            return 'post', reverse(name), {'doctor': self.doctor_profile.pk, 'notes': 'Benchmark'}, 'json'
+        if name == 'appointment-update':
+            return 'patch', reverse(name, args=[self.owned[0]]), {'status': 'cancelled'}, 'json'
+        if name == 'appointment-bulk-update':
+            return 'post', reverse(name), [{'id': pk, 'status': 'completed'} for pk in self.owned], 'json'
+        if name == 'prescription-create':
+            data = {'appointment': self.unprescribed[n], 'medicine_name': 'Ibuprofen', 'dosage': '200mg', 'instructions': '-'}
+            return 'post', reverse(name), data, 'json'
+        if name == 'audit-log':
+            return 'get', reverse(name), {'patient': self.patient.pk}, None
+        if name == 'token_obtain_pair':
+            return 'post', reverse(name), {'username': self.doctor.username, 'password': PASSWORD}, 'json'
+        if name == 'token_refresh':
+            return 'post', reverse(name), {'refresh': self.refresh}, 'json'
+        return 'get', reverse(name), None, None
+
+    # -------------------- measurement --------------------
+    def measure(self, name, count, warmup, errors):
+        client = self.clients[ENDPOINTS[name]]
+        durations, queries = [], []
+        for n in range(warmup + count):
+            method, path, data, fmt = self.build_request(name, n)
+            kwargs = {'format': fmt} if fmt else {}
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = getattr(client, method)(path, data, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            # Write the request's audit events outside the measurement, as a server's flusher thread does.
+            audit.flush()
+            if response.status_code >= 400:
+                errors.append(f"{name} returned {response.status_code}")
+                break
+            if n >= warmup:
+                durations.append(elapsed)
+                queries.append(len(ctx.captured_queries))
+        if not durations:
+            return None
+        durations.sort()
+        return {
+            'requests': len(durations),
+            'rps': round(len(durations) / sum(durations), 1),
+            'p50_ms': round(_percentile(durations, 0.5) * 1000, 3),
+            'p95_ms': round(_percentile(durations, 0.95) * 1000, 3),
+            'p99_ms': round(_percentile(durations, 0.99) * 1000, 3),
+            'mean_ms': round(statistics.fmean(durations) * 1000, 3),
+            'queries': max(queries),
+        }
+
+    # -------------------- reporting --------------------
+    def report(self, results):
+        header = f"{'endpoint':<26}{'requests':>9}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'queries':>9}"
+        self.stdout.write(header)
+        for name, result in results.items():
+            if result is None:
+                self.stdout.write(f"{name:<26}{'failed':>9}")
+                continue
+            self.stdout.write(
+                f"{name:<26}{result['requests']:>9}{result['rps']:>10}{result['p50_ms']:>10}"
+                f"{result['p95_ms']:>10}{result['p99_ms']:>10}{result['queries']:>9}"
+            )
+
+    @staticmethod
+    def write_json(path, results):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as handle:
+            json.dump(results, handle, indent=2, sort_keys=True)
+            handle.write('\n')
+
+    def compare(self, results, options):
+        with open(options['baseline']) as handle:
+            baseline = json.load(handle)
+        regressions = []
+        for name, result in results.items():
+            expected = baseline.get(name)
+            if result is None:
+                continue
+            if expected is None:
+                regressions.append(f"{name}: not in the baseline")
+                continue
+            if result['queries'] > expected['queries']:
+                regressions.append(f"{name}: {result['queries']} queries (baseline {expected['queries']})")
+            # Sub-millisecond differences are noise, whatever the ratio.
+            limit = max(expected['p95_ms'] * (1 + options['tolerance']), expected['p95_ms'] + 1)
+            if not options['ignore_latency'] and result['p95_ms'] > limit:
+                regressions.append(f"{name}: p95 {result['p95_ms']} ms (baseline {expected['p95_ms']} ms)")
+        if regressions:
+            raise CommandError("Regressions against baseline: " + '; '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f"No regressions against {options['baseline']}"))
@@ -0,0 +1,122 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from api.authentication import ClaimsTokenObtainPairSerializer, clear_user_state
+from api.models import User
+
+from .benchmark import _percentile, seed_dataset
+
+# (sync url name, async url name, role of the caller)
+PAIRS = [
+    ('doctor-list', 'async-doctor-list', 'patient'),
+    ('appointment-list', 'async-appointment-list', 'doctor'),
+    ('prescription-list', 'async-prescription-list', 'patient'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the sync list views (one thread per in-flight request, like threaded gunicorn workers) "
+        "with their async variants (one event loop, like an ASGI worker) at the same concurrency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=20)
+        parser.add_argument('--patients', type=int, default=200)
+        parser.add_argument('--appointments', type=int, default=2000)
+        parser.add_argument('--prescriptions', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50, help="Requests in flight at once.")
+        parser.add_argument('--requests', type=int, default=500, help="Requests per endpoint and mode.")
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith='bench-').exists():
+            raise CommandError("Benchmark users (bench-*) already exist; remove them first.")
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError("--concurrency and --requests must be positive.")
+
+        # Requests run on other threads/connections, so the dataset is committed and deleted afterwards.
+        doctor, patient = seed_dataset(
+            options['doctors'], options['patients'], options['appointments'], options['prescriptions'],
+        )
+        try:
+            tokens = {
+                role: str(ClaimsTokenObtainPairSerializer.get_token(user).access_token)
+                for role, user in (('doctor', doctor), ('patient', patient))
+            }
+            # Both modes authenticate from token claims, so they differ only in how they wait on I/O.
+            with override_settings(JWT_CLAIMS_AUTH=True, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+                clear_user_state()
+                rows = []
+                for sync_name, async_name, role in PAIRS:
+                    rows.append(('sync', sync_name, self.run_sync(reverse(sync_name), tokens[role], options)))
+                    rows.append(('async', async_name, self.run_async(reverse(async_name), tokens[role], options)))
+        finally:
+            User.objects.filter(username__startswith='bench-').delete()
+            cache.clear()
+
+        self.stdout.write(f"concurrency {options['concurrency']}, {options['requests']} requests per endpoint")
+        self.stdout.write(f"{'mode':<7}{'endpoint':<26}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        for mode, name, (seconds, durations) in rows:
+            self.stdout.write(
+                f"{mode:<7}{name:<26}{len(durations) / seconds:>10.1f}"
+                f"{_percentile(durations, 0.5) * 1000:>10.2f}{_percentile(durations, 0.99) * 1000:>10.2f}"
+            )
+
+    @staticmethod
+    def shares(options):
+        """Split the requests over the concurrent workers."""
+        concurrency, total = options['concurrency'], options['requests']
+        return [total // concurrency + (1 if n < total % concurrency else 0) for n in range(concurrency)]
+
+    def run_sync(self, path, token, options):
+        headers = {'Authorization': f'Bearer {token}'}
+
+        def worker(count):
+            client = Client()
+            durations = []
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                durations.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f"{path} returned {response.status_code}: {response.content[:200]}")
+            connections.close_all()
+            return durations
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(worker, self.shares(options)))
+        return time.perf_counter() - started, sorted(d for durations in results for d in durations)
+
+    def run_async(self, path, token, options):
+        headers = {'Authorization': f'Bearer {token}'}
+
+        async def worker(client, count):
+            durations = []
+            for _ in range(count):
+                started = time.perf_counter()
+                response = await client.get(path, headers=headers)
+                durations.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f"{path} returned {response.status_code}: {response.content[:200]}")
+            return durations
+
+        async def main():
+            client = AsyncClient()
+            started = time.perf_counter()
+            results = await asyncio.gather(*(worker(client, count) for count in self.shares(options)))
+            elapsed = time.perf_counter() - started
+            await sync_to_async(connections.close_all)()
+            return elapsed, sorted(d for durations in results for d in durations)
+
+        with override_settings(MIDDLEWARE=settings.ASGI_MIDDLEWARE):
+            return asyncio.run(main())
@@ -0,0 +1,109 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from api import audit
+from api.models import AuditEvent
+
+from .benchmark import _percentile, seed_dataset
+
+# (url name, role of the caller)
+ENDPOINTS = [
+    ('appointment-list', 'doctor'),
+    ('prescription-list', 'doctor'),
+    ('patient-list', 'doctor'),
+    ('patient-detail', 'patient'),
+]
+# off: no audit log; buffered: events are buffered and written in batches afterwards (by the
+# flusher thread in a server); synchronous: each request writes its events before returning
+MODES = ('off', 'buffered', 'synchronous')
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the audit log's overhead per request: each audited endpoint without the audit log, "
+        "with buffered batch writes (the default) and with one write per request."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=10)
+        parser.add_argument('--patients', type=int, default=100)
+        parser.add_argument('--appointments', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=200, help="Requests per endpoint and mode.")
+        parser.add_argument('--warmup', type=int, default=10, help="Unmeasured requests per endpoint.")
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.AUDIT_BUFFER_SIZE,
+            help="Events (one per request) written per batch in buffered mode.",
+        )
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--requests and --batch-size must be positive.")
+
+        audit.flush()
+        with transaction.atomic():
+            # Seeded, measured and rolled back in one transaction.
+            doctor, patient = seed_dataset(
+                options['doctors'], options['patients'], options['appointments'], options['appointments'] // 4,
+            )
+            clients = {}
+            for role, user in (('doctor', doctor), ('patient', patient)):
+                clients[role] = APIClient(SERVER_NAME='localhost')
+                clients[role].force_authenticate(user)
+            paths = {
+                name: reverse(name, args=[patient.patient_profile.pk] if name == 'patient-detail' else [])
+                for name, _ in ENDPOINTS
+            }
+
+            rows = []
+            for name, role in ENDPOINTS:
+                with override_settings(AUDIT_LOG=False):
+                    for _ in range(options['warmup']):
+                        clients[role].get(paths[name])
+                for mode in MODES:
+                    rows.append((name, mode, self.measure(clients[role], paths[name], mode, options)))
+            events = AuditEvent.objects.count()
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{options['requests']} requests per endpoint and mode, {events} audit rows written")
+        self.stdout.write("Request latency as clients see it; batch writes (buffered mode) are reported per request apart.")
+        self.stdout.write(
+            f"{'endpoint':<20}{'mode':<13}{'p50 ms':>9}{'p95 ms':>9}{'+p50 ms':>9}{'queries':>9}{'batch ms':>10}"
+        )
+        baseline = {}
+        for name, mode, (durations, queries, batch_seconds) in rows:
+            p50 = _percentile(durations, 0.5)
+            baseline.setdefault(name, p50)
+            self.stdout.write(
+                f"{name:<20}{mode:<13}{p50 * 1000:>9.3f}{_percentile(durations, 0.95) * 1000:>9.3f}"
+                f"{(p50 - baseline[name]) * 1000:>+9.3f}{queries:>9.2f}{batch_seconds * 1000:>10.3f}"
+            )
+
+    def measure(self, client, path, mode, options):
+        """
+        Sorted seconds per request, queries per request, and seconds of batch
+        writes per request (buffered mode).
+        """
+        durations, queries, batch_seconds = [], 0, 0.0
+        # Batches are flushed here, never by record() filling the buffer during a request.
+        with override_settings(AUDIT_LOG=mode != 'off', AUDIT_BUFFER_SIZE=options['requests'] + 1):
+            for n in range(options['requests']):
+                with CaptureQueriesContext(connection) as ctx:
+                    started = time.perf_counter()
+                    response = client.get(path)
+                    if mode == 'synchronous':
+                        audit.flush()
+                    durations.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f"{path} returned {response.status_code}")
+                queries += len(ctx.captured_queries)
+                if mode == 'buffered' and ((n + 1) % options['batch_size'] == 0 or n + 1 == options['requests']):
+                    started = time.perf_counter()
+                    audit.flush()
+                    batch_seconds += time.perf_counter() - started
+        return sorted(durations), queries / options['requests'], batch_seconds / options['requests']
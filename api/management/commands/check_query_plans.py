@@ -0,0 +1,161 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import views
+from api.sync import decode_token
+from api.models import User, DoctorProfile, PatientProfile, Appointment, Prescription
+
+
+# (label, view, role of the requesting user, query params, detail lookup)
+# Unfiltered directory lists (doctor-list, patient-list, available-doctors) read the
+# whole table by design and are deliberately not part of this check.
+HOT_PATHS = [
+    ('appointment-list (doctor)', views.AppointmentListView, 'doctor', {}, False),
+    ('appointment-list (patient)', views.AppointmentListView, 'patient', {}, False),
+    ('appointment-list pending queue', views.AppointmentListView, 'doctor', {'status': 'pending'}, False),
+    ('appointment-update lookup', views.AppointmentUpdateView, 'doctor', {}, True),
+    ('appointment-timeline (patient)', views.AppointmentTimelineView, 'patient', {}, False),
+    ('prescription-list (doctor)', views.PrescriptionListView, 'doctor', {}, False),
+    ('prescription-list (patient)', views.PrescriptionListView, 'patient', {}, False),
+    ('appointment-list delta sync (doctor)', views.AppointmentListView, 'doctor', {'since': ''}, False),
+    ('appointment-list delta sync (patient)', views.AppointmentListView, 'patient', {'since': ''}, False),
+    ('prescription-list delta sync (doctor)', views.PrescriptionListView, 'doctor', {'since': ''}, False),
+    ('prescription-list delta sync (patient)', views.PrescriptionListView, 'patient', {'since': ''}, False),
+    ('doctor-detail', views.DoctorProfileDetailView, 'doctor', {}, True),
+    ('patient-detail', views.PatientProfileDetailView, 'patient', {}, True),
+]
+
+# Paths meant to read every row they may reach; these may scan a whole covering index.
+UNBOUNDED_PATHS = frozenset()
+
+# (problem, pattern) of EXPLAIN output that means a query reads or sorts more rows than it returns
+PLAN_PROBLEMS = {
+    'sqlite': [
+        # "SEARCH t USING ..." looks rows up; "SCAN t" reads the whole table and "SCAN t USING INDEX" the whole index.
+        ('full table scan', re.compile(r'\bSCAN \S+$', re.MULTILINE)),
+        ('full index scan', re.compile(r'\bSCAN \S+ USING (?!COVERING INDEX)')),
+        ('full covering index scan', re.compile(r'\bSCAN \S+ USING COVERING INDEX')),
+        ('sort', re.compile(r'\bUSE TEMP B-TREE\b')),
+    ],
+    'postgresql': [
+        ('full table scan', re.compile(r'\bSeq Scan on\b')),
+        ('sort', re.compile(r'(?:^|->)\s*Sort\s+\(', re.MULTILINE)),
+    ],
+}
+COVERING_SCAN = 'full covering index scan'
+
+
+def _postgres_index_scans(plan):
+    """Problems of the index scans in a text EXPLAIN: one without an Index Cond reads the whole index."""
+    nodes = []  # [kind of scan or None, has an Index Cond]
+    for line in plan.splitlines():
+        if '->' in line or not nodes:
+            match = re.search(r'\b(Index Only Scan|Index Scan)(?: Backward)? using\b', line)
+            nodes.append([match and match.group(1), False])
+        elif 'Index Cond:' in line:
+            nodes[-1][1] = True
+    return [
+        COVERING_SCAN if kind == 'Index Only Scan' else 'full index scan'
+        for kind, conditioned in nodes if kind and not conditioned
+    ]
+
+
+def plan_problems(plan, vendor, unbounded=False):
+    """What's wrong with an EXPLAIN `plan`; `unbounded` queries may scan a whole covering index."""
+    problems = [problem for problem, pattern in PLAN_PROBLEMS[vendor] if pattern.search(plan)]
+    if vendor == 'postgresql':
+        problems += _postgres_index_scans(plan)
+    return sorted({problem for problem in problems if not (unbounded and problem == COVERING_SCAN)})
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN every hot-path view queryset and fail if any of them scans a whole table or index, or sorts."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help="Seed this many doctors and patients (5 appointments each) and roll them back afterwards.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in PLAN_PROBLEMS:
+            raise CommandError(f"Unsupported database backend: {connection.vendor}")
+
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            if connection.vendor == 'postgresql':
+                # Tiny tables always favour a seq scan; force the planner to show its best index path.
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            failures = self.check_paths()
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(f"Unindexed reads on: {', '.join(failures)}")
+        self.stdout.write(self.style.SUCCESS(f"All {len(HOT_PATHS)} hot paths use an index."))
+
+    def check_paths(self):
+        doctor = User.objects.filter(role='doctor', doctor_profile__isnull=False).first()
+        patient = User.objects.filter(role='patient', patient_profile__isnull=False).first()
+        if doctor is None or patient is None:
+            raise CommandError("Need at least one doctor and one patient; run with --seed.")
+        users = {'doctor': doctor, 'patient': patient}
+        lookups = {
+            views.AppointmentUpdateView: Appointment.objects.filter(doctor=doctor).values_list('pk', flat=True).first() or 0,
+            views.DoctorProfileDetailView: doctor.doctor_profile.pk,
+            views.PatientProfileDetailView: patient.patient_profile.pk,
+        }
+
+        failures = []
+        for label, view_class, role, params, detail in HOT_PATHS:
+            queryset = self.view_queryset(view_class, users[role], params, lookups.get(view_class) if detail else None)
+            plan = queryset.explain()
+            problems = plan_problems(plan, connection.vendor, unbounded=label in UNBOUNDED_PATHS)
+            if problems:
+                failures.append(f"{label} ({', '.join(problems)})")
+            status = self.style.ERROR(', '.join(problems).upper()) if problems else self.style.SUCCESS('ok')
+            self.stdout.write(f"{label}: {status}")
+            for line in plan.splitlines():
+                self.stdout.write(f"    {line}")
+        return failures
+
+    def view_queryset(self, view_class, user, params, pk=None):
+        """Build the exact queryset the view would run for `user`."""
+        request = Request(APIRequestFactory().get('/', params, SERVER_NAME='localhost'))
+        request.user = user
+        view = view_class(request=request, args=(), kwargs={}, format_kwarg=None)
+        queryset = view.filter_queryset(view.get_queryset())
+        if pk is not None:
+            return queryset.filter(pk=pk)
+        if 'since' in params:
+            return view.get_feed_queryset(decode_token(params['since']), timezone.now())
+        if view.paginator is not None:
+            return view.paginator.get_page_queryset(queryset, request)
+        return queryset
+
+    def seed(self, count):
+        doctors = User.objects.bulk_create(
+            User(username=f'plan-doctor-{i}', role='doctor', password='!') for i in range(count)
+        )
+        patients = User.objects.bulk_create(
+            User(username=f'plan-patient-{i}', role='patient', password='!') for i in range(count)
+        )
+        DoctorProfile.objects.bulk_create(DoctorProfile(user=user, specialty='General') for user in doctors)
+        PatientProfile.objects.bulk_create(PatientProfile(user=user) for user in patients)
+        appointments = Appointment.objects.bulk_create(
+            Appointment(doctor=doctor, patient=patients[(i + n) % count], status='confirmed')
+            for i, doctor in enumerate(doctors) for n in range(5)
+        )
+        Prescription.objects.bulk_create(
+            Prescription(
+                appointment=appointment, doctor_id=appointment.doctor_id, patient_id=appointment.patient_id,
+                medicine_name='Seed', dosage='1', instructions='-',
+            )
+            for appointment in appointments
+        )
@@ -0,0 +1,61 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.importer import FileCheckpoint, import_users, read_rows
+
+
+class Command(BaseCommand):
+    help = "Bulk-import users (and their doctor/patient profiles) from a CSV or JSON Lines file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or - for stdin.")
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help="Defaults to the file extension.")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="Processes used to hash passwords (1 hashes in-process).",
+        )
+        parser.add_argument('--checkpoint', help="File recording how many input rows are committed.")
+        parser.add_argument('--resume', action='store_true', help="Skip the rows recorded in --checkpoint.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'jsonl'):
+            raise CommandError("Cannot infer the format; pass --format csv or --format jsonl.")
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError("--resume requires --checkpoint.")
+
+        checkpoint = FileCheckpoint(options['checkpoint']) if options['checkpoint'] else None
+        start = checkpoint.load() if options['resume'] else 0
+        if start:
+            self.stdout.write(f"Resuming after row {start}.")
+
+        def progress(report):
+            self.stdout.write(
+                f"{report.position} rows read, {report.created} created, {report.skipped} skipped "
+                f"({report.rows_per_second:.0f} rows/sec)"
+            )
+
+        handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            report = import_users(
+                read_rows(handle, fmt),
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                start=start,
+                checkpoint=checkpoint,
+                on_batch=progress,
+            )
+        finally:
+            if handle is not sys.stdin:
+                handle.close()
+
+        for error in report.errors:
+            self.stderr.write(f"row {error['row']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.created} users in {report.elapsed:.1f}s "
+            f"({report.rows_per_second:.0f} rows/sec); {report.skipped} skipped."
+        ))
@@ -0,0 +1,89 @@
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+MANAGE_PY = os.path.join(settings.BASE_DIR, 'manage.py')
+
+# stage -> command run in a fresh interpreter; each stage includes the ones before it
+STAGES = {
+    'interpreter': [sys.executable, '-c', 'pass'],
+    'settings': [sys.executable, '-c', 'import django.conf as c; c.settings.INSTALLED_APPS'],
+    'django.setup': [sys.executable, '-c', 'import django; django.setup()'],
+    'wsgi': [sys.executable, '-c', 'import hospital_management.wsgi'],
+    'manage.py check': [sys.executable, MANAGE_PY, 'check'],
+}
+# Stage held to --budget
+BUDGET_STAGE = 'wsgi'
+DEFAULT_BUDGET = 2.0
+
+
+def _environ():
+    return {**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE}
+
+
+def measure(command, runs):
+    """Median wall-clock seconds of `command` in a fresh process."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(
+            command, env=_environ(), cwd=settings.BASE_DIR, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def import_breakdown(command):
+    """Seconds spent importing each top-level package's own modules, from `python -X importtime`."""
+    result = subprocess.run(
+        [command[0], '-X', 'importtime', *command[1:]], env=_environ(), cwd=settings.BASE_DIR, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    packages = Counter()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        if own.strip().isdigit():  # not the header
+            packages[name.strip().split('.')[0]] += int(own) / 1_000_000
+    return packages
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure start-up time: the median wall-clock time of each start-up stage in a fresh "
+        "interpreter, and the import time of the packages the WSGI application loads."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5)
+        parser.add_argument('--top', type=int, default=15, help="Packages listed in the import breakdown.")
+        parser.add_argument(
+            '--budget', type=float, default=None,
+            help=f"Fail if the '{BUDGET_STAGE}' stage takes longer (seconds, e.g. {DEFAULT_BUDGET}).",
+        )
+
+    def handle(self, *args, **options):
+        timings = {stage: measure(command, options['runs']) for stage, command in STAGES.items()}
+        self.stdout.write(f"{'stage':<18}{'median ms':>10}")
+        for stage, seconds in timings.items():
+            self.stdout.write(f"{stage:<18}{seconds * 1000:>10.1f}")
+
+        self.stdout.write(f"\nImport time of {BUDGET_STAGE} by package:")
+        for package, seconds in import_breakdown(STAGES[BUDGET_STAGE]).most_common(options['top']):
+            self.stdout.write(f"{package:<28}{seconds * 1000:>8.1f} ms")
+
+        budget = options['budget']
+        if budget is not None:
+            if timings[BUDGET_STAGE] > budget:
+                raise CommandError(
+                    f"Start-up budget exceeded: {BUDGET_STAGE} took {timings[BUDGET_STAGE]:.2f}s (budget {budget:.2f}s)."
+                )
+            self.stdout.write(self.style.SUCCESS(f"\n{BUDGET_STAGE} within its {budget:.2f}s budget."))
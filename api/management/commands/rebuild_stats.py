@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-doctor daily appointment counters (DoctorDailyStats) from the appointments."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--doctor', type=int, action='append', dest='doctors',
+            help="User id of a doctor to rebuild (repeatable); all doctors by default.",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows = rebuild(options['doctors'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} daily stats rows."))
@@ -0,0 +1,38 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import run_batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued background jobs (api/jobs.py) in batches until stopped; SIGTERM or Ctrl-C stops "
+        "after the current batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Jobs claimed at a time.")
+        parser.add_argument('--sleep', type=float, default=1.0, help="Seconds to wait when no job is due.")
+        parser.add_argument('--once', action='store_true', help="Run the jobs due now, then exit.")
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        handlers = {signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        ran = failed = 0
+        try:
+            while not self.stopping:
+                count, failures = run_batch(options['batch_size'])
+                ran, failed = ran + count, failed + failures
+                if count < options['batch_size']:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(f"Ran {ran} jobs, {failed} failed."))
+
+    def stop(self, signum, frame):
+        self.stopping = True
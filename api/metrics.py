@@ -0,0 +1,129 @@
+"""
+In-process request metrics.
+
+`RequestMetricsMiddleware` records, for a sample of requests, the wall time,
+database query count and time, serializer time, render time and response size,
+keyed by the URL name of the matched route. Each series keeps a count, a sum and
+a fixed-size uniform reservoir (Vitter's algorithm R) from which p50/p95/p99 are
+estimated, so memory stays bounded however long the process runs. Counters are
+per process; scrape every worker or run a single one when benchmarking.
+"""
+import random
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+from .cache import stats as directory_cache_stats
+from .throttling import stats as throttle_stats
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# (series, Prometheus metric name, help text)
+SERIES = [
+    ('wall', 'api_request_duration_seconds', "Wall time of the request."),
+    ('db_queries', 'api_request_db_queries', "Database queries executed by the request."),
+    ('db', 'api_request_db_duration_seconds', "Time spent executing database queries."),
+    ('serializer', 'api_request_serializer_duration_seconds',
+     "Time in the view outside the database (serialization and business logic)."),
+    ('render', 'api_request_render_duration_seconds', "Time spent rendering the response body."),
+    ('size', 'api_response_size_bytes', "Size of the response body (non-streaming responses only)."),
+]
+
+
+class Reservoir:
+    """Count, sum and a bounded uniform sample of observed values."""
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            index = random.randrange(self.count)
+            if index < self.size:
+                self.samples[index] = value
+
+    def quantiles(self, quantiles=QUANTILES):
+        ordered = sorted(self.samples)
+        if not ordered:
+            return [(q, 0.0) for q in quantiles]
+        return [(q, ordered[min(int(q * len(ordered)), len(ordered) - 1)]) for q in quantiles]
+
+
+_lock = threading.Lock()
+_views = defaultdict(dict)  # url name -> {series: Reservoir}
+
+
+def sample_rate():
+    return settings.REQUEST_METRICS_SAMPLE_RATE
+
+
+def record(view, **values):
+    """Add one request's measurements (keyword per series name) to `view`'s series."""
+    with _lock:
+        series = _views[view]
+        for name, value in values.items():
+            if value is None:
+                continue
+            if name not in series:
+                series[name] = Reservoir(settings.REQUEST_METRICS_RESERVOIR_SIZE)
+            series[name].add(value)
+
+
+def snapshot():
+    """{url name: {series: {'count', 'sum', 'p50', 'p95', 'p99'}}} for every recorded view."""
+    with _lock:
+        result = {}
+        for view, series in _views.items():
+            result[view] = {}
+            for name, reservoir in series.items():
+                entry = {'count': reservoir.count, 'sum': reservoir.total}
+                for q, value in reservoir.quantiles():
+                    entry[f'p{round(q * 100)}'] = value
+                result[view][name] = entry
+        return result
+
+
+def reset():
+    with _lock:
+        _views.clear()
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Render every series (as summaries), the directory cache and the throttle counters in Prometheus text format."""
+    views = snapshot()
+    lines = []
+    for name, metric, help_text in SERIES:
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} summary')
+        for view in sorted(views):
+            entry = views[view].get(name)
+            if entry is None:
+                continue
+            for q in QUANTILES:
+                lines.append(f'{metric}{{view="{view}",quantile="{q}"}} {_format(entry[f"p{round(q * 100)}"])}')
+            lines.append(f'{metric}_sum{{view="{view}"}} {_format(entry["sum"])}')
+            lines.append(f'{metric}_count{{view="{view}"}} {entry["count"]}')
+
+    lines.append('# HELP api_directory_cache_events_total Doctor directory cache events in this process.')
+    lines.append('# TYPE api_directory_cache_events_total counter')
+    for event, value in sorted(dict(directory_cache_stats).items()):
+        lines.append(f'api_directory_cache_events_total{{event="{event}"}} {value}')
+
+    # decided: "local" when the worker already knew the bucket was empty, "shared" after reading the cache
+    lines.append('# HELP api_throttled_requests_total Requests rejected by a throttle bucket in this process.')
+    lines.append('# TYPE api_throttled_requests_total counter')
+    for (bucket, decided), value in sorted(dict(throttle_stats).items()):
+        lines.append(f'api_throttled_requests_total{{bucket="{bucket}",decided="{decided}"}} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,157 @@
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.permissions import SAFE_METHODS
+
+from . import metrics
+from .routers import apin_to_primary, pin_to_primary
+
+
+class _Sample:
+    """Measurements of one sampled request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.view_started = None
+        self.view_finished = None
+        self.render_started = None
+        self.render_finished = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook: time every query of the request.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class RequestMetricsMiddleware:
+    """
+    Record request cost per URL name (see api/metrics.py).
+
+    Only a REQUEST_METRICS_SAMPLE_RATE fraction of requests is measured; at the
+    default of 0 the middleware is a single settings lookup per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rate = metrics.sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return self.get_response(request)
+
+        sample = request._metrics_sample = _Sample()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(sample))
+            response = self.get_response(request)
+        wall = time.perf_counter() - started
+
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            view_seconds = (sample.view_finished or started + wall) - (sample.view_started or started)
+            render_seconds = None
+            if sample.render_started is not None and sample.render_finished is not None:
+                render_seconds = sample.render_finished - sample.render_started
+            metrics.record(
+                match.url_name,
+                wall=wall,
+                db_queries=sample.queries,
+                db=sample.db_seconds,
+                serializer=max(view_seconds - sample.db_seconds, 0.0),
+                render=render_seconds,
+                size=None if response.streaming else len(response.content),
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        sample = getattr(request, '_metrics_sample', None)
+        if sample is not None:
+            sample.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook; time the render with a callback.
+        sample = getattr(request, '_metrics_sample', None)
+        if sample is not None:
+            sample.view_finished = sample.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: setattr(sample, 'render_finished', time.perf_counter()))
+        return response
+
+
+class AsyncRequestMetricsMiddleware:
+    """
+    RequestMetricsMiddleware for the ASGI stack: records wall time and response size only.
+
+    Async views run their queries on a worker thread whose connections the
+    execute_wrapper hook can't reach, and view/render hooks would each cost a
+    thread switch, so database, serializer and render series stay sync-only.
+    """
+    sync_capable = False
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        markcoroutinefunction(self)
+
+    async def __call__(self, request):
+        rate = metrics.sample_rate()
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        wall = time.perf_counter() - started
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            metrics.record(match.url_name, wall=wall, size=None if response.streaming else len(response.content))
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Pin users to the primary database after their own writes (see api/routers.py).
+
+    Runs after the view, when DRF has set request.user from the token.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        response = self.get_response(request)
+        user_id = self.writer(request, response)
+        if user_id is not None:
+            pin_to_primary(user_id)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        user_id = self.writer(request, response)
+        if user_id is not None:
+            await apin_to_primary(user_id)
+        return response
+
+    @staticmethod
+    def writer(request, response):
+        """Id of the user who just wrote through `request`, if any."""
+        if request.method in SAFE_METHODS or response.status_code >= 400 or not settings.DATABASE_REPLICAS:
+            return None
+        user = getattr(request, 'user', None)
+        return user.id if user is not None and user.is_authenticated else None
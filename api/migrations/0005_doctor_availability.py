@@ -0,0 +1,44 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_appointment_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekday', models.PositiveSmallIntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('start_time', models.TimeField()),
+                ('end_time', models.TimeField()),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=30)),
+            ],
+            options={
+                'ordering': ['weekday', 'start_time'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'confirmed')), fields=('doctor', 'date', 'time'), name='unique_confirmed_slot'),
+        ),
+        migrations.AddField(
+            model_name='doctoravailability',
+            name='doctor',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability', to='api.doctorprofile'),
+        ),
+        migrations.AddConstraint(
+            model_name='doctoravailability',
+            constraint=models.CheckConstraint(condition=models.Q(('end_time__gt', models.F('start_time'))), name='availability_end_after_start'),
+        ),
+        migrations.AddConstraint(
+            model_name='doctoravailability',
+            constraint=models.CheckConstraint(condition=models.Q(('slot_minutes__gt', 0)), name='availability_slot_positive'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.6 on 2026-10-18 05:09
+
+import taggit.managers
+from django.db import migrations, models
+
+
+def build_search_index(apps, schema_editor):
+    DoctorProfile = apps.get_model('api', 'DoctorProfile')
+    profiles = list(DoctorProfile.objects.select_related('user'))
+    for profile in profiles:
+        user = profile.user
+        parts = [user.first_name, user.last_name, user.username, profile.specialty, profile.bio]
+        profile.search_text = ' '.join(part for part in parts if part)
+    DoctorProfile.objects.bulk_update(profiles, ['search_text'], batch_size=1000)
+
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('CREATE VIRTUAL TABLE api_doctor_search USING fts5(search_text)')
+        schema_editor.execute(
+            'INSERT INTO api_doctor_search (rowid, search_text) SELECT id, search_text FROM api_doctorprofile'
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX doctor_search_gin ON api_doctorprofile USING gin (to_tsvector('simple', search_text))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS api_doctor_search')
+    elif vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS doctor_search_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_doctor_availability'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='tags',
+            field=taggit.managers.TaggableManager(blank=True, help_text='A comma-separated list of tags.', through='taggit.TaggedItem', to='taggit.Tag', verbose_name='Tags'),
+        ),
+        migrations.AddIndex(
+            model_name='doctorprofile',
+            index=models.Index(fields=['specialty'], name='doctor_specialty_idx'),
+        ),
+        migrations.RunPython(build_search_index, drop_search_index),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:40
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import Coalesce, TruncDate
+
+STATUSES = ('pending', 'confirmed', 'cancelled', 'completed')
+
+
+def build_daily_stats(apps, schema_editor):
+    Appointment = apps.get_model('api', 'Appointment')
+    DoctorDailyStats = apps.get_model('api', 'DoctorDailyStats')
+    counts = (
+        Appointment.objects.annotate(day=Coalesce('date', TruncDate('created_at')))
+        .values('doctor_id', 'day')
+        .annotate(**{status: Count('id', filter=Q(status=status)) for status in STATUSES})
+        .order_by()
+    )
+    DoctorDailyStats.objects.bulk_create((DoctorDailyStats(**row) for row in counts), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_doctor_directory_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='DoctorDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('pending', models.IntegerField(default=0)),
+                ('confirmed', models.IntegerField(default=0)),
+                ('cancelled', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'day'), name='unique_doctor_stats_day')],
+            },
+        ),
+        migrations.RunPython(build_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuditEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.PositiveIntegerField()),
+                ('at', models.DateTimeField()),
+                ('actor_id', models.BigIntegerField()),
+                ('patient_id', models.BigIntegerField(null=True)),
+                ('kind', models.CharField(choices=[('patient', 'Patient profile'), ('appointment', 'Appointment'), ('prescription', 'Prescription')], max_length=12)),
+                ('action', models.CharField(choices=[('read', 'Read'), ('create', 'Create'), ('update', 'Update'), ('export', 'Export')], max_length=6)),
+                ('object_ids', models.JSONField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['month', 'patient_id', 'at'], name='audit_patient_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.6 on 2026-10-18 08:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_owners(apps, schema_editor):
+    Appointment = apps.get_model('api', 'Appointment')
+    appointment = Appointment.objects.filter(pk=OuterRef('appointment_id'))
+    apps.get_model('api', 'Prescription').objects.update(
+        doctor_id=Subquery(appointment.values('doctor_id')),
+        patient_id=Subquery(appointment.values('patient_id')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_audit_event'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prescription',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prescriptions_as_doctor', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='prescription',
+            name='patient',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='prescriptions_as_patient', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_owners, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='prescription',
+            name='doctor',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='prescriptions_as_doctor', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='prescription',
+            name='patient',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='prescriptions_as_patient', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RemoveIndex(
+            model_name='prescription',
+            name='rx_issued_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='prescription',
+            name='rx_updated_idx',
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['doctor', '-issued_at', '-id'], name='rx_doctor_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient', '-issued_at', '-id'], name='rx_patient_issued_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['doctor', 'updated_at', 'id'], name='rx_doctor_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient', 'updated_at', 'id'], name='rx_patient_updated_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from taggit.managers import TaggableManager
 
 
 # Custom: User Model extending Django's AbstractUser, with roles for doctor and patient.
@@ -10,8 +11,16 @@ class User(AbstractUser):
     )
     role = models.CharField(max_length=10, choices=ROLES)
 
+    # __str__ is format_str over these fields, so list responses can render it
+    # from .values() rows (api/row_serializers.py)
+    str_fields = ('username', 'role')
+
+    @staticmethod
+    def format_str(username, role):
+        return f"{username} ({role})"
+
     def __str__(self):
-        return f"{self.username} ({self.role})"
+        return self.format_str(*(getattr(self, name) for name in self.str_fields))
 
 
 # Doctor: Profile Stores additional information specific to doctors, such as specialty and bio.
@@ -19,10 +28,60 @@ class DoctorProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="doctor_profile")
     specialty = models.CharField(max_length=100)
     bio = models.TextField(blank=True, null=True)
+    tags = TaggableManager(blank=True)
+    # Denormalized name/specialty/bio text indexed for directory search (see api/search.py)
+    search_text = models.TextField(blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['specialty'], name='doctor_specialty_idx'),
+        ]
 
     def __str__(self):
         return f"Dr. {self.user.username} - {self.specialty}"
 
+    def build_search_text(self):
+        user = self.user
+        parts = [user.first_name, user.last_name, user.username, self.specialty, self.bio]
+        return ' '.join(part for part in parts if part)
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.build_search_text()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'search_text'}
+        super().save(*args, **kwargs)
+
+# Doctor Availability: Weekly working hours of a doctor, split into fixed-length slots.
+class DoctorAvailability(models.Model):
+    WEEKDAYS = (
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    )
+
+    doctor = models.ForeignKey(DoctorProfile, on_delete=models.CASCADE, related_name="availability")
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAYS)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    slot_minutes = models.PositiveSmallIntegerField(default=30)
+
+    class Meta:
+        ordering = ['weekday', 'start_time']
+        constraints = [
+            models.CheckConstraint(
+                condition=models.Q(end_time__gt=models.F('start_time')),
+                name='availability_end_after_start',
+            ),
+            models.CheckConstraint(condition=models.Q(slot_minutes__gt=0), name='availability_slot_positive'),
+        ]
+
+    def __str__(self):
+        return f"{self.doctor} - {self.get_weekday_display()} {self.start_time}-{self.end_time}"
+
 # Patient: Profile Stores additional information specific to patients.
 class PatientProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name="patient_profile")
@@ -41,13 +100,43 @@ class Appointment(models.Model):
         ('cancelled', 'Cancelled'),
         ('completed', 'Completed'),
     )
+    # Transitions a doctor may apply to an appointment
+    DOCTOR_STATUSES = ('confirmed', 'cancelled', 'completed')
 
-    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments_as_doctor")
-    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments_as_patient")
+    # Single-column FK indexes are redundant: the composite indexes below lead with these columns.
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments_as_doctor", db_index=False)
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="appointments_as_patient", db_index=False)
     date = models.DateField(null=True, blank=True)
     time = models.TimeField(null=True, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     notes = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Not set by QuerySet.update() or bulk_update(): pass it explicitly there (delta sync, api/sync.py).
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of AppointmentListView: (date, id) per doctor / patient
+            models.Index(fields=['doctor', '-date', '-id'], name='appt_doctor_date_idx'),
+            models.Index(fields=['patient', '-date', '-id'], name='appt_patient_date_idx'),
+            # Delta sync (?since=): changes in (updated_at, id) order per doctor / patient
+            models.Index(fields=['doctor', 'updated_at', 'id'], name='appt_doctor_updated_idx'),
+            models.Index(fields=['patient', 'updated_at', 'id'], name='appt_patient_updated_idx'),
+            # A doctor's pending queue (?status=pending); stays small as requests are handled
+            models.Index(
+                fields=['doctor', '-date', '-id'],
+                condition=models.Q(status='pending'),
+                name='appt_doctor_pending_idx',
+            ),
+        ]
+        constraints = [
+            # Atomic guard against double-booking; also indexes the confirmed-slot lookups.
+            models.UniqueConstraint(
+                fields=['doctor', 'date', 'time'],
+                condition=models.Q(status='confirmed'),
+                name='unique_confirmed_slot',
+            ),
+        ]
 
     def __str__(self):
         return f"Appointment: {self.patient.username} with {self.doctor.username} on {self.date}"
@@ -56,10 +145,177 @@ class Appointment(models.Model):
 # Prescription: Records prescriptions issued for an appointment.
 class Prescription(models.Model):
     appointment = models.OneToOneField(Appointment, on_delete=models.CASCADE, related_name="prescription")
+    # The appointment's doctor and patient, copied on save so lists filter and sort on one table's indexes.
+    # Set them explicitly with bulk_create().
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="prescriptions_as_doctor", db_index=False)
+    patient = models.ForeignKey(User, on_delete=models.CASCADE, related_name="prescriptions_as_patient", db_index=False)
     medicine_name = models.CharField(max_length=100)
     dosage = models.CharField(max_length=100)
     instructions = models.TextField()
     issued_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of PrescriptionListView: (issued_at, id) per doctor / patient
+            models.Index(fields=['doctor', '-issued_at', '-id'], name='rx_doctor_issued_idx'),
+            models.Index(fields=['patient', '-issued_at', '-id'], name='rx_patient_issued_idx'),
+            # Delta sync (?since=): changes in (updated_at, id) order per doctor / patient
+            models.Index(fields=['doctor', 'updated_at', 'id'], name='rx_doctor_updated_idx'),
+            models.Index(fields=['patient', 'updated_at', 'id'], name='rx_patient_updated_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.doctor_id is None or self.patient_id is None:
+            self.doctor_id, self.patient_id = self.appointment.doctor_id, self.appointment.patient_id
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Prescription for {self.patient.username}"
+
+
+# Tombstone: A deleted appointment or prescription, reported to delta syncs (api/sync.py).
+class Tombstone(models.Model):
+    KINDS = (
+        ('appointment', 'Appointment'),
+        ('prescription', 'Prescription'),
+    )
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.BigIntegerField()
+    # Plain ids, not foreign keys: tombstones outlive the rows and users they describe.
+    doctor_id = models.BigIntegerField()
+    patient_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor_id', 'kind', 'deleted_at'], name='tombstone_doctor_idx'),
+            models.Index(fields=['patient_id', 'kind', 'deleted_at'], name='tombstone_patient_idx'),
+        ]
+
+    def __str__(self):
+        return f"Deleted {self.kind} {self.object_id}"
+
+
+# DoctorDailyStats: Appointment counts per doctor, day and status, maintained by api/stats.py.
+class DoctorDailyStats(models.Model):
+    doctor = models.ForeignKey(User, on_delete=models.CASCADE, related_name="daily_stats", db_index=False)
+    day = models.DateField()
+    pending = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # One row per doctor and day; also indexes the date-range reads of the stats endpoint.
+            models.UniqueConstraint(fields=['doctor', 'day'], name='unique_doctor_stats_day'),
+        ]
 
     def __str__(self):
-        return f"Prescription for {self.appointment.patient.username}"
+        return f"Stats for {self.doctor_id} on {self.day}"
+
+
+# IdempotencyKey: The stored response of a create request sent with an Idempotency-Key header.
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="idempotency_keys", db_index=False)
+    path = models.CharField(max_length=255)
+    key = models.CharField(max_length=255)
+    # Hash of the request body; a key may not be reused for a different request.
+    fingerprint = models.CharField(max_length=64)
+    # Filled in the same transaction as the create, so other requests never see them empty.
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Serializes concurrent requests with the same key: the second insert waits for the first to commit.
+            models.UniqueConstraint(fields=['user', 'path', 'key'], name='unique_idempotency_key'),
+        ]
+        indexes = [
+            # Purging expired keys
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.path})"
+
+
+# Job: A queued background job of the database job backend (api/jobs.py).
+class Job(models.Model):
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('failed', 'Failed'),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When the job is next due; a worker that claims it moves this past its lease.
+    run_at = models.DateTimeField()
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Workers claiming due jobs; finished jobs are deleted and failed ones drop out
+            models.Index(fields=['run_at', 'id'], condition=models.Q(status='queued'), name='job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} job {self.pk} ({self.status})"
+
+
+class AuditEventQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        raise TypeError("Audit events are append-only.")
+
+    def delete(self):
+        raise TypeError("Audit events are append-only.")
+
+
+# AuditEvent: Who read or changed which medical records of a patient, written in batches by api/audit.py.
+class AuditEvent(models.Model):
+    KINDS = (
+        ('patient', 'Patient profile'),
+        ('appointment', 'Appointment'),
+        ('prescription', 'Prescription'),
+    )
+    ACTIONS = (
+        ('read', 'Read'),
+        ('create', 'Create'),
+        ('update', 'Update'),
+        ('export', 'Export'),
+    )
+
+    # Partition key: year * 100 + month of `at` in UTC; lookups name the months they cover.
+    month = models.PositiveIntegerField()
+    at = models.DateTimeField()
+    # Plain ids, not foreign keys: the trail outlives the users and rows it mentions.
+    actor_id = models.BigIntegerField()
+    patient_id = models.BigIntegerField(null=True)
+    kind = models.CharField(max_length=12, choices=KINDS)
+    action = models.CharField(max_length=6, choices=ACTIONS)
+    object_ids = models.JSONField()
+
+    objects = AuditEventQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Compliance lookups: a patient's events over a date range, month by month
+            models.Index(fields=['month', 'patient_id', 'at'], name='audit_patient_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.actor_id} {self.action} {self.kind} {self.object_ids} of {self.patient_id}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise TypeError("Audit events are append-only.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("Audit events are append-only.")
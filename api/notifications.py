@@ -0,0 +1,87 @@
+"""
+Email notifications, sent by background jobs (api/jobs.py) after the write that
+triggers them commits. Payloads carry ids, so the request only pays for the
+enqueue; the worker loads the rows and sends a whole batch over one connection,
+one message at a time, so an address the server rejects only retries its own
+job. Users without an email address are skipped.
+
+Emails carry no medical details: the prescription email links to the
+authenticated API instead.
+"""
+import traceback
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.urls import reverse
+
+from .jobs import PartialFailure, job
+from .models import User, Appointment, Prescription
+
+
+def _send(messages):
+    """
+    Send `messages` ({payload position: (subject, body, address)}) over one connection. Raise
+    PartialFailure with the positions whose message failed, so that only their jobs are retried.
+    """
+    errors = {}
+    with get_connection() as connection:
+        for position, (subject, body, address) in messages.items():
+            if not address:
+                continue
+            try:
+                EmailMessage(subject, body, to=[address], connection=connection).send()
+            except Exception:
+                errors[position] = traceback.format_exc()
+    if errors:
+        raise PartialFailure(errors)
+
+
+@job('welcome-email', batch=True)
+def send_welcome_emails(payloads):
+    users = User.objects.in_bulk([payload['user'] for payload in payloads])
+    messages = {}
+    for position, payload in enumerate(payloads):
+        user = users.get(payload['user'])
+        if user is not None:
+            messages[position] = (
+                "Welcome to the hospital", f"Hello {user.username}, your {user.role} account is ready.", user.email,
+            )
+    _send(messages)
+
+
+@job('appointment-status-email', batch=True)
+def send_appointment_status_emails(payloads):
+    """Payloads: {"appointment": id, "status": the status it was changed to}."""
+    appointments = Appointment.objects.select_related('doctor', 'patient').in_bulk(
+        [payload['appointment'] for payload in payloads]
+    )
+    messages = {}
+    for position, payload in enumerate(payloads):
+        appointment = appointments.get(payload['appointment'])
+        if appointment is None:
+            continue  # deleted since
+        when = f" on {appointment.date} at {appointment.time}" if appointment.date and appointment.time else ""
+        messages[position] = (
+            f"Your appointment was {payload['status']}",
+            f"Your appointment with Dr. {appointment.doctor.username}{when} was {payload['status']}.",
+            appointment.patient.email,
+        )
+    _send(messages)
+
+
+@job('prescription-email', batch=True)
+def send_prescription_emails(payloads):
+    prescriptions = Prescription.objects.select_related('doctor', 'patient').in_bulk(
+        [payload['prescription'] for payload in payloads]
+    )
+    link = settings.SITE_URL.rstrip('/') + reverse('prescription-list')
+    messages = {}
+    for position, payload in enumerate(payloads):
+        prescription = prescriptions.get(payload['prescription'])
+        if prescription is not None:
+            messages[position] = (
+                "New prescription",
+                f"Dr. {prescription.doctor.username} issued you a new prescription. Sign in to view it: {link}",
+                prescription.patient.email,
+            )
+    _send(messages)
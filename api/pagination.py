@@ -0,0 +1,137 @@
+import json
+import operator
+from functools import reduce
+
+from django.core.exceptions import ValidationError
+from django.db import connections, router
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset pagination over a composite, unique ordering such as `(date, id)`.
+
+    The cursor carries the full ordering tuple of the boundary row, so every page
+    is one `WHERE (date, id) < (...) ORDER BY ... LIMIT n` query served by an index
+    on the ordering columns, no matter how deep. NULLs keep the database's native
+    ordering so the same index also covers nullable fields like `Appointment.date`.
+    """
+    ordering = ('-id',)
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request)
+        if page_queryset is None:
+            return None
+        return self.build_page(list(page_queryset))
+
+    def get_page_queryset(self, queryset, request):
+        """Return the ordered, filtered, LIMITed queryset for the requested page."""
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.nulls_largest = connections[router.db_for_read(self.model)].features.nulls_order_largest
+        self.cursor = self.decode_cursor(request)
+        self.reverse = bool(self.cursor and self.cursor.reverse)
+
+        order_by = [self._flip(field) if self.reverse else field for field in self.ordering]
+        queryset = queryset.order_by(*order_by)
+        if self.cursor and self.cursor.position is not None:
+            queryset = queryset.filter(self._after(self._decode_position(self.cursor.position)))
+        return queryset[:self.page_size + 1]
+
+    def build_page(self, rows):
+        """Trim the look-ahead row, restore display order and compute the links."""
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_next, self.has_previous = has_more, self.cursor is not None
+
+        self.next_position = self._encode_position(rows[-1]) if rows else None
+        self.previous_position = self._encode_position(rows[0]) if rows else None
+        if not rows and self.cursor:
+            # Walked off either end: offer the way back from where we came.
+            self.has_next = self.has_previous = False
+            if self.reverse:
+                self.has_next, self.next_position = True, self.cursor.position
+            else:
+                self.has_previous, self.previous_position = True, self.cursor.position
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self.next_position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self.previous_position))
+
+    # -------------------- keyset helpers --------------------
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def _fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def _encode_position(self, row):
+        values = []
+        for name in self._fields():
+            value = row[name] if isinstance(row, dict) else getattr(row, name)
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return json.dumps(values, separators=(',', ':'))
+
+    def _decode_position(self, position):
+        try:
+            values = json.loads(position)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError(position)
+            return [
+                None if value is None else self.model._meta.get_field(name).to_python(value)
+                for name, value in zip(self._fields(), values)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _after(self, position):
+        """Q matching the rows that follow `position` in the current direction."""
+        branches = []
+        prefix = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            # Moving "forward" through a descending field means smaller values.
+            smaller = field.startswith('-') != self.reverse
+            if value is None:
+                step = Q(**{f'{name}__isnull': False}) if smaller == self.nulls_largest else None
+                equal = Q(**{f'{name}__isnull': True})
+            else:
+                step = Q(**{f'{name}__{"lt" if smaller else "gt"}': value})
+                if smaller != self.nulls_largest and self.model._meta.get_field(name).null:
+                    step |= Q(**{f'{name}__isnull': True})
+                equal = Q(**{name: value})
+            if step is not None:
+                branches.append(prefix & step)
+            prefix &= equal
+        return reduce(operator.or_, branches)
+
+
+class AppointmentCursorPagination(KeysetCursorPagination):
+    ordering = ('-date', '-id')
+
+
+class PrescriptionCursorPagination(KeysetCursorPagination):
+    ordering = ('-issued_at', '-id')
@@ -1,5 +1,20 @@
 from rest_framework import permissions
 
+
+def owned_by(queryset, user, via=''):
+    """
+    Narrow `queryset` to the appointments `user` takes part in, by FK id:
+    doctors get the ones they hold, patients the ones they booked. `via` is
+    the lookup path to the appointment (e.g. 'appointment__' for prescriptions).
+    Views scope their querysets with this, so rows a user may not see are never loaded.
+    """
+    if user.role == 'doctor':
+        return queryset.filter(**{f'{via}doctor_id': user.id})
+    if user.role == 'patient':
+        return queryset.filter(**{f'{via}patient_id': user.id})
+    return queryset.none()
+
+
 class IsDoctor(permissions.BasePermission):
     """Allow access only to users with doctor role."""
     def has_permission(self, request, view):
@@ -15,22 +30,5 @@ class IsPatient(permissions.BasePermission):
 class IsAppointmentOwnerOrDoctor(permissions.BasePermission):
     """Allow patients to view their appointments and doctors to manage their own."""
     def has_object_permission(self, request, view, obj):
-        return (
-            request.user == obj.patient or
-            request.user == obj.doctor
-        )
-
-class IsPrescriptionOwnerOrDoctor(permissions.BasePermission):
-    """
-    Allows patients to view their own prescriptions,
-    and doctors to view prescriptions they created.
-    """
-    def has_object_permission(self, request, view, obj):
-        if request.method in permissions.SAFE_METHODS:
-            # Doctor who issued it OR patient for whom it was issued
-            return (
-                request.user == obj.appointment.doctor.user or
-                request.user == obj.appointment.patient.user
-            )
-        # Only doctors can modify prescriptions
-        return request.user.role == 'doctor'
\ No newline at end of file
+        # FK ids, so the check never loads the related users
+        return request.user.id in (obj.patient_id, obj.doctor_id)
@@ -0,0 +1,91 @@
+"""
+Read-replica routing.
+
+Only views that opt in with `ReplicaReadMixin` (the read-only list views) read
+from a replica; every other query, and every write, goes to the primary, and so
+does everything inside `read_from_primary()` (the directory cache fills its
+misses there, so it never stores what a lagging replica returned). A
+request picks one replica from settings.DATABASE_REPLICAS and keeps it for all
+its queries.
+
+Replicas lag behind the primary, so a user who has just written is pinned to
+the primary for DATABASE_REPLICA_PIN_SECONDS (read-your-writes):
+`ReplicaPinMiddleware` records the pin in the cache after every successful
+unsafe request, which makes it visible to every worker.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Alias the current request reads from, or None for the default routing
+_read_alias = ContextVar('read_alias', default=None)
+# True inside read_from_primary()
+_primary_only = ContextVar('primary_only', default=False)
+
+
+def _pin_key(user_id):
+    return f'replica-pin:{user_id}'
+
+
+def pin_to_primary(user_id):
+    """Send `user_id`'s replica reads to the primary for the next DATABASE_REPLICA_PIN_SECONDS."""
+    cache.set(_pin_key(user_id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+async def apin_to_primary(user_id):
+    await cache.aset(_pin_key(user_id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id)) is not None
+
+
+@contextmanager
+def read_from_replica(user):
+    """Route the reads inside the block to a replica, unless there is none or `user` is pinned."""
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas or _primary_only.get() or (user.is_authenticated and is_pinned(user.id)):
+        yield None
+        return
+    alias = random.choice(replicas)
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    """Route the reads inside the block to the primary, including those of read_from_replica blocks."""
+    alias_token, primary_token = _read_alias.set(None), _primary_only.set(True)
+    try:
+        yield
+    finally:
+        _primary_only.reset(primary_token)
+        _read_alias.reset(alias_token)
+
+
+class ReplicaReadMixin:
+    """Serve list() from a replica (see read_from_replica)."""
+
+    def list(self, request, *args, **kwargs):
+        with read_from_replica(request.user):
+            return super().list(request, *args, **kwargs)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so instances read from a replica are still saved to the primary.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        return True
@@ -0,0 +1,260 @@
+"""
+Compiled read path for list endpoints.
+
+`compile_serializer(SerializerClass)` inspects a serializer's readable fields
+once and returns a `RowSerializer` that reads exactly the columns they need
+with `.values()` and builds the same dicts DRF would, in the same key order,
+so the rendered JSON is byte-identical. The row builder is a list of getter
+closures resolved once per serializer and bound to each response's state once,
+so a row costs a few dict lookups (plain columns are a bare `itemgetter`)
+instead of a model instance and a walk over serializer fields. Converters are DRF's
+own `to_representation`, except where that is a no-op on database values
+(strings, integers, booleans) or has an exact cheaper equivalent (ISO 8601
+dates, times and datetimes).
+
+Fields the compiler can't reproduce exactly (method fields, properties,
+nullable relation chains, many-valued nested serializers, string relations to
+models without `str_fields`/`format_str`, ...) make it return None, and the view falls back to the regular serializer.
+"""
+import datetime
+from collections import defaultdict
+from functools import lru_cache
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import ISO_8601, fields, relations, serializers
+from rest_framework.settings import api_settings
+from taggit.managers import TaggableManager
+from taggit.serializers import TagListSerializerField
+
+# Fields whose to_representation returns database values unchanged.
+IDENTITY_FIELDS = (fields.CharField, fields.IntegerField, fields.BooleanField)
+
+ISO_FORMAT_SETTINGS = {
+    fields.DateField: 'DATE_FORMAT',
+    fields.TimeField: 'TIME_FORMAT',
+    fields.DateTimeField: 'DATETIME_FORMAT',
+}
+
+
+class Unsupported(Exception):
+    pass
+
+
+class _Context:
+    """State shared by every row of one response."""
+
+    def __init__(self, tags):
+        self.tags = tags  # tag source -> {object id: sorted names}
+        self.strings = defaultdict(dict)  # related model -> {str_fields values: str(instance)}
+        self.timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+
+class RowSerializer:
+    def __init__(self, model, bind, columns, tag_sources):
+        self.model = model
+        self.bind = bind
+        self.columns = columns
+        self.tag_sources = tag_sources
+
+    def values(self, queryset, extra_columns=()):
+        """`queryset` as `.values()` dicts holding every column the output needs (unevaluated)."""
+        columns = list(dict.fromkeys([*self.columns, *extra_columns]))
+        return queryset.prefetch_related(None).values(*columns)
+
+    def fetch(self, queryset, extra_columns=()):
+        """Evaluate `queryset` as `.values()` dicts holding every column the output needs."""
+        return list(self.values(queryset, extra_columns))
+
+    def serialize(self, rows):
+        """Turn rows from `fetch` into the serializer's output."""
+        context = _Context({source: self._tag_names(source, rows) for source in self.tag_sources})
+        return list(map(self.bind(context), rows))
+
+    def _tag_names(self, source, rows):
+        through = self.model._meta.get_field(source).through
+        names = {}
+        items = through.objects.filter(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_id__in=[row['pk'] for row in rows],
+        ).values_list('object_id', 'tag__name')
+        for object_id, name in items:
+            names.setdefault(object_id, []).append(name)
+        return {object_id: sorted(values) for object_id, values in names.items()}
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    """Return a RowSerializer for `serializer_class`, or None if it can't be compiled exactly."""
+    model = serializer_class.Meta.model
+    columns, tag_sources = ['pk'], []
+    try:
+        bind = _compile(serializer_class(), model, '', columns, tag_sources)
+    except Unsupported:
+        return None
+    return RowSerializer(model, bind, list(dict.fromkeys(columns)), tag_sources)
+
+
+def _compile(serializer, model, prefix, columns, tag_sources):
+    """Return a `bind(context)` that makes the `build(row)` producing `serializer`'s output."""
+    getters = []
+    for field in serializer._readable_fields:
+        source_attrs = field.source_attrs
+        if not source_attrs or source_attrs == ['*']:
+            raise Unsupported(field.field_name)
+        model_field = _resolve(model, source_attrs)
+        path = prefix + '__'.join(source_attrs)
+
+        if isinstance(field, serializers.BaseSerializer):
+            if isinstance(field, serializers.ListSerializer) or model_field.null or not (
+                model_field.many_to_one or model_field.one_to_one
+            ):
+                raise Unsupported(field.field_name)
+            getter = _compile(field, model_field.related_model, path + '__', columns, tag_sources)
+        elif isinstance(field, TagListSerializerField):
+            if prefix or not isinstance(model_field, TaggableManager):
+                raise Unsupported(field.field_name)
+            tag_sources.append(source_attrs[0])
+            getter = _tag_getter(source_attrs[0])
+        elif isinstance(field, relations.StringRelatedField):
+            names = _string_columns(model_field, path)
+            columns.extend(names)
+            getter = _string_getter(model_field.related_model, names)
+        elif isinstance(field, relations.RelatedField) or model_field.is_relation:
+            raise Unsupported(field.field_name)
+        else:
+            columns.append(path)
+            getter = _value_getter(path, _converter(field))
+        getters.append((field.field_name, getter))
+
+    names = [name for name, _ in getters]
+
+    def bind(context):
+        bound = [getter(context) for _, getter in getters]
+
+        def build(row):
+            return dict(zip(names, [get(row) for get in bound]))
+        return build
+    return bind
+
+
+# Each getter below is a `bind(context)` returning a `get(row)`, so per-response
+# state is looked up once per response and plain columns are a bare itemgetter.
+
+def _tag_getter(source):
+    def bind(context):
+        tags = context.tags[source]
+
+        def get(row):
+            return tags.get(row['pk'], [])
+        return get
+    return bind
+
+
+def _value_getter(column, convert):
+    if convert is None:
+        get = itemgetter(column)
+        return lambda context: get
+
+    def bind(context):
+        if convert is _datetime:
+            field_timezone = context.timezone
+
+            def get(row):
+                value = row[column]
+                return None if value is None else _datetime(value, field_timezone)
+        elif convert is _isoformat:
+            def get(row):
+                value = row[column]
+                return value if value is None or isinstance(value, str) else value.isoformat()
+        else:
+            def get(row):
+                value = row[column]
+                return None if value is None else convert(value)
+        return get
+    return bind
+
+
+def _string_getter(related, columns):
+    """str() of the related instance via its `format_str`, memoized per response since the same rows repeat."""
+    key = itemgetter(*columns)
+    format_str = related.format_str if len(columns) == 1 else lambda values: related.format_str(*values)
+
+    def bind(context):
+        strings = context.strings[related]
+
+        def get(row):
+            values = key(row)
+            value = strings.get(values)
+            if value is None:
+                strings[values] = value = format_str(values)
+            return value
+        return get
+    return bind
+
+
+def _converter(field):
+    if isinstance(field, IDENTITY_FIELDS):
+        return None
+    if type(field) is fields.ChoiceField and all(type(key) is str for key in field.choices):
+        # to_representation maps str(value) back to the choice key, i.e. the value itself.
+        return None
+    setting = ISO_FORMAT_SETTINGS.get(type(field))
+    if setting and not hasattr(field, 'timezone'):
+        output_format = getattr(field, 'format', getattr(api_settings, setting))
+        if output_format is not None and output_format.lower() == ISO_8601:
+            return _datetime if setting == 'DATETIME_FORMAT' else _isoformat
+    return field.to_representation
+
+
+def _isoformat(value):
+    # DateField/TimeField.to_representation for ISO 8601 output, minus the per-call lookups.
+    return value if isinstance(value, str) else value.isoformat()
+
+
+def _datetime(value, field_timezone):
+    # DateTimeField.to_representation (and enforce_timezone) for ISO 8601 output and the
+    # default timezone, which the caller resolves once per response.
+    if isinstance(value, str):
+        return value
+    if field_timezone is not None:
+        if timezone.is_aware(value):
+            value = value.astimezone(field_timezone)
+        else:
+            value = timezone.make_aware(value, field_timezone)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, datetime.timezone.utc)
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def _resolve(model, source_attrs):
+    """Follow `source_attrs` through non-null forward relations to the final model field."""
+    for position, attr in enumerate(source_attrs):
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise Unsupported(attr)
+        if position < len(source_attrs) - 1:
+            if not (model_field.many_to_one or model_field.one_to_one) or model_field.null or model_field.auto_created:
+                raise Unsupported(attr)
+            model = model_field.related_model
+    if model_field.auto_created and not model_field.concrete:
+        raise Unsupported(source_attrs[-1])
+    return model_field
+
+
+def _string_columns(model_field, path):
+    """
+    Columns a StringRelatedField reads: the related model renders __str__ with
+    `format_str` over the fields listed in `str_fields`.
+    """
+    related = model_field.related_model
+    if not (model_field.many_to_one or model_field.one_to_one) or model_field.null or not (
+        getattr(related, 'str_fields', None) and hasattr(related, 'format_str')
+    ):
+        raise Unsupported(path)
+    return [f'{path}__{name}' for name in related.str_fields]
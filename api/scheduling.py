@@ -0,0 +1,149 @@
+"""
+Slot scheduling: free-slot computation and double-booking checks.
+
+A doctor's week is described by `DoctorAvailability` windows split into
+fixed-length slots. Free slots are computed with one query for the windows
+and one for the confirmed appointments in the range; each (doctor, day,
+window) is then a bitmap with one bit per slot, and booked appointments just
+clear bits. Cost is O(days x windows + appointments in range), independent of
+how many years of history a doctor has.
+"""
+import datetime
+from collections import defaultdict
+
+from django.utils import timezone
+
+from .models import User, Appointment, DoctorAvailability
+
+# Length assumed for an appointment when its doctor has no availability configured.
+DEFAULT_SLOT_MINUTES = 30
+MAX_RANGE_DAYS = 62
+
+
+class SlotUnavailable(Exception):
+    """The requested date/time cannot be booked for this doctor."""
+
+
+def _minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def _time(minutes):
+    return datetime.time(minutes // 60, minutes % 60)
+
+
+def _days(start, end):
+    for offset in range((end - start).days + 1):
+        yield start + datetime.timedelta(days=offset)
+
+
+def free_slots(doctor_profiles, start, end):
+    """
+    Return {doctor_profile_id: [(date, [time, ...]), ...]} of free slots between
+    `start` and `end` (inclusive) for every profile in `doctor_profiles`.
+    """
+    profiles = {profile.id: profile.user_id for profile in doctor_profiles}
+    windows = defaultdict(list)
+    for window in DoctorAvailability.objects.filter(doctor_id__in=profiles):
+        windows[window.doctor_id, window.weekday].append(window)
+
+    booked = defaultdict(list)
+    confirmed = Appointment.objects.filter(
+        doctor_id__in=profiles.values(), status='confirmed', date__range=(start, end), time__isnull=False,
+    ).values_list('doctor_id', 'date', 'time')
+    for doctor_id, day, booked_time in confirmed:
+        booked[doctor_id, day].append(_minutes(booked_time))
+
+    now = timezone.localtime()
+    result = {}
+    for profile_id, user_id in profiles.items():
+        days = []
+        for day in _days(start, end):
+            if day < now.date():
+                continue
+            earliest = _minutes(now) if day == now.date() else 0
+            times = []
+            for window in windows.get((profile_id, day.weekday()), ()):
+                times.extend(_window_free_times(window, booked.get((user_id, day), ()), earliest))
+            if times:
+                days.append((day, times))
+        result[profile_id] = days
+    return result
+
+
+def _window_free_times(window, booked_minutes, earliest):
+    begin, length = _minutes(window.start_time), window.slot_minutes
+    count = (_minutes(window.end_time) - begin) // length
+    bitmap = (1 << count) - 1
+    for minute in booked_minutes:
+        # An appointment occupies one slot length from its start; clear every slot it overlaps.
+        first = max((minute - begin) // length, 0)
+        last = min(-(-(minute + length - begin) // length), count)
+        for index in range(first, last):
+            bitmap &= ~(1 << index)
+    return [
+        _time(begin + index * length)
+        for index in range(count)
+        if bitmap >> index & 1 and begin + index * length >= earliest
+    ]
+
+
+class DoctorCalendar:
+    """
+    One doctor's working windows and confirmed slots on a set of dates, held in memory.
+
+    Must be built inside a transaction: the doctor's row is locked so concurrent
+    confirmations for the same doctor are serialized, and the
+    `unique_confirmed_slot` constraint backs this up at the database level.
+    """
+
+    def __init__(self, doctor_id, dates):
+        list(User.objects.select_for_update().filter(pk=doctor_id).values_list('pk', flat=True))
+        self.windows = list(DoctorAvailability.objects.filter(doctor__user_id=doctor_id))
+        self.days = defaultdict(dict)  # date -> {appointment id: start minute}
+        self.day_of = {}  # appointment id -> date
+        rows = Appointment.objects.filter(
+            doctor_id=doctor_id, status='confirmed', date__in=set(dates), time__isnull=False,
+        ).values_list('id', 'date', 'time')
+        for pk, day, booked_time in rows:
+            self.days[day][pk] = _minutes(booked_time)
+            self.day_of[pk] = day
+
+    def slot_length(self, day, booked_time):
+        if not self.windows:
+            return DEFAULT_SLOT_MINUTES
+        minute = _minutes(booked_time)
+        for window in self.windows:
+            begin = _minutes(window.start_time)
+            if (
+                window.weekday == day.weekday()
+                and begin <= minute
+                and minute + window.slot_minutes <= _minutes(window.end_time)
+                and (minute - begin) % window.slot_minutes == 0
+            ):
+                return window.slot_minutes
+        raise SlotUnavailable("Requested time is not one of the doctor's slots.")
+
+    def book(self, appointment_id, day, booked_time):
+        """Record a confirmation, or raise SlotUnavailable if it is off-grid or overlaps."""
+        length = self.slot_length(day, booked_time)
+        minute = _minutes(booked_time)
+        for pk, other_minute in self.days[day].items():
+            # Any confirmed appointment starting less than one slot length away overlaps.
+            if pk != appointment_id and abs(other_minute - minute) < length:
+                raise SlotUnavailable("The doctor already has a confirmed appointment at this time.")
+        self.release(appointment_id)
+        self.days[day][appointment_id] = minute
+        self.day_of[appointment_id] = day
+
+    def release(self, appointment_id):
+        day = self.day_of.pop(appointment_id, None)
+        if day is not None:
+            del self.days[day][appointment_id]
+
+
+def book_slot(appointment):
+    """Validate that `appointment` may be confirmed at its date/time (inside a transaction)."""
+    DoctorCalendar(appointment.doctor_id, [appointment.date]).book(
+        appointment.pk, appointment.date, appointment.time
+    )
@@ -0,0 +1,71 @@
+"""
+Full-text search over the doctor directory.
+
+`DoctorProfile.search_text` holds the doctor's names, specialty and bio. On
+SQLite it is mirrored into an FTS5 table (`api_doctor_search`, rowid = profile
+id) kept in sync from the model signals; on Postgres a GIN index on
+`to_tsvector('simple', search_text)` serves the same query. Every term is
+prefix-matched and all terms must match. Other backends fall back to
+`icontains`, which is correct but unindexed.
+"""
+import re
+
+from django.db import connections
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'api_doctor_search'
+_fts_available = {}
+
+
+def _terms(text):
+    return re.findall(r'\w+', text)
+
+
+def has_fts(connection):
+    """Whether the SQLite FTS5 table exists on this connection (checked once per process)."""
+    if connection.vendor != 'sqlite':
+        return False
+    if connection.alias not in _fts_available:
+        _fts_available[connection.alias] = FTS_TABLE in connection.introspection.table_names()
+    return _fts_available[connection.alias]
+
+
+def search_doctors(queryset, text):
+    terms = _terms(text)
+    if not terms:
+        return queryset
+    connection = connections[queryset.db]
+    if has_fts(connection):
+        match = ' '.join(f'"{term}"*' for term in terms)
+        return queryset.filter(id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+    if connection.vendor == 'postgresql':
+        query = ' & '.join(f'{term}:*' for term in terms)
+        return queryset.filter(RawSQL(
+            "to_tsvector('simple', api_doctorprofile.search_text) @@ to_tsquery('simple', %s)",
+            [query],
+            output_field=BooleanField(),
+        ))
+    for term in terms:
+        queryset = queryset.filter(search_text__icontains=term)
+    return queryset
+
+
+def index_profiles(profiles, using='default'):
+    """Write (or rewrite) the FTS rows of `profiles`; a no-op where no FTS table is kept."""
+    connection = connections[using]
+    if not has_fts(connection) or not profiles:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(p.pk,) for p in profiles])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, search_text) VALUES (%s, %s)',
+            [(p.pk, p.search_text) for p in profiles],
+        )
+
+
+def unindex_profile(pk, using='default'):
+    connection = connections[using]
+    if has_fts(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
@@ -1,6 +1,34 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
-from .models import User, DoctorProfile, PatientProfile, Appointment, Prescription
+from taggit.serializers import TaggitSerializer, TagList, TagListSerializerField
+from .models import User, DoctorProfile, DoctorAvailability, PatientProfile, Appointment, Prescription
 
+# Flexible date/time input formats accepted for appointments
+DATE_INPUT_FORMATS = ['%Y-%m-%d', '%m/%d/%Y']
+TIME_INPUT_FORMATS = ['%H:%M', '%H:%M:%S', '%I:%M %p']
+
+
+# Query shaping: serializers declare the relations they read so views can load them up front.
+class QueryShapeMixin:
+    """
+    Declarative "required relations" for a serializer.
+
+    Views apply `shape_queryset` to every queryset they serialize, so nested
+    serializers and dotted sources never trigger a query per row.
+    """
+    select_related_fields = ()
+    prefetch_related_fields = ()
+    only_fields = ()
+
+    @classmethod
+    def shape_queryset(cls, queryset):
+        if cls.select_related_fields:
+            queryset = queryset.select_related(*cls.select_related_fields)
+        if cls.prefetch_related_fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        if cls.only_fields:
+            queryset = queryset.only(*cls.only_fields)
+        return queryset
 
 
 # User Serializer
@@ -35,32 +63,60 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+class SortedTagListField(TagListSerializerField):
+    """Tag names in alphabetical order (prefetched tags come back in no particular order)."""
+
+    def to_representation(self, value):
+        return TagList(sorted(super().to_representation(value)), pretty_print=self.pretty_print)
+
+
 # Doctor Profile Serializer
-class DoctorProfileSerializer(serializers.ModelSerializer):
+class DoctorProfileSerializer(TaggitSerializer, QueryShapeMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
+    tags = SortedTagListField(required=False)
+
+    select_related_fields = ('user',)
+    prefetch_related_fields = ('tags',)
 
     class Meta:
         model = DoctorProfile
-        fields = ['id', 'user', 'specialty', 'bio']
+        fields = ['id', 'user', 'specialty', 'bio', 'tags']
+
+
+# Doctor Availability Serializer
+class DoctorAvailabilitySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DoctorAvailability
+        fields = ['id', 'weekday', 'start_time', 'end_time', 'slot_minutes']
+
+    def validate(self, attrs):
+        if attrs['end_time'] <= attrs['start_time']:
+            raise serializers.ValidationError({"end_time": "End time must be after start time."})
+        return attrs
 
 
 # Patient Profile Serializer
-class PatientProfileSerializer(serializers.ModelSerializer):
+class PatientProfileSerializer(QueryShapeMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
 
+    select_related_fields = ('user',)
+
     class Meta:
         model = PatientProfile
         fields = ['id', 'user', 'date_of_birth', 'medical_history']
 
 
 # Appointment Serializer 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(QueryShapeMixin, serializers.ModelSerializer):
     doctor = serializers.StringRelatedField(read_only=True)
     patient = serializers.StringRelatedField(read_only=True)
 
+    # StringRelatedField calls User.__str__ on both sides
+    select_related_fields = ('doctor', 'patient')
+
     # Allow flexible date/time input formats
-    date = serializers.DateField(input_formats=['%Y-%m-%d', '%m/%d/%Y'])
-    time = serializers.TimeField(input_formats=['%H:%M', '%H:%M:%S', '%I:%M %p'])
+    date = serializers.DateField(input_formats=DATE_INPUT_FORMATS)
+    time = serializers.TimeField(input_formats=TIME_INPUT_FORMATS)
 
     class Meta:
         model = Appointment
@@ -80,14 +136,25 @@ class AppointmentSerializer(serializers.ModelSerializer):
                 # Doctors can’t edit notes (only date/time/status)
                 self.fields['notes'].read_only = True
 
+# Bulk appointment status item Serializer (doctors only)
+class AppointmentStatusItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    status = serializers.ChoiceField(choices=Appointment.DOCTOR_STATUSES)
+    date = serializers.DateField(input_formats=DATE_INPUT_FORMATS, required=False)
+    time = serializers.TimeField(input_formats=TIME_INPUT_FORMATS, required=False)
+
+
 # Prescription Serializer 
-class PrescriptionSerializer(serializers.ModelSerializer):
+class PrescriptionSerializer(QueryShapeMixin, serializers.ModelSerializer):
     appointment = serializers.PrimaryKeyRelatedField(
         queryset=Appointment.objects.none(),  # default empty until set in __init__
         write_only=True
     )
-    doctor = serializers.CharField(source='appointment.doctor.username', read_only=True)
-    patient = serializers.CharField(source='appointment.patient.username', read_only=True)
+    doctor = serializers.CharField(source='doctor.username', read_only=True)
+    patient = serializers.CharField(source='patient.username', read_only=True)
+
+    select_related_fields = ('doctor', 'patient')
+    only_fields = ('id', 'medicine_name', 'dosage', 'instructions', 'issued_at', 'doctor__username', 'patient__username')
 
     class Meta:
         model = Prescription
@@ -109,12 +176,76 @@ class PrescriptionSerializer(serializers.ModelSerializer):
         if request and hasattr(request, 'user') and request.user.is_authenticated:
             # If the logged-in user is a doctor, show only their appointments
             if request.user.role == 'doctor':
-                self.fields['appointment'].queryset = Appointment.objects.filter(doctor=request.user)
+                self.fields['appointment'].queryset = Appointment.objects.filter(doctor_id=request.user.id)
+
+
+
+# Appointment timeline Serializers (read-only): appointments with their prescription embedded
+class TimelinePrescriptionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Prescription
+        fields = ['id', 'medicine_name', 'dosage', 'instructions', 'issued_at']
+
+
+class AppointmentTimelineSerializer(QueryShapeMixin, serializers.ModelSerializer):
+    """
+    Supports field selection: with ?fields=id,date,prescription only those keys
+    are rendered, and shape_queryset() skips the relations the others need.
+    """
+    doctor = serializers.StringRelatedField()
+    patient = serializers.StringRelatedField()
+    prescription = TimelinePrescriptionSerializer(read_only=True)  # null without one
+
+    select_related_fields = ('doctor', 'patient')
+    # One query for the whole page, through the reverse OneToOne accessor
+    prefetch_related_fields = (
+        Prefetch(
+            'prescription',
+            queryset=Prescription.objects.only('appointment', *TimelinePrescriptionSerializer.Meta.fields),
+        ),
+    )
+
+    class Meta:
+        model = Appointment
+        fields = ['id', 'doctor', 'patient', 'date', 'time', 'status', 'notes', 'prescription']
+        read_only_fields = fields
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request:
+            selected = self.selected_fields(request)
+            for name in [name for name in self.fields if name not in selected]:
+                self.fields.pop(name)
+
+    @classmethod
+    def selected_fields(cls, request):
+        """Field names of ?fields= (comma-separated), or all of them."""
+        value = request.query_params.get('fields')
+        if not value:
+            return list(cls.Meta.fields)
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = sorted(set(names) - set(cls.Meta.fields))
+        if unknown:
+            raise serializers.ValidationError({"fields": f"Unknown fields: {', '.join(unknown)}."})
+        return names
+
+    @classmethod
+    def shape_queryset(cls, queryset, fields=None):
+        """Load only the relations `fields` (default: all) render."""
+        if fields is None:
+            return super().shape_queryset(queryset)
+        related = [name for name in cls.select_related_fields if name in fields]
+        if related:
+            queryset = queryset.select_related(*related)
+        if 'prescription' in fields:
+            queryset = queryset.prefetch_related(*cls.prefetch_related_fields)
+        return queryset
 
 
 # Serializer for creating appointments (patients only)
 class AppointmentCreateSerializer(serializers.ModelSerializer):
-    doctor = serializers.PrimaryKeyRelatedField(queryset=DoctorProfile.objects.all())
+    doctor = serializers.PrimaryKeyRelatedField(queryset=DoctorProfile.objects.select_related('user'))
 
     class Meta:
         model = Appointment
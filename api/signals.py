@@ -0,0 +1,80 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import DIRECTORY_USER_FIELDS, invalidate_directory
+from .ical import schedule_refresh as refresh_calendar
+from .models import User, DoctorProfile, Appointment, Prescription, Tombstone
+from .search import index_profiles, unindex_profile
+
+
+# -------------------- DOCTOR DIRECTORY --------------------
+# Cache invalidation runs on commit so a concurrent request can't re-cache the pre-commit state.
+@receiver(post_save, sender=DoctorProfile)
+def doctor_profile_saved(sender, instance, using, **kwargs):
+    index_profiles([instance], using=using)
+    transaction.on_commit(invalidate_directory, using=using)
+
+
+@receiver(post_delete, sender=DoctorProfile)
+def doctor_profile_deleted(sender, instance, using, **kwargs):
+    unindex_profile(instance.pk, using=using)
+    transaction.on_commit(invalidate_directory, using=using)
+
+
+@receiver(m2m_changed, sender=DoctorProfile.tags.through)
+def doctor_tags_changed(sender, instance, action, using, **kwargs):
+    if isinstance(instance, DoctorProfile) and action.startswith('post_'):
+        transaction.on_commit(invalidate_directory, using=using)
+
+
+@receiver(post_save, sender=User)
+def doctor_user_saved(sender, instance, update_fields=None, **kwargs):
+    if instance.role != 'doctor':
+        return
+    if update_fields is not None and not DIRECTORY_USER_FIELDS.intersection(update_fields):
+        return
+    # Refresh the profile's search text; its own post_save re-indexes and invalidates the cache.
+    profile = DoctorProfile.objects.filter(user=instance).first()
+    if profile is not None:
+        profile.user = instance
+        profile.save(update_fields=['search_text'])
+
+
+@receiver(post_delete, sender=User)
+def doctor_user_deleted(sender, instance, using, **kwargs):
+    if instance.role == 'doctor':
+        transaction.on_commit(invalidate_directory, using=using)
+
+
+# -------------------- CLAIMS AUTHENTICATION --------------------
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Imported here: it pulls in simplejwt and the DRF serializers, which django.setup() shouldn't pay for.
+    from .authentication import REVOCATION_USER_FIELDS, forget_user
+
+    if update_fields is None or not REVOCATION_USER_FIELDS.isdisjoint(update_fields):
+        forget_user(instance.pk)
+
+
+# -------------------- DELTA SYNC --------------------
+# Deleted rows leave a tombstone so that clients syncing with ?since= drop them (api/sync.py).
+@receiver(post_delete, sender=Appointment)
+def appointment_deleted(sender, instance, using, **kwargs):
+    Tombstone.objects.using(using).create(
+        kind='appointment', object_id=instance.pk, doctor_id=instance.doctor_id, patient_id=instance.patient_id,
+    )
+
+
+@receiver(post_delete, sender=Prescription)
+def prescription_deleted(sender, instance, using, **kwargs):
+    Tombstone.objects.using(using).create(
+        kind='prescription', object_id=instance.pk, doctor_id=instance.doctor_id, patient_id=instance.patient_id,
+    )
+
+
+# -------------------- CALENDAR FEED --------------------
+# The doctor's cached feed is patched by a job after the commit, from the committed row (api/ical.py).
+@receiver([post_save, post_delete], sender=Appointment)
+def appointment_changed(sender, instance, using, **kwargs):
+    refresh_calendar(instance.doctor_id, [instance.pk], using=using)
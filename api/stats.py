@@ -0,0 +1,104 @@
+"""
+Per-doctor, per-day appointment counters.
+
+DoctorDailyStats keeps one row per doctor and day with a counter per
+appointment status. The views that create appointments or change their status
+or date pass the before/after state to `record_transitions` inside the same
+transaction, so the counters move with the rows they count, and a date-range
+read costs one row per day instead of one per appointment. `rebuild`
+(`python manage.py rebuild_stats`) recomputes the counters from the
+appointments, for backfills and changes made outside the API (admin, shell).
+
+An appointment counts on its scheduled date, or on the day it was requested
+while it has none (pending requests).
+"""
+import datetime
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Appointment, DoctorDailyStats
+
+STATUSES = tuple(status for status, _ in Appointment.STATUS_CHOICES)
+
+
+def stats_key(appointment):
+    """The (doctor id, day, status) counter `appointment` counts towards."""
+    return appointment.doctor_id, appointment.date or timezone.localdate(appointment.created_at), appointment.status
+
+
+def record_transitions(transitions):
+    """
+    Apply (before, after) pairs of stats_key() values; None stands for an
+    appointment that didn't exist before or doesn't any more. Costs two
+    queries however many rows change: an insert of missing counter rows and
+    one UPDATE adding the deltas.
+    """
+    deltas = Counter()
+    for before, after in transitions:
+        if before == after:
+            continue
+        if before is not None:
+            deltas[before] -= 1
+        if after is not None:
+            deltas[after] += 1
+
+    changes = defaultdict(dict)
+    for (doctor_id, day, status), delta in deltas.items():
+        if delta:
+            changes[doctor_id, day][status] = delta
+    if not changes:
+        return
+
+    DoctorDailyStats.objects.bulk_create(
+        [DoctorDailyStats(doctor_id=doctor_id, day=day) for doctor_id, day in changes], ignore_conflicts=True,
+    )
+    rows = Q()
+    for doctor_id, day in changes:
+        rows |= Q(doctor_id=doctor_id, day=day)
+    updates = {}
+    for status in STATUSES:
+        whens = [
+            When(doctor_id=doctor_id, day=day, then=Value(counts[status]))
+            for (doctor_id, day), counts in changes.items()
+            if status in counts
+        ]
+        if whens:
+            updates[status] = F(status) + Case(*whens, default=Value(0))
+    DoctorDailyStats.objects.filter(rows).update(**updates)
+
+
+def rebuild(doctor_ids=None, batch_size=1000):
+    """Recompute the counters from the appointments (of `doctor_ids`, or everyone); return the row count."""
+    stats = DoctorDailyStats.objects.all()
+    appointments = Appointment.objects.all()
+    if doctor_ids is not None:
+        stats = stats.filter(doctor_id__in=doctor_ids)
+        appointments = appointments.filter(doctor_id__in=doctor_ids)
+    counts = (
+        appointments.annotate(day=Coalesce('date', TruncDate('created_at')))
+        .values('doctor_id', 'day')
+        .annotate(**{status: Count('id', filter=Q(status=status)) for status in STATUSES})
+        .order_by()
+    )
+    with transaction.atomic():
+        stats.delete()
+        rows = DoctorDailyStats.objects.bulk_create((DoctorDailyStats(**row) for row in counts), batch_size=batch_size)
+    return len(rows)
+
+
+def daily_counts(doctor_id, start, end):
+    """Counters of every day from `start` to `end` (inclusive, zeros where nothing happened)."""
+    stored = {
+        row['day']: row
+        for row in DoctorDailyStats.objects.filter(doctor_id=doctor_id, day__range=(start, end)).values('day', *STATUSES)
+    }
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + datetime.timedelta(days=offset)
+        row = stored.get(day, {})
+        days.append({"date": day, **{status: row.get(status, 0) for status in STATUSES}})
+    return days
@@ -1,3 +1,2143 @@
-from django.test import TestCase
+import datetime
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from smtplib import SMTPRecipientsRefused
+from unittest import mock, skipIf, skipUnless
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, router, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from . import audit, jobs, metrics, throttling, urls as api_urls
+from .authentication import ClaimsTokenObtainPairSerializer, ClaimsUser, clear_user_state
+from .models import (
+    User, AuditEvent, DoctorProfile, DoctorAvailability, DoctorDailyStats, IdempotencyKey, Job, PatientProfile,
+    Appointment, Prescription,
+)
+from .export import export_lines
+from .importer import import_users
+from .sync import decode_token
+from .management.commands.benchmark import DEFAULT_BASELINE
+from .management.commands.profile_startup import DEFAULT_BUDGET
+from .permissions import IsAppointmentOwnerOrDoctor
+from .routers import _read_alias, is_pinned, pin_to_primary, read_from_primary, read_from_replica
+from .row_serializers import compile_serializer
+from .serializers import AppointmentSerializer, DoctorProfileSerializer, PatientProfileSerializer, PrescriptionSerializer
+from .views import AppointmentListView
+
+
+def make_doctor(username, specialty='General'):
+    user = User.objects.create(username=username, role='doctor')
+    DoctorProfile.objects.create(user=user, specialty=specialty)
+    return user
+
+
+def make_patient(username):
+    user = User.objects.create(username=username, role='patient')
+    PatientProfile.objects.create(user=user)
+    return user
+
+
+class ListQueryCountTests(TestCase):
+    """Every list endpoint must cost the same number of queries regardless of row count."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.rows = 0
+
+    def add_rows(self, count):
+        for _ in range(count):
+            self.rows += 1
+            other_doctor = make_doctor(f'doc{self.rows}')
+            other_patient = make_patient(f'pat{self.rows}')
+            for doctor, patient in ((self.doctor, other_patient), (other_doctor, self.patient)):
+                appointment = Appointment.objects.create(doctor=doctor, patient=patient, status='confirmed')
+                Prescription.objects.create(
+                    appointment=appointment, medicine_name='Paracetamol', dosage='500mg', instructions='Daily'
+                )
+
+    def count_queries(self, user, url_name):
+        cache.clear()  # measure the uncached path of the directory views
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        if isinstance(data, dict):
+            data = data['results']
+        return len(ctx.captured_queries), data
+
+    def assertConstantQueries(self, user, url_name, expected):
+        self.add_rows(2)
+        small, small_data = self.count_queries(user, url_name)
+        self.add_rows(10)
+        large, large_data = self.count_queries(user, url_name)
+        self.assertGreater(len(large_data), len(small_data))
+        self.assertEqual(small, expected)
+        self.assertEqual(large, expected)
+
+    def test_doctor_list(self):
+        self.assertConstantQueries(self.patient, 'doctor-list', 2)  # profiles + prefetched tags
+
+    def test_available_doctors(self):
+        self.assertConstantQueries(self.patient, 'available-doctors', 2)
+
+    def test_patient_list(self):
+        self.assertConstantQueries(self.doctor, 'patient-list', 1)
+
+    def test_appointment_list_for_doctor(self):
+        self.assertConstantQueries(self.doctor, 'appointment-list', 1)
+
+    def test_appointment_list_for_patient(self):
+        self.assertConstantQueries(self.patient, 'appointment-list', 1)
+
+    def test_prescription_list_for_doctor(self):
+        self.assertConstantQueries(self.doctor, 'prescription-list', 1)
+
+    def test_prescription_list_for_patient(self):
+        self.assertConstantQueries(self.patient, 'prescription-list', 1)
+
+    def test_appointment_timeline_for_doctor(self):
+        self.assertConstantQueries(self.doctor, 'appointment-timeline', 2)  # appointments + prefetched prescriptions
+
+    def test_appointment_timeline_for_patient(self):
+        self.assertConstantQueries(self.patient, 'appointment-timeline', 2)
+
+    def test_prescription_list_payload(self):
+        self.add_rows(1)
+        _, data = self.count_queries(self.doctor, 'prescription-list')
+        self.assertEqual(data[0]['doctor'], 'doc')
+        self.assertEqual(data[0]['patient'], 'pat1')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.client.force_authenticate(self.doctor)
+        dates = [None, datetime.date(2025, 1, 1), datetime.date(2025, 1, 2), None, datetime.date(2025, 1, 1)]
+        self.appointments = [
+            Appointment.objects.create(doctor=self.doctor, patient=self.patient, date=day)
+            for day in dates * 2
+        ]
+
+    def walk(self, url, direction='next'):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row['id'] for row in response.data['results']])
+            url = response.data[direction]
+        return pages
+
+    def test_pages_cover_every_row_once_in_order(self):
+        pages = self.walk(reverse('appointment-list') + '?page_size=3')
+        ids = [pk for page in pages for pk in page]
+        expected = list(
+            Appointment.objects.filter(doctor=self.doctor).order_by('-date', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+
+    def test_previous_links_walk_back(self):
+        url = reverse('appointment-list') + '?page_size=3'
+        forward = []
+        while url:
+            response = self.client.get(url)
+            forward.append([row['id'] for row in response.data['results']])
+            last, url = response, response.data['next']
+        backward = self.walk(last.data['previous'], direction='previous')
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_deep_page_costs_one_query(self):
+        response = self.client.get(reverse('appointment-list') + '?page_size=2')
+        url = response.data['next']
+        for _ in range(3):
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            url = response.data['next']
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('appointment-list') + '?cursor=bogus')
+        self.assertEqual(response.status_code, 404)
+
+    def test_prescriptions_paginate(self):
+        for appointment in self.appointments[:5]:
+            Prescription.objects.create(appointment=appointment, medicine_name='A', dosage='1', instructions='x')
+        pages = self.walk(reverse('prescription-list') + '?page_size=2')
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(ids, list(Prescription.objects.order_by('-issued_at', '-id').values_list('id', flat=True)))
+        # Owners are copied from the appointment, so pages are read from (doctor, issued_at, id).
+        owners = set(Prescription.objects.values_list('doctor_id', 'patient_id'))
+        self.assertEqual(owners, {(self.doctor.id, self.patient.id)})
+
+
+class QueryPlanCheckTests(TestCase):
+    def test_hot_paths_use_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', seed=10, stdout=out)
+        self.assertIn('All 13 hot paths use an index.', out.getvalue())
+        self.assertFalse(User.objects.exists())  # seed data is rolled back
+
+    def test_full_scan_detection(self):
+        from .management.commands.check_query_plans import plan_problems
+        self.assertEqual(plan_problems('2 0 0 SCAN api_appointment', 'sqlite'), ['full table scan'])
+        self.assertEqual(
+            plan_problems('2 0 0 SCAN api_appointment USING INDEX appt_doctor_date_idx', 'sqlite'), ['full index scan'],
+        )
+        self.assertEqual(plan_problems('5 0 0 SEARCH api_appointment USING INDEX x (doctor_id=?)', 'sqlite'), [])
+        sorted_search = '5 0 0 SEARCH t USING INDEX x (a=?)\n9 0 0 USE TEMP B-TREE FOR ORDER BY'
+        self.assertEqual(plan_problems(sorted_search, 'sqlite'), ['sort'])
+        covering = '2 0 0 SCAN api_appointment USING COVERING INDEX x'
+        self.assertEqual(plan_problems(covering, 'sqlite'), ['full covering index scan'])
+        self.assertEqual(plan_problems(covering, 'sqlite', unbounded=True), [])
+
+        self.assertEqual(
+            plan_problems('Seq Scan on api_appointment  (cost=0.00..1.01 rows=1)', 'postgresql'), ['full table scan'],
+        )
+        sort = 'Limit  (cost=1..2 rows=1)\n  ->  Sort  (cost=1..2 rows=1)\n        Sort Key: issued_at DESC'
+        self.assertEqual(plan_problems(sort, 'postgresql'), ['sort'])
+        full_index = 'Index Scan using api_prescription_pkey on api_prescription  (cost=1)\n  Filter: (doctor_id = 1)'
+        self.assertEqual(plan_problems(full_index, 'postgresql'), ['full index scan'])
+        searched = 'Index Scan using rx_doctor_issued_idx on api_prescription  (cost=1)\n  Index Cond: (doctor_id = 1)'
+        self.assertEqual(plan_problems(searched, 'postgresql'), [])
+
+    def test_pending_queue_filter(self):
+        doctor, patient = make_doctor('doc'), make_patient('pat')
+        pending = Appointment.objects.create(doctor=doctor, patient=patient)
+        Appointment.objects.create(doctor=doctor, patient=patient, status='confirmed')
+        client = APIClient()
+        client.force_authenticate(doctor)
+        response = client.get(reverse('appointment-list'), {'status': 'pending'})
+        self.assertEqual([row['id'] for row in response.data['results']], [pending.id])
+
+
+class SchedulingTests(TestCase):
+    monday = datetime.date(2030, 1, 7)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc', specialty='Cardiology')
+        self.patient = make_patient('pat')
+        self.profile = self.doctor.doctor_profile
+        DoctorAvailability.objects.create(
+            doctor=self.profile, weekday=0, start_time=datetime.time(9), end_time=datetime.time(11), slot_minutes=30
+        )
+
+    def confirm(self, appointment, time, day=None):
+        self.client.force_authenticate(self.doctor)
+        return self.client.patch(
+            reverse('appointment-update', args=[appointment.pk]),
+            {'status': 'confirmed', 'date': (day or self.monday).isoformat(), 'time': time},
+        )
+
+    def slots(self, url, **params):
+        self.client.force_authenticate(self.patient)
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_free_slots_skip_booked_and_non_working_days(self):
+        Appointment.objects.create(
+            doctor=self.doctor, patient=self.patient, status='confirmed', date=self.monday, time=datetime.time(9, 30)
+        )
+        data = self.slots(
+            reverse('doctor-slots', args=[self.profile.pk]),
+            start=self.monday.isoformat(), end=(self.monday + datetime.timedelta(days=7)).isoformat(),
+        )
+        self.assertEqual([slot['date'] for slot in data['slots']], [self.monday, self.monday + datetime.timedelta(days=7)])
+        self.assertEqual(data['slots'][0]['times'], [datetime.time(9), datetime.time(10), datetime.time(10, 30)])
+        self.assertEqual(len(data['slots'][1]['times']), 4)
+
+    def test_specialty_slots_query_count_is_constant(self):
+        for i in range(5):
+            other = make_doctor(f'doc{i}', specialty='Cardiology')
+            DoctorAvailability.objects.create(
+                doctor=other.doctor_profile, weekday=0, start_time=datetime.time(9), end_time=datetime.time(10)
+            )
+            Appointment.objects.create(
+                doctor=other, patient=self.patient, status='confirmed', date=self.monday, time=datetime.time(9)
+            )
+        self.client.force_authenticate(self.patient)
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse('specialty-slots'),
+                {'specialty': 'Cardiology', 'start': self.monday.isoformat(), 'end': self.monday.isoformat()},
+            )
+        doctors = {row['doctor']: row['slots'] for row in response.data['doctors']}
+        self.assertEqual(len(doctors), 6)
+        self.assertEqual(doctors[self.profile.pk][0]['times'][0], datetime.time(9))
+
+    def test_invalid_range(self):
+        self.client.force_authenticate(self.patient)
+        url = reverse('doctor-slots', args=[self.profile.pk])
+        self.assertEqual(self.client.get(url, {'start': 'tomorrow'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': '2030-01-07', 'end': '2030-06-01'}).status_code, 400)
+
+    def test_confirmation_rejects_double_booking(self):
+        first = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        second = Appointment.objects.create(doctor=self.doctor, patient=make_patient('pat2'))
+        self.assertEqual(self.confirm(first, '09:30').status_code, 200)
+        self.assertEqual(self.confirm(second, '09:30').status_code, 409)
+        self.assertEqual(self.confirm(second, '10:00').status_code, 200)
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.time), ('confirmed', datetime.time(10)))
+
+    def test_confirmation_outside_working_hours(self):
+        appointment = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        self.assertEqual(self.confirm(appointment, '09:15').status_code, 409)
+        self.assertEqual(self.confirm(appointment, '09:00', day=self.monday + datetime.timedelta(days=1)).status_code, 409)
+
+    def test_overlap_without_configured_hours(self):
+        DoctorAvailability.objects.all().delete()
+        first = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        second = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        self.assertEqual(self.confirm(first, '14:00').status_code, 200)
+        self.assertEqual(self.confirm(second, '14:20').status_code, 409)
+        self.assertEqual(self.confirm(second, '14:30').status_code, 200)
+
+    def test_doctor_manages_availability(self):
+        self.client.force_authenticate(self.doctor)
+        response = self.client.post(
+            reverse('doctor-availability'), {'weekday': 2, 'start_time': '13:00', 'end_time': '12:00'}
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            reverse('doctor-availability'), {'weekday': 2, 'start_time': '13:00', 'end_time': '17:00'}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get(reverse('doctor-availability')).data), 2)
+
+
+class BulkStatusUpdateTests(TestCase):
+    day = datetime.date(2030, 1, 7)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.client.force_authenticate(self.doctor)
+        self.url = reverse('appointment-bulk-update')
+
+    def create(self, count, doctor=None):
+        return Appointment.objects.bulk_create(
+            Appointment(doctor=doctor or self.doctor, patient=self.patient) for _ in range(count)
+        )
+
+    def test_hundreds_of_items_in_a_handful_of_queries(self):
+        appointments = self.create(300)
+        items = [
+            {'id': a.id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': f'{8 + i // 2:02d}:{30 * (i % 2):02d}'}
+            for i, a in enumerate(appointments[:20])
+        ] + [{'id': a.id, 'status': 'completed'} for a in appointments[20:]]
+        # appointments, doctor lock, availability, confirmed slots, bulk update, stats insert + update (+ savepoints)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['updated'], response.data['failed']), (300, 0))
+        self.assertLessEqual(len([q for q in ctx.captured_queries if 'SAVEPOINT' not in q['sql']]), 8)
+        self.assertEqual(Appointment.objects.filter(status='completed').count(), 280)
+        self.assertEqual(response.data['results'][0]['appointment']['status'], 'confirmed')
+
+    def test_per_item_errors(self):
+        mine = self.create(4)
+        theirs = self.create(1, doctor=make_doctor('other'))[0]
+        items = [
+            {'id': mine[0].id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': '10:00'},
+            {'id': mine[1].id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': '10:15'},
+            {'id': mine[2].id, 'status': 'pending'},
+            {'id': theirs.id, 'status': 'cancelled'},
+            {'id': mine[0].id, 'status': 'cancelled'},
+            {'id': mine[3].id, 'status': 'cancelled'},
+        ]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['ok'] for r in response.data['results']], [True, False, False, False, False, True])
+        self.assertIn('time', response.data['results'][1]['errors'])
+        theirs.refresh_from_db()
+        self.assertEqual(theirs.status, 'pending')
+
+    def test_released_slot_can_be_rebooked_in_same_batch(self):
+        first, second = self.create(2)
+        Appointment.objects.filter(pk=first.pk).update(status='confirmed', date=self.day, time=datetime.time(9))
+        items = [
+            {'id': first.id, 'status': 'cancelled'},
+            {'id': second.id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': '09:00'},
+        ]
+        response = self.client.post(self.url, items, format='json')
+        self.assertEqual(response.data['updated'], 2)
+
+    def test_release_later_in_the_batch_frees_the_slot(self):
+        taken, moved, pending, other = self.create(4)
+        Appointment.objects.filter(pk__in=[taken.pk, moved.pk]).update(status='confirmed', date=self.day)
+        Appointment.objects.filter(pk=taken.pk).update(time=datetime.time(9))
+        Appointment.objects.filter(pk=moved.pk).update(time=datetime.time(10))
+        # Confirmations come before the cancellation and the move that free their slots.
+        items = [
+            {'id': pending.id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': '09:00'},
+            {'id': other.id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': '10:00'},
+            {'id': moved.id, 'status': 'confirmed', 'date': self.day.isoformat(), 'time': '11:00'},
+            {'id': taken.id, 'status': 'cancelled'},
+        ]
+        for order in (items, items[::-1]):
+            with transaction.atomic():
+                response = self.client.post(self.url, order, format='json')
+                self.assertEqual((response.data['updated'], response.data['failed']), (4, 0))
+                slots = dict(Appointment.objects.filter(status='confirmed').values_list('id', 'time'))
+                self.assertEqual(slots, {
+                    pending.id: datetime.time(9), other.id: datetime.time(10), moved.id: datetime.time(11),
+                })
+                transaction.set_rollback(True)
+
+    def test_rejects_bad_payloads(self):
+        self.assertEqual(self.client.post(self.url, {'id': 1}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, [], format='json').status_code, 400)
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.post(self.url, [{'id': 1, 'status': 'cancelled'}], format='json').status_code, 403)
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserImportTests(TestCase):
+    def write_csv(self, rows):
+        handle = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, newline='')
+        handle.write('username,password,role,email,specialty,date_of_birth\n')
+        handle.writelines(f'{row}\n' for row in rows)
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def test_command_imports_in_batches_and_resumes(self):
+        make_patient('taken')
+        path = self.write_csv(
+            [f'doc{i},pw{i},doctor,doc{i}@example.com,Cardiology,' for i in range(5)]
+            + ['taken,pw,patient,,,', 'bad,pw,nurse,,,', 'p1,pw,patient,,,1990-02-03', 'p1,pw,patient,,,']
+        )
+        checkpoint = path + '.checkpoint'
+        self.addCleanup(lambda: os.path.exists(checkpoint) and os.remove(checkpoint))
+        out, err = StringIO(), StringIO()
+        call_command(
+            'import_users', path, batch_size=4, workers=2, checkpoint=checkpoint, stdout=out, stderr=err
+        )
+        self.assertIn('Imported 6 users', out.getvalue())
+        self.assertIn('rows/sec', out.getvalue())
+        self.assertEqual(err.getvalue().count('row '), 3)
+        doctor = User.objects.get(username='doc3')
+        self.assertTrue(doctor.check_password('pw3'))
+        self.assertEqual(doctor.doctor_profile.specialty, 'Cardiology')
+        self.assertEqual(User.objects.get(username='p1').patient_profile.date_of_birth, datetime.date(1990, 2, 3))
+        with open(checkpoint) as handle:
+            self.assertEqual(json.load(handle), {'position': 9})
+
+        # Resuming from the checkpoint reads nothing new.
+        out = StringIO()
+        call_command('import_users', path, workers=1, checkpoint=checkpoint, resume=True, stdout=out)
+        self.assertIn('Imported 0 users', out.getvalue())
+
+    def test_admin_api_imports_jsonl(self):
+        admin = User.objects.create(username='admin', is_staff=True)
+        lines = [{'username': f'pat{i}', 'password': 'secret', 'role': 'patient'} for i in range(3)]
+        upload = SimpleUploadedFile('users.jsonl', '\n'.join(json.dumps(line) for line in lines).encode())
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.post(reverse('user-import') + '?skip=1', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['position']), (2, 3))
+        self.assertEqual(PatientProfile.objects.count(), 2)
+
+        client.force_authenticate(make_doctor('doc'))
+        response = client.post(reverse('user-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 403)
+
+
+    def test_bad_lines_are_row_errors(self):
+        admin = User.objects.create(username='admin', is_staff=True)
+        lines = [
+            json.dumps({'username': 'pat0', 'password': 'secret', 'role': 'patient'}),
+            '{"username": "pat1", ',
+            '',
+            '[]',
+            json.dumps({'username': 5, 'password': 'secret', 'role': 'patient'}),
+            json.dumps({'username': 'pat2', 'password': 'secret', 'role': 'patient'}),
+        ]
+        client = APIClient()
+        client.force_authenticate(admin)
+        upload = SimpleUploadedFile('users.jsonl', '\n'.join(lines).encode())
+        response = client.post(reverse('user-import'), {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['created'], response.data['position']), (2, 5))
+        self.assertEqual([error['row'] for error in response.data['errors']], [2, 3, 4])
+        self.assertTrue(response.data['errors'][0]['error'].startswith('Line 2: invalid JSON'))
+        self.assertEqual(response.data['errors'][1]['error'], 'Line 4: expected a JSON object.')
+        self.assertEqual(response.data['errors'][2]['error'], 'Expected text for: username.')
+
+    def test_values_longer_than_their_column_are_row_errors(self):
+        rows = [
+            {'username': 'u' * 151, 'password': 'pw', 'role': 'patient'},
+            {'username': 'doc', 'password': 'pw', 'role': 'doctor', 'specialty': 's' * 101},
+            {'username': 'ok', 'password': 'pw', 'role': 'patient', 'first_name': 'f' * 150},
+        ]
+        report = import_users(rows)
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.errors, [
+            {'row': 1, 'error': 'Too long: username (max 150).'},
+            {'row': 2, 'error': 'Too long: specialty (max 100).'},
+        ])
+
+    def test_username_taken_during_the_batch(self):
+        rows = [{'username': name, 'password': 'pw', 'role': 'patient'} for name in ('new', 'raced')]
+        make_patient('raced')
+        # The first check misses the row a concurrent registration commits before the insert.
+        with mock.patch('api.importer._taken', side_effect=[set(), {'raced'}]):
+            report = import_users(rows)
+        self.assertEqual(report.created, 1)
+        self.assertEqual(report.errors, [{'row': 2, 'error': 'Username already exists: raced.'}])
+        self.assertTrue(User.objects.filter(username='new').exists())
+
+
+@override_settings(DIRECTORY_CACHE=True)
+class DirectoryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.patient = make_patient('pat')
+        self.doctor = make_doctor('doc', specialty='Cardiology')
+        self.client.force_authenticate(self.patient)
+        self.url = reverse('available-doctors')
+
+    def test_hit_serves_without_queries_and_supports_etag(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.status_code, 200)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    @override_settings(DIRECTORY_CACHE=False)
+    def test_off_without_a_shared_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(2):  # the doctors and their tags, read again
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_doctor_changes_invalidate(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            DoctorProfile.objects.filter(pk=self.doctor.doctor_profile.pk).first().save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)  # unchanged content keeps its ETag
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.first_name = 'Ada'
+            self.doctor.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data[0]['user']['first_name'], 'Ada')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_irrelevant_saves_keep_the_cache(self):
+        from .cache import stats
+        self.client.get(self.url)
+        before = dict(stats)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.patient.save()
+            self.doctor.save(update_fields=['last_login'])
+        self.assertEqual(callbacks, [])
+        self.client.get(self.url)
+        self.assertEqual(stats['hits'], before['hits'] + 1)
+
+    def test_stats_endpoint_is_admin_only(self):
+        self.assertEqual(self.client.get(reverse('doctor-cache-stats')).status_code, 403)
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        self.assertEqual(set(self.client.get(reverse('doctor-cache-stats')).data), {'hits', 'misses', 'not_modified', 'invalidations'})
+
+
+class DoctorDirectoryFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(make_patient('pat'))
+        self.ada = make_doctor('ada', specialty='Cardiology')
+        self.ada.first_name, self.ada.last_name = 'Ada', 'Lovelace'
+        self.ada.save()
+        profile = self.ada.doctor_profile
+        profile.refresh_from_db()
+        profile.bio = 'Heart rhythm disorders'
+        profile.save()
+        profile.tags.add('adults', 'arrhythmia')
+        self.grace = make_doctor('grace', specialty='Pediatrics')
+        self.grace.doctor_profile.tags.add('children')
+
+    def usernames(self, **params):
+        cache.clear()
+        response = self.client.get(reverse('available-doctors'), params)
+        self.assertEqual(response.status_code, 200)
+        return sorted(row['user']['username'] for row in response.data)
+
+    def test_specialty_and_tag_filters(self):
+        self.assertEqual(self.usernames(specialty='Pediatrics'), ['grace'])
+        self.assertEqual(self.usernames(tag='children,arrhythmia'), ['ada', 'grace'])
+        self.assertEqual(self.usernames(tag='adults'), ['ada'])
+        self.assertEqual(self.usernames(specialty='Pediatrics', tag='adults'), [])
+
+    def test_full_text_search(self):
+        self.assertEqual(self.usernames(q='ada card'), ['ada'])
+        self.assertEqual(self.usernames(q='rhyth'), ['ada'])
+        self.assertEqual(self.usernames(q='LOVELACE'), ['ada'])
+        self.assertEqual(self.usernames(q='pediatrics'), ['grace'])
+        self.assertEqual(self.usernames(q='ada pediatrics'), [])
+        self.assertEqual(self.usernames(q='"*'), ['ada', 'grace'])
+
+    def test_search_follows_renames_and_deletes(self):
+        self.grace.last_name = 'Hopper'
+        self.grace.save()
+        self.assertEqual(self.usernames(q='hopper'), ['grace'])
+        self.grace.delete()
+        self.assertEqual(self.usernames(q='hopper'), [])
+
+    def test_tags_are_rendered_and_editable(self):
+        response = self.client.get(reverse('doctor-list'), {'specialty': 'Cardiology'})
+        self.assertEqual(sorted(response.data[0]['tags']), ['adults', 'arrhythmia'])
+        self.client.force_authenticate(self.grace)
+        response = self.client.patch(
+            reverse('doctor-detail', args=[self.grace.doctor_profile.pk]), {'tags': ['newborns']}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(self.grace.doctor_profile.tags.names()), ['newborns'])
+
+
+@override_settings(
+    JWT_CLAIMS_AUTH=True,
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        clear_user_state()
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.doctor.set_password('secret')
+        self.doctor.save()
+        patient = make_patient('pat')
+        Appointment.objects.create(doctor=self.doctor, patient=patient, date=datetime.date(2030, 1, 1))
+
+    def login(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'doc', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        return AccessToken(response.data['access'])
+
+    def list_appointments(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('appointment-list'))
+        return response, len(ctx.captured_queries)
+
+    def test_token_carries_role_and_profile(self):
+        token = self.login()
+        self.assertEqual(token['role'], 'doctor')
+        self.assertEqual(token['profile_id'], self.doctor.doctor_profile.pk)
+
+    def test_list_skips_user_lookup(self):
+        self.login()
+        response, queries = self.list_appointments()
+        self.assertEqual((response.status_code, len(response.data['results'])), (200, 1))
+        self.assertEqual(queries, 2)  # revocation state + appointments
+        response, queries = self.list_appointments()
+        self.assertEqual((response.status_code, queries), (200, 1))
+
+    def test_deactivated_user_is_rejected(self):
+        self.login()
+        self.list_appointments()
+        self.doctor.is_active = False
+        self.doctor.save()
+        self.assertEqual(self.list_appointments()[0].status_code, 401)
+
+    @override_settings(JWT_CLAIMS_REVOCATION_TTL=0)
+    def test_role_change_is_rejected_after_ttl(self):
+        self.login()
+        User.objects.filter(pk=self.doctor.pk).update(role='patient')
+        self.assertEqual(self.list_appointments()[0].status_code, 401)
+
+    def test_staff_claim_opens_stats_and_calendar(self):
+        admin = User.objects.create(username='admin', is_staff=True)
+        token = ClaimsTokenObtainPairSerializer.get_token(admin).access_token
+        self.assertIs(token['is_staff'], True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        for name in ('doctor-stats', 'doctor-calendar'):
+            response = self.client.get(reverse(name, args=[self.doctor.doctor_profile.pk]))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertIsInstance(response.wsgi_request.user, ClaimsUser)
+
+    @override_settings(JWT_CLAIMS_REVOCATION_TTL=0)
+    def test_staff_change_is_rejected_after_ttl(self):
+        admin = User.objects.create(username='admin', is_staff=True)
+        token = ClaimsTokenObtainPairSerializer.get_token(admin).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        User.objects.filter(pk=admin.pk).update(is_staff=False)
+        self.assertEqual(self.list_appointments()[0].status_code, 401)
+
+    def test_token_without_staff_claim_loads_the_user(self):
+        admin = User.objects.create(username='admin', is_staff=True)
+        token = ClaimsTokenObtainPairSerializer.get_token(admin).access_token
+        del token['is_staff']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = self.client.get(reverse('doctor-stats', args=[self.doctor.doctor_profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, admin)
+
+    def test_prescriptions_list_for_claims_user(self):
+        self.login()
+        response = self.client.get(reverse('prescription-list'))
+        self.assertEqual((response.status_code, response.data['results']), (200, []))
+
+    def test_claims_user_id_is_an_integer(self):
+        self.login()
+        response = self.client.get(reverse('doctor-stats', args=[self.doctor.doctor_profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user.pk, self.doctor.pk)
+
+    def test_own_calendar_and_prescription_create(self):
+        self.login()
+        response = self.client.get(reverse('doctor-calendar', args=[self.doctor.doctor_profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'BEGIN:VCALENDAR', response.content)
+        appointment = Appointment.objects.get()
+        response = self.client.post(
+            reverse('prescription-create'), {'appointment': appointment.pk, 'medicine_name': 'Rest', 'dosage': '-', 'instructions': 'Sleep'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_patient_exports_own_record(self):
+        patient = User.objects.get(username='pat')
+        patient.set_password('secret')
+        patient.save()
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'pat', 'password': 'secret'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+        response = self.client.get(reverse('patient-export', args=[patient.patient_profile.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('patient', json.loads(next(iter(response.streaming_content))))
+
+    def test_token_without_claims_falls_back_to_database(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.doctor)}")
+        response, queries = self.list_appointments()
+        self.assertEqual((response.status_code, queries), (200, 2))  # user row + appointments
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.client.force_authenticate(self.doctor)
+
+    def test_sampling_off_records_nothing(self):
+        self.client.get(reverse('appointment-list'))
+        self.assertEqual(metrics.snapshot(), {})
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1.0)
+    def test_records_per_url_name(self):
+        for _ in range(3):
+            response = self.client.get(reverse('appointment-list'))
+        series = metrics.snapshot()['appointment-list']
+        self.assertEqual(series['wall']['count'], 3)
+        self.assertEqual(series['db_queries']['p50'], 1)
+        self.assertEqual(series['size']['p99'], len(response.content))
+        self.assertGreater(series['render']['sum'], 0)
+        self.assertLessEqual(series['db']['p99'], series['wall']['p99'])
+
+    @override_settings(REQUEST_METRICS_SAMPLE_RATE=1.0)
+    def test_prometheus_endpoint_is_admin_only(self):
+        self.client.get(reverse('doctor-list'))
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.client.force_authenticate(User.objects.create(username='admin', is_staff=True))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        body = response.content.decode()
+        self.assertIn('api_request_duration_seconds{view="doctor-list",quantile="0.95"}', body)
+        self.assertIn('api_request_db_queries_count{view="doctor-list"} 1', body)
+        self.assertIn('api_directory_cache_events_total{event="misses"}', body)
+
+    def test_reservoir_is_bounded(self):
+        reservoir = metrics.Reservoir(100)
+        for value in range(10000):
+            reservoir.add(value)
+        self.assertEqual((reservoir.count, len(reservoir.samples)), (10000, 100))
+        self.assertEqual(reservoir.total, sum(range(10000)))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class BenchmarkCommandTests(TestCase):
+    def run_benchmark(self, *args):
+        out = StringIO()
+        call_command(
+            'benchmark', '--doctors', '3', '--patients', '5', '--appointments', '20', '--prescriptions', '5',
+            '--requests', '2', '--warmup', '0', *args, stdout=out,
+        )
+        return out.getvalue()
+
+    def test_every_route_is_benchmarked_and_checked_against_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            baseline = os.path.join(directory, 'baseline.json')
+            self.run_benchmark('--baseline', baseline, '--save-baseline')
+            with open(baseline) as handle:
+                results = json.load(handle)
+            routes = {pattern.name for pattern in api_urls.urlpatterns}
+            self.assertEqual(set(results), routes)
+            self.assertTrue(all(result['requests'] >= 1 for result in results.values()))
+
+            self.assertIn('No regressions', self.run_benchmark('--baseline', baseline, '--ignore-latency'))
+
+            results['appointment-list']['queries'] = 0
+            with open(baseline, 'w') as handle:
+                json.dump(results, handle)
+            with self.assertRaisesMessage(CommandError, 'appointment-list'):
+                self.run_benchmark('--baseline', baseline, '--ignore-latency', '--only', 'appointment-list')
+
+
+    def test_committed_baseline_covers_every_route(self):
+        with open(DEFAULT_BASELINE) as handle:
+            baseline = json.load(handle)
+        self.assertEqual(set(baseline), {pattern.name for pattern in api_urls.urlpatterns})
+
+@override_settings(JWT_CLAIMS_AUTH=True)
+class AsyncListViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        clear_user_state()
+        self.doctor = make_doctor('doc', specialty='Cardiology')
+        self.patient = make_patient('pat')
+        for day in range(1, 8):
+            appointment = Appointment.objects.create(
+                doctor=self.doctor, patient=self.patient, date=datetime.date(2030, 1, day), status='completed',
+            )
+            Prescription.objects.create(appointment=appointment, medicine_name='Rx', dosage='1', instructions='-')
+        self.client = APIClient()
+
+    def login(self, user):
+        token = ClaimsTokenObtainPairSerializer.get_token(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def assertSameResponses(self, sync_name, async_name, params=None):
+        sync_response = self.client.get(reverse(sync_name), params)
+        async_response = self.client.get(reverse(async_name), params)
+        self.assertEqual(sync_response.status_code, 200)
+        self.assertEqual(async_response.status_code, 200)
+        # Pagination links point at the view that served the page.
+        content = async_response.content.replace(reverse(async_name).encode(), reverse(sync_name).encode())
+        self.assertEqual(content, sync_response.content)
+        self.assertEqual(async_response['Content-Type'], sync_response['Content-Type'])
+        return json.loads(async_response.content)
+
+    def test_responses_match_sync_views(self):
+        self.login(self.doctor)
+        self.assertSameResponses('appointment-list', 'async-appointment-list')
+        self.assertSameResponses('prescription-list', 'async-prescription-list')
+        self.login(self.patient)
+        self.assertSameResponses('doctor-list', 'async-doctor-list', {'specialty': 'Cardiology'})
+        self.assertSameResponses('prescription-list', 'async-prescription-list')
+
+    def test_cursor_pages_match_sync_views(self):
+        self.login(self.patient)
+        page = self.assertSameResponses('appointment-list', 'async-appointment-list', {'page_size': 3})
+        cursor = parse_qs(urlsplit(page['next']).query)['cursor'][0]
+        page = self.assertSameResponses('appointment-list', 'async-appointment-list', {'page_size': 3, 'cursor': cursor})
+        self.assertEqual([row['date'] for row in page['results']], ['2030-01-04', '2030-01-03', '2030-01-02'])
+
+    @override_settings(DELTA_SYNC_SETTLE_SECONDS=0)
+    def test_delta_sync_matches_sync_views(self):
+        self.login(self.doctor)
+        # Freeze the clock so both views issue the same sync token.
+        with mock.patch('api.sync.timezone.now', return_value=timezone.now()):
+            data = self.assertSameResponses('appointment-list', 'async-appointment-list', {'since': ''})
+        self.assertEqual(len(data['results']), 7)
+        deleted = Appointment.objects.order_by('date').first()
+        deleted_id = deleted.id
+        deleted.delete()
+        with mock.patch('api.sync.timezone.now', return_value=timezone.now()):
+            params = {'since': data['since']}
+            data = self.assertSameResponses('appointment-list', 'async-appointment-list', params)
+            self.assertEqual((data['results'], data['deleted']), ([], [deleted_id]))
+            data = self.assertSameResponses('prescription-list', 'async-prescription-list', params)
+            self.assertEqual(len(data['deleted']), 1)
+        response = self.client.get(reverse('async-appointment-list'), {'since': 'bogus'})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(DIRECTORY_CACHE=True)
+    def test_directory_etag(self):
+        self.login(self.patient)
+        etag = self.client.get(reverse('async-doctor-list'))['ETag']
+        self.assertEqual(self.client.get(reverse('doctor-list'))['ETag'], etag)
+        response = self.client.get(reverse('async-doctor-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_authentication_errors(self):
+        response = self.client.get(reverse('async-appointment-list'))
+        self.assertEqual(response.status_code, 403)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer not-a-token')
+        response = self.client.get(reverse('async-appointment-list'))
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+        self.login(self.doctor)
+        User.objects.filter(pk=self.doctor.pk).update(is_active=False)
+        clear_user_state()
+        self.assertEqual(self.client.get(reverse('async-appointment-list')).status_code, 401)
+
+
+class RowSerializerTests(TestCase):
+    """Compiled list serialization must render exactly what the DRF serializers render."""
+
+    def setUp(self):
+        self.doctor = make_doctor('doc', specialty='Cardiology')
+        DoctorProfile.objects.get(user=self.doctor).tags.add('night', 'children', 'adults')
+        make_doctor('untagged')
+        self.patient = make_patient('pat')
+        for day in range(1, 4):
+            appointment = Appointment.objects.create(
+                doctor=self.doctor, patient=self.patient, date=datetime.date(2030, 1, day),
+                time=datetime.time(9, 30), status='completed', notes='Bring results' if day == 1 else None,
+            )
+            Prescription.objects.create(appointment=appointment, medicine_name='Rx', dosage='1', instructions='-')
+
+    def assertRendersLikeDRF(self, serializer_class, model):
+        compiled = compile_serializer(serializer_class)
+        self.assertIsNotNone(compiled)
+        queryset = model.objects.order_by('pk')
+        expected = serializer_class(serializer_class.shape_queryset(queryset), many=True).data
+        rows = compiled.serialize(compiled.fetch(queryset))
+        self.assertEqual(JSONRenderer().render(rows), JSONRenderer().render(expected))
+        return rows
+
+    def test_matches_drf_output(self):
+        self.assertRendersLikeDRF(AppointmentSerializer, Appointment)
+        self.assertRendersLikeDRF(PrescriptionSerializer, Prescription)
+        self.assertRendersLikeDRF(PatientProfileSerializer, PatientProfile)
+        doctors = self.assertRendersLikeDRF(DoctorProfileSerializer, DoctorProfile)
+        self.assertEqual([doctor['tags'] for doctor in doctors], [['adults', 'children', 'night'], []])
+
+    def test_unsupported_fields_fall_back(self):
+        class WithMethodField(AppointmentSerializer):
+            label = serializers.SerializerMethodField()
+
+            class Meta(AppointmentSerializer.Meta):
+                fields = [*AppointmentSerializer.Meta.fields, 'label']
+
+            def get_label(self, obj):
+                return str(obj)
+
+        self.assertIsNone(compile_serializer(WithMethodField))
+        client = APIClient()
+        client.force_authenticate(self.doctor)
+        with mock.patch.object(AppointmentListView, 'serializer_class', WithMethodField):
+            response = client.get(reverse('appointment-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['label'].startswith('Appointment: pat with doc'))
+
+
+    def test_string_relation_without_str_fields_falls_back(self):
+        class Copy(AppointmentSerializer):
+            pass
+
+        with mock.patch.object(User, 'str_fields', None):
+            self.assertIsNone(compile_serializer(Copy))
+
+class PatientExportTests(TestCase):
+    def setUp(self):
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.profile = self.patient.patient_profile
+        for day in (3, 1, 2):
+            appointment = Appointment.objects.create(
+                doctor=self.doctor, patient=self.patient, date=datetime.date(2030, 1, day), status='completed',
+            )
+            if day != 2:
+                Prescription.objects.create(appointment=appointment, medicine_name=f'Rx{day}', dosage='1', instructions='-')
+        Appointment.objects.create(doctor=self.doctor, patient=make_patient('other'), date=datetime.date(2030, 1, 1))
+        self.client = APIClient()
+
+    def export(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get(reverse('patient-export', args=[self.profile.pk]))
+
+    def test_streams_record_as_json_lines(self):
+        response = self.export(self.patient)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(lines[0]['patient']['user']['username'], 'pat')
+        appointments = [line['appointment'] for line in lines[1:]]
+        self.assertEqual([a['date'] for a in appointments], ['2030-01-01', '2030-01-02', '2030-01-03'])
+        self.assertEqual([a['prescription'] and a['prescription']['medicine_name'] for a in appointments], ['Rx1', None, 'Rx3'])
+        self.assertEqual(appointments[0]['doctor'], 'doc (doctor)')
+
+    def test_reads_appointments_in_chunks(self):
+        chunks = list(export_lines(self.profile, chunk_size=2))
+        self.assertEqual([chunk.count(b'\n') for chunk in chunks], [1, 2, 1])
+
+    def test_falls_back_to_the_regular_serializers(self):
+        compiled = list(export_lines(self.profile, chunk_size=2))
+        with mock.patch('api.export.compile_serializer', return_value=None):
+            # one cursor over the appointments, then one prescription query per chunk
+            with self.assertNumQueries(1 + 2):
+                self.assertEqual(list(export_lines(self.profile, chunk_size=2)), compiled)
+
+    def test_access(self):
+        self.assertEqual(self.export(self.doctor).status_code, 200)
+        self.assertEqual(self.export(make_doctor('stranger')).status_code, 403)
+        self.assertEqual(self.export(make_patient('someone')).status_code, 403)
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.get(reverse('patient-export', args=[0])).status_code, 404)
+
+
+class DoctorStatsTests(TestCase):
+    day = datetime.date(2030, 1, 7)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.profile = self.doctor.doctor_profile
+        self.patient = make_patient('pat')
+        self.url = reverse('doctor-stats', args=[self.profile.pk])
+
+    def request_appointment(self):
+        self.client.force_authenticate(self.patient)
+        response = self.client.post(reverse('appointment-request'), {'doctor': self.profile.pk}, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Appointment.objects.latest('id')
+
+    def stats(self, start, end=None):
+        self.client.force_authenticate(self.doctor)
+        response = self.client.get(self.url, {'start': start.isoformat(), 'end': (end or start).isoformat()})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def counts(self, day):
+        row = self.stats(day)['days'][0]
+        return {status: row[status] for status in ('pending', 'confirmed', 'cancelled', 'completed') if row[status]}
+
+    def test_counters_follow_requests_and_transitions(self):
+        today = timezone.localdate()
+        first, second, third = (self.request_appointment() for _ in range(3))
+        self.assertEqual(self.counts(today), {'pending': 3})
+
+        self.client.force_authenticate(self.doctor)
+        response = self.client.patch(
+            reverse('appointment-update', args=[first.pk]),
+            {'status': 'confirmed', 'date': self.day.isoformat(), 'time': '10:00'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.client.patch(reverse('appointment-update', args=[second.pk]), {'status': 'cancelled'})
+        self.client.post(
+            reverse('appointment-bulk-update'),
+            [{'id': first.pk, 'status': 'completed'}, {'id': third.pk, 'status': 'confirmed', 'date': self.day.isoformat()}],
+            format='json',
+        )
+        self.assertEqual(self.counts(today), {'cancelled': 1})
+        self.assertEqual(self.counts(self.day), {'confirmed': 1, 'completed': 1})
+
+        # The incremental counters agree with a rebuild from the appointments.
+        incremental = list(DoctorDailyStats.objects.order_by('day').values('day', 'pending', 'confirmed', 'cancelled', 'completed'))
+        call_command('rebuild_stats', stdout=StringIO())
+        rebuilt = list(DoctorDailyStats.objects.order_by('day').values('day', 'pending', 'confirmed', 'cancelled', 'completed'))
+        self.assertEqual([row for row in incremental if any(v for k, v in row.items() if k != 'day')], rebuilt)
+
+    def test_range_is_read_from_daily_rows(self):
+        for offset, status in ((0, 'completed'), (0, 'cancelled'), (2, 'completed')):
+            Appointment.objects.create(
+                doctor=self.doctor, patient=self.patient, status=status, date=self.day + datetime.timedelta(days=offset),
+            )
+        call_command('rebuild_stats', stdout=StringIO())
+        with CaptureQueriesContext(connection) as ctx:
+            data = self.stats(self.day, self.day + datetime.timedelta(days=3))
+        self.assertEqual(len(ctx.captured_queries), 2)  # profile, daily rows
+        self.assertEqual([day['completed'] for day in data['days']], [1, 0, 1, 0])
+        self.assertEqual(data['totals'], {'pending': 0, 'confirmed': 0, 'cancelled': 1, 'completed': 2})
+
+    def test_access_and_validation(self):
+        self.client.force_authenticate(make_doctor('other'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(self.doctor)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(self.client.get(self.url, {'start': '2030-01-01', 'end': '2031-06-01'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'start': 'yesterday'}).status_code, 400)
+
+
+
+@override_settings(JOB_BACKEND='api.jobs.ImmediateBackend')
+class CalendarFeedTests(TestCase):
+    day = datetime.date(2030, 1, 7)
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.url = reverse('doctor-calendar', args=[self.doctor.doctor_profile.pk])
+        self.confirmed = Appointment.objects.create(
+            doctor=self.doctor, patient=self.patient, status='confirmed', date=self.day,
+            time=datetime.time(9, 0), notes='Follow-up; bring results',
+        )
+        self.pending = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        self.client.force_authenticate(self.doctor)
+
+    def uids(self, response):
+        return [line for line in response.content.decode().split('\r\n') if line.startswith('UID:')]
+
+    def test_feed_lists_confirmed_appointments(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        body = response.content.decode()
+        self.assertTrue(body.startswith('BEGIN:VCALENDAR\r\n') and body.endswith('END:VCALENDAR\r\n'))
+        self.assertEqual(self.uids(response), [f'UID:appointment-{self.confirmed.pk}@hospital-management-api'])
+        self.assertIn('DESCRIPTION:Follow-up\\; bring results\r\n', body)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+    @override_settings(JWT_CLAIMS_AUTH=True)
+    def test_unchanged_feed_is_answered_304_from_the_cache(self):
+        clear_user_state()
+        self.addCleanup(clear_user_state)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {ClaimsTokenObtainPairSerializer.get_token(self.doctor).access_token}')
+        etag = client.get(self.url)['ETag']
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(len(ctx.captured_queries), 1)  # the version of the doctor's appointments
+
+    def test_if_modified_since(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2001 00:00:00 GMT').status_code, 200,
+        )
+
+    @override_settings(CALENDAR_PATCHING=True)
+    def test_changes_patch_the_cached_feed(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('appointment-update', args=[self.pending.pk]),
+                {'status': 'confirmed', 'date': self.day.isoformat(), 'time': '08:00'},
+            )
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(ctx.captured_queries), 2)  # the profile and the version: served from the patched cache
+        self.assertEqual(self.uids(response), [
+            f'UID:appointment-{self.pending.pk}@hospital-management-api',  # 08:00 sorts first
+            f'UID:appointment-{self.confirmed.pk}@hospital-management-api',
+        ])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('appointment-bulk-update'), [{'id': self.pending.pk, 'status': 'cancelled'}], format='json',
+            )
+            self.confirmed.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(self.uids(response), [])
+        cache.clear()
+        self.assertEqual(self.client.get(self.url).content, response.content)  # same as a rebuild
+
+    @override_settings(JOB_BACKEND='api.jobs.DatabaseBackend', CALENDAR_PATCHING=True)
+    def test_feed_changed_elsewhere_is_rebuilt(self):
+        etag = self.client.get(self.url)['ETag']
+        # The refresh job hasn't run (or ran in a process with its own cache).
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('appointment-update', args=[self.confirmed.pk]), {'status': 'completed'})
+        self.assertTrue(Job.objects.filter(name='calendar-refresh').exists())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, self.uids(response)), (200, []))
+
+    @override_settings(JOB_BACKEND='api.jobs.DatabaseBackend')
+    def test_changes_rebuild_the_feed_without_patching(self):
+        # The default with a per-process cache: the worker couldn't patch the web process's copy.
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('appointment-update', args=[self.confirmed.pk]), {'status': 'completed'})
+        self.assertFalse(Job.objects.filter(name='calendar-refresh').exists())
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, self.uids(response)), (200, []))
+
+    @override_settings(JOB_BACKEND='api.jobs.DatabaseBackend', CALENDAR_PATCHING=True)
+    def test_uncached_feed_is_not_refreshed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(reverse('appointment-update', args=[self.confirmed.pk]), {'status': 'completed'})
+        self.assertFalse(Job.objects.filter(name='calendar-refresh').exists())
+
+    def test_access(self):
+        self.client.force_authenticate(make_doctor('other'))
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get(reverse('doctor-calendar', args=[0])).status_code, 404)
+
+
+
+class AppointmentTimelineTests(TestCase):
+    def setUp(self):
+        audit.reset()
+        self.addCleanup(audit.reset)
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.other = make_patient('other')
+        self.appointments = [
+            Appointment.objects.create(doctor=self.doctor, patient=patient, date=datetime.date(2030, 1, day))
+            for day, patient in ((1, self.patient), (2, self.other), (3, self.patient))
+        ]
+        self.prescription = Prescription.objects.create(
+            appointment=self.appointments[0], medicine_name='Paracetamol', dosage='500mg', instructions='Daily',
+        )
+        self.url = reverse('appointment-timeline')
+
+    def get(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_prescriptions_are_embedded(self):
+        results = self.get(self.patient)['results']
+        self.assertEqual([row['id'] for row in results], [self.appointments[2].id, self.appointments[0].id])
+        self.assertIsNone(results[0]['prescription'])
+        self.assertEqual(results[1]['prescription'], {
+            'id': self.prescription.id, 'medicine_name': 'Paracetamol', 'dosage': '500mg', 'instructions': 'Daily',
+            'issued_at': PrescriptionSerializer(self.prescription).data['issued_at'],
+        })
+        self.assertEqual(results[1]['doctor'], 'doc (doctor)')
+
+        results = self.get(self.doctor, patient=self.other.id)['results']
+        self.assertEqual([row['id'] for row in results], [self.appointments[1].id])
+        self.assertEqual(self.client.get(self.url, {'patient': 'me'}).status_code, 400)
+
+    def test_field_selection(self):
+        self.client.force_authenticate(self.patient)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url, {'fields': 'id,date'})
+        self.assertEqual(len(ctx.captured_queries), 1)  # no join, no prefetch
+        self.assertEqual(response.data['results'][0], {'id': self.appointments[2].id, 'date': '2030-01-03'})
+        results = self.get(self.patient, fields='prescription')['results']
+        self.assertEqual([row['prescription'] and row['prescription']['id'] for row in results], [None, self.prescription.id])
+        response = self.client.get(self.url, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(str(response.data['fields']), 'Unknown fields: secret.')
+
+    def test_cursor_paging(self):
+        data = self.get(self.doctor, page_size=2)
+        self.assertEqual(len(data['results']), 2)
+        self.client.force_authenticate(self.doctor)
+        rest = self.client.get(data['next']).data
+        self.assertEqual(
+            [row['id'] for row in data['results'] + rest['results']], [a.id for a in reversed(self.appointments)],
+        )
+        self.assertIsNone(rest['next'])
+
+    def test_reads_are_audited(self):
+        self.get(self.patient, fields='date,prescription')
+        audit.flush()
+        self.assertEqual(
+            sorted((event.kind, event.object_ids) for event in AuditEvent.objects.filter(patient_id=self.patient.id)),
+            [
+                ('appointment', [self.appointments[2].id, self.appointments[0].id]),
+                ('prescription', [self.prescription.id]),
+            ],
+        )
+
+
+# Expected status per caller: anonymous, patient, other patient, doctor, other doctor, admin
+ACCESS_MATRIX = {
+    'user-register': (201, 201, 201, 201, 201, 201),
+    'user-import': (401, 403, 403, 403, 403, 200),
+    'doctor-list': (401, 200, 200, 200, 200, 200),
+    'doctor-detail': (401, 403, 403, 200, 404, 403),
+    'doctor-cache-stats': (401, 403, 403, 403, 403, 200),
+    'metrics': (401, 403, 403, 403, 403, 200),
+    'audit-log': (401, 403, 403, 403, 403, 200),
+    'patient-list': (401, 403, 403, 200, 200, 403),
+    'patient-detail': (401, 200, 404, 403, 403, 403),
+    'patient-export': (401, 200, 403, 200, 403, 403),
+    'available-doctors': (401, 200, 200, 403, 403, 403),
+    'doctor-availability': (401, 403, 403, 200, 200, 403),
+    'doctor-slots': (401, 200, 200, 200, 200, 200),
+    'specialty-slots': (401, 200, 200, 200, 200, 200),
+    'doctor-stats': (401, 403, 403, 200, 403, 200),
+    'doctor-calendar': (401, 403, 403, 200, 403, 200),
+    'appointment-request': (401, 201, 201, 403, 403, 403),
+    'appointment-list': (401, 200, 200, 200, 200, 200),
+    'appointment-update': (401, 403, 403, 200, 404, 403),
+    'appointment-bulk-update': (401, 403, 403, 200, 200, 403),
+    'appointment-timeline': (401, 200, 200, 200, 200, 200),
+    'prescription-list': (401, 200, 200, 200, 200, 200),
+    'prescription-create': (401, 403, 403, 201, 400, 403),
+    'async-doctor-list': (403, 200, 200, 200, 200, 200),
+    'async-appointment-list': (403, 200, 200, 200, 200, 200),
+    'async-prescription-list': (403, 200, 200, 200, 200, 200),
+    'token_obtain_pair': (200, 200, 200, 200, 200, 200),
+    'token_refresh': (200, 200, 200, 200, 200, 200),
+}
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AccessControlTests(TestCase):
+    """Every route, called by every kind of user."""
+
+    def setUp(self):
+        cache.clear()
+        clear_user_state()
+        self.doctor = make_doctor('doc')
+        self.doctor.set_password('doc-password')
+        self.doctor.save()
+        self.patient = make_patient('pat')
+        self.callers = [
+            None, self.patient, make_patient('other-pat'), self.doctor, make_doctor('other-doc'),
+            User.objects.create(username='admin', is_staff=True, is_superuser=True),
+        ]
+        self.appointment = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        prescribed = Appointment.objects.create(doctor=self.doctor, patient=self.patient, status='completed')
+        Prescription.objects.create(appointment=prescribed, medicine_name='Rx', dosage='1', instructions='-')
+        self.unprescribed = Appointment.objects.create(doctor=self.doctor, patient=self.patient, status='completed')
+        self.calls = 0
+
+    def build_request(self, name):
+        """Return (method, path, data, format) of a valid call to route `name`."""
+        self.calls += 1
+        doctor_pk, patient_pk = self.doctor.doctor_profile.pk, self.patient.patient_profile.pk
+        if name == 'user-register':
+            return 'post', reverse(name), {'username': f'new{self.calls}', 'password': 'x', 'role': 'patient'}, 'json'
+        if name == 'user-import':
+            upload = SimpleUploadedFile('users.csv', f'username,password,role\nimported{self.calls},x,patient\n'.encode())
+            return 'post', reverse(name), {'file': upload}, 'multipart'
+        if name in ('doctor-detail', 'doctor-slots', 'doctor-stats', 'doctor-calendar'):
+            return 'get', reverse(name, args=[doctor_pk]), None, None
+        if name in ('patient-detail', 'patient-export'):
+            return 'get', reverse(name, args=[patient_pk]), None, None
+        if name == 'specialty-slots':
+            return 'get', reverse(name), {'specialty': 'General'}, None
+        if name == 'appointment-request':
+            return 'post', reverse(name), {'doctor': doctor_pk}, 'json'
+        if name == 'appointment-update':
+            return 'patch', reverse(name, args=[self.appointment.pk]), {'status': 'cancelled'}, 'json'
+        if name == 'appointment-bulk-update':
+            return 'post', reverse(name), [{'id': self.appointment.pk, 'status': 'cancelled'}], 'json'
+        if name == 'prescription-create':
+            data = {'appointment': self.unprescribed.pk, 'medicine_name': 'Rx', 'dosage': '1', 'instructions': '-'}
+            return 'post', reverse(name), data, 'json'
+        if name == 'audit-log':
+            return 'get', reverse(name), {'patient': self.patient.pk}, None
+        if name == 'token_obtain_pair':
+            return 'post', reverse(name), {'username': 'doc', 'password': 'doc-password'}, 'json'
+        if name == 'token_refresh':
+            return 'post', reverse(name), {'refresh': str(RefreshToken.for_user(self.doctor))}, 'json'
+        return 'get', reverse(name), None, None
+
+    def test_every_route_and_caller(self):
+        self.assertEqual(set(ACCESS_MATRIX), {pattern.name for pattern in api_urls.urlpatterns})
+        for name, expected in ACCESS_MATRIX.items():
+            for caller, status_code in zip(self.callers, expected):
+                client = APIClient()
+                if caller is not None:
+                    token = ClaimsTokenObtainPairSerializer.get_token(caller).access_token
+                    client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+                method, path, data, fmt = self.build_request(name)
+                with self.subTest(route=name, caller=caller and caller.username):
+                    response = getattr(client, method)(path, data, **({'format': fmt} if fmt else {}))
+                    self.assertEqual(response.status_code, status_code)
+
+    def test_lists_only_hold_own_rows(self):
+        other_doctor, other_patient = self.callers[4], self.callers[2]
+        for caller, count in ((self.patient, 3), (self.doctor, 3), (other_patient, 0), (other_doctor, 0)):
+            client = APIClient()
+            client.force_authenticate(caller)
+            self.assertEqual(len(client.get(reverse('appointment-list')).data['results']), count)
+            self.assertEqual(len(client.get(reverse('prescription-list')).data['results']), min(count, 1))
+        client = APIClient()
+        client.force_authenticate(other_doctor)
+        response = client.post(reverse('appointment-bulk-update'), [{'id': self.appointment.pk, 'status': 'cancelled'}], format='json')
+        self.assertEqual(response.data['updated'], 0)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'pending')
+
+    def test_other_doctors_rows_are_never_loaded(self):
+        client = APIClient()
+        client.force_authenticate(self.callers[4])
+        with CaptureQueriesContext(connection) as ctx:
+            response = client.patch(reverse('appointment-update', args=[self.appointment.pk]), {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('"doctor_id" =', ctx.captured_queries[0]['sql'])
+
+    def test_object_permissions_use_foreign_key_ids(self):
+        request = APIRequestFactory().get('/')
+        request.user = self.patient
+        appointment = Appointment.objects.get(pk=self.appointment.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(IsAppointmentOwnerOrDoctor().has_object_permission(request, None, appointment))
+            request.user = self.callers[2]
+            self.assertFalse(IsAppointmentOwnerOrDoctor().has_object_permission(request, None, appointment))
+
+
+class ReplicaRoutingTests(TestCase):
+    replica_settings = override_settings(DATABASE_REPLICAS=['default'])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.appointment = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+
+    def routed_queries(self, user, url_name):
+        """(queries made while reads were routed to a replica, all queries) of one GET."""
+        routed, total = [], []
+
+        def spy(execute, sql, params, many, context):
+            total.append(sql)
+            if _read_alias.get() is not None:
+                routed.append(sql)
+            return execute(sql, params, many, context)
+
+        self.client.force_authenticate(user)
+        with self.replica_settings, connection.execute_wrapper(spy):
+            self.assertEqual(self.client.get(reverse(url_name)).status_code, 200)
+        return len(routed), len(total)
+
+    def test_router(self):
+        with override_settings(DATABASE_REPLICAS=['replica1', 'replica2']):
+            self.assertEqual(router.db_for_read(Appointment), 'default')
+            with read_from_replica(self.doctor) as alias:
+                self.assertIn(alias, ('replica1', 'replica2'))
+                self.assertEqual(router.db_for_read(Appointment), alias)
+                self.assertEqual(router.db_for_write(Appointment, instance=self.appointment), 'default')
+            with read_from_primary(), read_from_replica(self.doctor) as alias:
+                self.assertIsNone(alias)
+                self.assertEqual(router.db_for_read(Appointment), 'default')
+            pin_to_primary(self.doctor.id)
+            with read_from_replica(self.doctor) as alias:
+                self.assertIsNone(alias)
+                self.assertEqual(router.db_for_read(Appointment), 'default')
+        with override_settings(DATABASE_REPLICAS=[]), read_from_replica(self.patient) as alias:
+            self.assertIsNone(alias)
+
+    def test_list_views_read_from_replica(self):
+        for user, url_name in (
+            (self.doctor, 'appointment-list'), (self.patient, 'prescription-list'),
+            (self.patient, 'doctor-list'), (self.patient, 'available-doctors'), (self.doctor, 'patient-list'),
+        ):
+            cache.clear()  # the directory views would answer from the cache
+            self.assertGreater(self.routed_queries(user, url_name)[0], 0, url_name)
+        # Authentication and object views stay on the primary.
+        self.assertEqual(self.routed_queries(self.doctor, 'doctor-availability')[0], 0)
+
+    @override_settings(DIRECTORY_CACHE=True)
+    def test_directory_cache_fills_from_the_primary(self):
+        for url_name in ('doctor-list', 'available-doctors'):
+            cache.clear()
+            routed, total = self.routed_queries(self.patient, url_name)
+            self.assertEqual(routed, 0, url_name)
+            self.assertGreater(total, 0, url_name)
+
+    def test_writes_pin_the_writer_to_the_primary(self):
+        self.client.force_authenticate(self.doctor)
+        url = reverse('appointment-update', args=[self.appointment.pk])
+        with self.replica_settings:
+            self.client.patch(url, {'status': 'not-a-status'})
+            self.client.get(reverse('appointment-list'))
+            self.assertFalse(is_pinned(self.doctor.id))
+            self.assertEqual(self.client.patch(url, {'status': 'cancelled'}).status_code, 200)
+        self.assertTrue(is_pinned(self.doctor.id))
+        self.assertFalse(is_pinned(self.patient.id))
+        self.assertEqual(self.routed_queries(self.doctor, 'appointment-list'), (0, 1))
+        self.assertGreater(self.routed_queries(self.patient, 'appointment-list')[0], 0)
+
+
+@skipUnless(settings.DATABASE_REPLICAS, "set DATABASE_REPLICA_URLS to run against a replica database")
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    Run on its own with a replica configured, e.g.
+    DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3 python manage.py test api.tests.ReplicaDatabaseTests
+    Tests treat the replica as a mirror of the primary; rows are committed so its connection sees them.
+    """
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def test_list_reads_use_the_replica_connection(self):
+        cache.clear()
+        doctor = make_doctor('doc')
+        Appointment.objects.create(doctor=doctor, patient=make_patient('pat'))
+        client = APIClient()
+        client.force_authenticate(doctor)
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+        with override_settings(DATABASE_REPLICAS=settings.DATABASE_REPLICAS[:1]), CaptureQueriesContext(replica) as ctx:
+            response = client.get(reverse('appointment-list'))
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.client.force_authenticate(self.patient)
+        self.url = reverse('appointment-request')
+
+    def post(self, data, key='key-1'):
+        return self.client.post(self.url, data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_repeats_replay_the_first_response(self):
+        data = {'doctor': self.doctor.doctor_profile.pk, 'notes': 'Headache'}
+        first = self.post(data)
+        with CaptureQueriesContext(connection) as ctx:
+            second = self.post(data)
+        self.assertEqual((first.status_code, second.status_code), (201, 201))
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertFalse(any('INSERT INTO "api_appointment"' in query['sql'] for query in ctx.captured_queries))
+        self.assertEqual(Appointment.objects.count(), 1)
+        # Other keys, and requests without one, create as before.
+        self.assertEqual(self.post(data, key='key-2').status_code, 201)
+        self.assertEqual(self.client.post(self.url, data, format='json').status_code, 201)
+        self.assertEqual(Appointment.objects.count(), 3)
+
+    def test_key_reused_for_another_request(self):
+        self.post({'doctor': self.doctor.doctor_profile.pk})
+        response = self.post({'doctor': self.doctor.doctor_profile.pk, 'notes': 'Different'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_failed_requests_and_expired_keys_are_not_replayed(self):
+        self.assertEqual(self.post({'doctor': 0}).status_code, 400)
+        self.assertEqual(self.post({'doctor': self.doctor.doctor_profile.pk}).status_code, 201)
+        IdempotencyKey.objects.update(created_at=timezone.now() - datetime.timedelta(days=2))
+        response = self.post({'doctor': self.doctor.doctor_profile.pk})
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertEqual(self.post({'doctor': 0}, key='x' * 256).status_code, 400)
+
+        IdempotencyKey.objects.update(created_at=timezone.now() - datetime.timedelta(days=2))
+        call_command('purge_idempotency_keys', stdout=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+@skipIf(connection.vendor == 'sqlite', "SQLite fails concurrent writers with 'database is locked' instead of queueing them")
+class IdempotencyConcurrencyTests(TransactionTestCase):
+    """
+    Many threads sending the same create at once, each on its own database connection.
+    Run with a server database, e.g. DATABASE_URL=postgres://... python manage.py test api.tests.IdempotencyConcurrencyTests
+    """
+    threads = 16
+
+    def setUp(self):
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+
+    def send_concurrently(self, user, url, payloads):
+        barrier = threading.Barrier(len(payloads))
+
+        def send(payload):
+            data, key = payload
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+                return client.post(url, data, format='json', **headers)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(payloads)) as pool:
+            return list(pool.map(send, payloads))
+
+    def test_appointment_requests_with_one_key(self):
+        data = {'doctor': self.doctor.doctor_profile.pk}
+        responses = self.send_concurrently(self.patient, reverse('appointment-request'), [(data, 'same')] * self.threads)
+        self.assertEqual({response.status_code for response in responses}, {201})
+        self.assertEqual(len({response.content for response in responses}), 1)
+        self.assertEqual(sum(response.has_header('Idempotent-Replayed') for response in responses), self.threads - 1)
+        self.assertEqual(Appointment.objects.count(), 1)
+        self.assertEqual(DoctorDailyStats.objects.get().pending, 1)
+
+    def test_appointment_requests_with_distinct_keys(self):
+        data = {'doctor': self.doctor.doctor_profile.pk}
+        payloads = [(data, f'key-{n}') for n in range(self.threads)]
+        responses = self.send_concurrently(self.patient, reverse('appointment-request'), payloads)
+        self.assertEqual({response.status_code for response in responses}, {201})
+        self.assertEqual(Appointment.objects.count(), self.threads)
+        self.assertEqual(DoctorDailyStats.objects.get().pending, self.threads)
+
+    def test_prescriptions(self):
+        appointment = Appointment.objects.create(doctor=self.doctor, patient=self.patient, status='completed')
+        data = {'appointment': appointment.pk, 'medicine_name': 'Rx', 'dosage': '1', 'instructions': '-'}
+        url = reverse('prescription-create')
+        responses = self.send_concurrently(self.doctor, url, [(data, 'same')] * self.threads)
+        self.assertEqual({response.status_code for response in responses}, {201})
+        self.assertEqual(Prescription.objects.count(), 1)
+
+        # Without a key, the one-prescription-per-appointment rule answers the losers with 400, not 500.
+        other = Appointment.objects.create(doctor=self.doctor, patient=self.patient, status='completed')
+        responses = self.send_concurrently(self.doctor, url, [({**data, 'appointment': other.pk}, None)] * self.threads)
+        self.assertEqual(sorted(response.status_code for response in responses), [201] + [400] * (self.threads - 1))
+        self.assertEqual(Prescription.objects.count(), 2)
+
+
+class StartupTests(SimpleTestCase):
+    def test_setup_skips_optional_and_request_only_imports(self):
+        deferred = ['dj_database_url', 'api.authentication', 'rest_framework_simplejwt.serializers']
+        if not (settings.BASE_DIR / '.env').is_file():
+            deferred.append('dotenv')
+        code = f"import django, sys; django.setup(); print([name for name in {deferred!r} if name in sys.modules])"
+        env = {
+            **os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE,
+            'DATABASE_URL': '', 'DATABASE_REPLICA_URLS': '',
+        }
+        result = subprocess.run(
+            [sys.executable, '-c', code], env=env, cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        )
+        # Nothing else on stdout either: settings don't print.
+        self.assertEqual(result.stdout, '[]\n')
+
+    def test_asgi_middleware_is_async_capable(self):
+        self.assertIn('api.middleware.AsyncRequestMetricsMiddleware', settings.ASGI_MIDDLEWARE)
+        sync_only = {'api.middleware.RequestMetricsMiddleware', 'whitenoise.middleware.WhiteNoiseMiddleware'}
+        self.assertFalse(sync_only & set(settings.ASGI_MIDDLEWARE))
+
+    def test_wsgi_import_within_budget(self):
+        out = StringIO()
+        call_command('profile_startup', runs=1, top=5, budget=DEFAULT_BUDGET, stdout=out)
+        output = out.getvalue()
+        self.assertIn('manage.py check', output)
+        self.assertIn('django', output.split('by package:')[1])
+        self.assertIn('within its', output)
+
+        with self.assertRaisesMessage(CommandError, 'Start-up budget exceeded'):
+            call_command('profile_startup', runs=1, budget=0.001, stdout=StringIO())
+
+
+@override_settings(
+    REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'login.ip': '3/min', 'booking.user': '2/min'},
+        'NUM_PROXIES': 1,
+    },
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'],
+)
+class ThrottlingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        throttling.reset()
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.doctor.set_password('secret')
+        self.doctor.save()
+
+    def login(self, client_ip='203.0.113.1'):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(
+                reverse('token_obtain_pair'), {'username': 'doc', 'password': 'secret'},
+                HTTP_X_FORWARDED_FOR=f'198.51.100.7, {client_ip}',  # client-supplied, then appended by the proxy
+            )
+        return response, len(ctx.captured_queries)
+
+    def test_login_is_rejected_before_any_work(self):
+        for _ in range(3):
+            self.assertEqual(self.login()[0].status_code, 200)
+        with mock.patch('django.contrib.auth.hashers.MD5PasswordHasher.verify') as verify:
+            response, queries = self.login()
+        self.assertEqual((response.status_code, queries), (429, 0))
+        verify.assert_not_called()
+        self.assertEqual(int(response['Retry-After']), 20)  # one token per 60/3 seconds
+        # Buckets are per client address: with NUM_PROXIES=1, the one the proxy appended.
+        self.assertEqual(self.login(client_ip='203.0.113.2')[0].status_code, 200)
+
+    def test_forwarded_for_is_ignored_without_proxies(self):
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 0}):
+            for _ in range(3):
+                self.login()
+            # A new X-Forwarded-For doesn't buy a fresh bucket.
+            self.assertEqual(self.login(client_ip='203.0.113.2')[0].status_code, 429)
+
+    def test_bucket_refills_over_time(self):
+        now = 1_000_000.0
+        with mock.patch('api.throttling.time.time', side_effect=lambda: now):
+            for _ in range(3):
+                self.login()
+            self.assertEqual(self.login()[0].status_code, 429)
+            now += 20
+            self.assertEqual(self.login()[0].status_code, 200)
+            self.assertEqual(self.login()[0].status_code, 429)
+
+    def test_rejections_are_remembered_in_process(self):
+        for _ in range(4):
+            self.login()
+        with mock.patch.object(throttling, 'get_cache') as get_cache:
+            self.assertEqual(self.login()[0].status_code, 429)
+        get_cache.assert_not_called()
+        self.assertEqual(throttling.stats, {('login.ip', 'shared'): 1, ('login.ip', 'local'): 1})
+        self.assertIn('api_throttled_requests_total{bucket="login.ip",decided="local"} 1', metrics.render_prometheus())
+
+    def test_booking_is_limited_per_user(self):
+        patient, other = make_patient('pat'), make_patient('other')
+        data = {'doctor': self.doctor.doctor_profile.pk}
+        self.client.force_authenticate(patient)
+        statuses = [self.client.post(reverse('appointment-request'), data, format='json').status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.client.force_authenticate(other)
+        self.assertEqual(self.client.post(reverse('appointment-request'), data, format='json').status_code, 201)
+
+
+@override_settings(DELTA_SYNC_SETTLE_SECONDS=0)
+class DeltaSyncTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.appointments = [
+            Appointment.objects.create(doctor=self.doctor, patient=self.patient, date=datetime.date(2030, 1, day))
+            for day in (1, 2, 3)
+        ]
+        self.client.force_authenticate(self.doctor)
+
+    def sync(self, since='', url='appointment-list', **params):
+        response = self.client.get(reverse(url), {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def ids(self, data):
+        return [row['id'] for row in data['results']]
+
+    def test_full_then_incremental_sync(self):
+        data = self.sync()
+        self.assertEqual(self.ids(data), [appointment.id for appointment in self.appointments])
+        self.assertEqual((data['deleted'], data['more']), ([], False))
+        # Same output as the list
+        listed = self.client.get(reverse('appointment-list')).data['results']
+        self.assertEqual(sorted(data['results'], key=lambda row: row['id']), sorted(listed, key=lambda row: row['id']))
+
+        changed = self.appointments[1]
+        response = self.client.patch(reverse('appointment-update', args=[changed.id]), {'status': 'cancelled'})
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(2):  # changed rows + tombstones
+            data = self.sync(data['since'])
+        self.assertEqual(self.ids(data), [changed.id])
+        self.assertEqual(data['results'][0]['status'], 'cancelled')
+        self.assertEqual(self.ids(self.sync(data['since'])), [])
+
+    def test_pages_follow_the_token(self):
+        data = self.sync(page_size=2)
+        self.assertTrue(data['more'])
+        ids = self.ids(data)
+        data = self.sync(data['since'], page_size=2)
+        self.assertFalse(data['more'])
+        self.assertEqual(ids + self.ids(data), [appointment.id for appointment in self.appointments])
+
+    def test_deletions_and_rows_leaving_the_filter_are_reported(self):
+        data = self.sync(status='pending')
+        self.assertEqual(len(data['results']), 3)
+        cancelled, deleted, kept = self.appointments
+        deleted_id = deleted.id
+        self.client.patch(reverse('appointment-update', args=[cancelled.id]), {'status': 'cancelled'})
+        deleted.delete()
+        # Another doctor's deletion isn't reported to this one.
+        Appointment.objects.create(doctor=make_doctor('other'), patient=self.patient).delete()
+        data = self.sync(data['since'], status='pending')
+        self.assertEqual(self.ids(data), [])
+        self.assertEqual(sorted(data['deleted']), [cancelled.id, deleted_id])
+
+        prescription = Prescription.objects.create(appointment=kept, medicine_name='Rx', dosage='1', instructions='-')
+        since = self.sync(url='prescription-list')['since']
+        kept.delete()  # cascades to the prescription
+        data = self.sync(since, url='prescription-list')
+        self.assertEqual((data['results'], data['deleted']), ([], [prescription.id]))
+        self.client.force_authenticate(self.patient)
+        self.assertEqual(self.sync(since, url='prescription-list')['deleted'], [prescription.id])
+
+    def test_bulk_update_moves_rows_into_the_feed(self):
+        since = self.sync()['since']
+        response = self.client.post(
+            reverse('appointment-bulk-update'), [{'id': self.appointments[0].id, 'status': 'completed'}], format='json',
+        )
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(self.ids(self.sync(since)), [self.appointments[0].id])
+
+    @override_settings(DELTA_SYNC_SETTLE_SECONDS=60)
+    def test_changes_wait_for_the_settle_window(self):
+        data = self.sync()
+        self.assertEqual(data['results'], [])
+        self.assertLess(decode_token(data['since'])[0], timezone.now() - datetime.timedelta(seconds=59))
+
+    def test_invalid_token(self):
+        response = self.client.get(reverse('appointment-list'), {'since': 'not-a-token'})
+        self.assertEqual((response.status_code, list(response.data)), (400, ['since']))
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.calls = []
+        self.failures = 0
+        jobs.job('test-record')(self.calls.append)
+        jobs.job('test-batch', batch=True)(self.calls.append)
+        jobs.job('test-flaky', max_attempts=2)(self.flaky)
+        self.addCleanup(lambda: [jobs.registry.pop(name) for name in ('test-record', 'test-batch', 'test-flaky')])
+
+    def flaky(self, payload):
+        if self.failures < payload['fail']:
+            self.failures += 1
+            raise RuntimeError('boom')
+        self.calls.append(payload)
+
+    def make_due(self):
+        Job.objects.update(run_at=timezone.now())
+
+    def test_jobs_are_queued_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test-record', {'n': 1})
+            self.assertFalse(Job.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    jobs.enqueue_many('test-record', [{'n': 2}, {'n': 3}])
+                    raise RuntimeError('rolled back')
+            except RuntimeError:
+                pass
+        self.assertEqual(list(Job.objects.values_list('payload', flat=True)), [{'n': 1}])
+        with self.assertRaises(LookupError):
+            jobs.enqueue('no-such-job', {})
+
+        self.assertEqual(jobs.run_batch(), (1, 0))
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertFalse(Job.objects.exists())
+
+    def test_batch_jobs_get_every_payload_in_one_call(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue_many('test-batch', [{'n': n} for n in range(3)])
+            jobs.enqueue('test-record', {'n': 3})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(jobs.run_batch(batch_size=3), (3, 0))
+        # Claim (select, update) and delete, whatever the batch size
+        queries = [query['sql'] for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(self.calls, [[{'n': 0}, {'n': 1}, {'n': 2}]])
+        self.assertEqual(jobs.run_batch(), (1, 0))
+
+    def test_partial_failure_retries_only_the_failed_payloads(self):
+        def send(payloads):
+            self.calls.extend(payloads)
+            raise jobs.PartialFailure({1: 'rejected'})
+        jobs.job('test-partial', batch=True)(send)
+        self.addCleanup(jobs.registry.pop, 'test-partial')
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue_many('test-partial', [{'n': n} for n in range(3)])
+        self.assertEqual(jobs.run_batch(), (3, 1))
+        failed = Job.objects.get()
+        self.assertEqual((failed.payload, failed.status, failed.last_error), ({'n': 1}, 'queued', 'rejected'))
+
+    @override_settings(JOB_RETRY_DELAY=10, JOB_MAX_RETRY_DELAY=15)
+    def test_failed_jobs_are_retried_with_backoff(self):
+        self.assertEqual([jobs.retry_delay(attempt) for attempt in (1, 2, 3)], [10, 15, 15])
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test-flaky', {'fail': 1})
+            jobs.enqueue('test-flaky', {'fail': 5})
+        self.assertEqual(jobs.run_batch(), (2, 2))
+        # Not due again before the backoff
+        self.assertEqual(jobs.run_batch(), (0, 0))
+        retry_at = Job.objects.values_list('run_at', flat=True).first()
+        self.assertGreater(retry_at, timezone.now() + datetime.timedelta(seconds=9))
+
+        self.make_due()
+        with self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(jobs.run_batch(), (2, 1))
+        self.assertEqual(self.calls, [{'fail': 1}])
+        failed = Job.objects.get()
+        self.assertEqual((failed.status, failed.attempts), ('failed', 2))
+        self.assertIn('RuntimeError: boom', failed.last_error)
+        self.make_due()
+        self.assertEqual(jobs.run_batch(), (0, 0))
+
+    def test_claimed_jobs_are_leased(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test-record', {'n': 1})
+        self.assertEqual(len(jobs.claim(10)), 1)
+        # A second worker doesn't get it until the lease runs out (its worker died).
+        self.assertEqual(jobs.claim(10), [])
+        self.make_due()
+        self.assertEqual(jobs.claim(10)[0].attempts, 2)
+
+    @override_settings(JOB_BACKEND='api.jobs.ImmediateBackend')
+    def test_immediate_backend(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('test-record', {'n': 1})
+            self.assertEqual(self.calls, [])
+        self.assertEqual(self.calls, [{'n': 1}])
+        self.assertFalse(Job.objects.exists())
+
+    def test_worker_command(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue_many('test-record', [{'n': n} for n in range(5)])
+        out = StringIO()
+        call_command('run_jobs', '--once', '--batch-size', '2', stdout=out)
+        self.assertIn('Ran 5 jobs, 0 failed.', out.getvalue())
+        self.assertEqual(len(self.calls), 5)
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        User.objects.filter(pk=self.patient.pk).update(email='pat@example.com')
+        self.appointment = Appointment.objects.create(doctor=self.doctor, patient=self.patient)
+        self.client.force_authenticate(self.doctor)
+
+    def test_writes_queue_emails_for_the_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(
+                reverse('appointment-update', args=[self.appointment.pk]), {'status': 'cancelled'}, format='json',
+            )
+            self.assertEqual(response.status_code, 200)
+            response = self.client.post(reverse('prescription-create'), {
+                'appointment': self.appointment.pk, 'medicine_name': 'Rx', 'dosage': '1', 'instructions': 'Daily',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.client.force_authenticate(None)
+            response = self.client.post(reverse('user-register'), {
+                'username': 'new', 'password': 'pw-123456', 'role': 'patient', 'email': 'new@example.com',
+            }, format='json')
+            self.assertEqual(response.status_code, 201)
+        # Nothing was sent inside the requests.
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(Job.objects.count(), 3)
+
+        call_command('run_jobs', '--once', stdout=StringIO())
+        self.assertEqual(
+            sorted((message.subject, tuple(message.to)) for message in mail.outbox),
+            [
+                ('New prescription', ('pat@example.com',)),
+                ('Welcome to the hospital', ('new@example.com',)),
+                ('Your appointment was cancelled', ('pat@example.com',)),
+            ],
+        )
+        self.assertFalse(Job.objects.exists())
+
+    def test_prescription_email_links_to_the_api_without_medical_details(self):
+        prescription = Prescription.objects.create(
+            appointment=self.appointment, medicine_name='Amoxicillin', dosage='500mg', instructions='Twice daily',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            jobs.enqueue('prescription-email', {'prescription': prescription.pk})
+        call_command('run_jobs', '--once', stdout=StringIO())
+        body = mail.outbox[0].body
+        self.assertIn(settings.SITE_URL + reverse('prescription-list'), body)
+        for detail in ('Amoxicillin', '500mg', 'Twice daily'):
+            self.assertNotIn(detail, body)
+
+    def test_a_rejected_address_retries_only_its_own_email(self):
+        other = make_patient('other')
+        User.objects.filter(pk=other.pk).update(email='other@example.com')
+        second = Appointment.objects.create(doctor=self.doctor, patient=other)
+        with self.captureOnCommitCallbacks(execute=True):
+            for appointment in (self.appointment, second):
+                prescription = Prescription.objects.create(
+                    appointment=appointment, medicine_name='Rx', dosage='1', instructions='-',
+                )
+                jobs.enqueue('prescription-email', {'prescription': prescription.pk})
+        with mock.patch('api.notifications.EmailMessage.send', side_effect=[1, SMTPRecipientsRefused({})]):
+            call_command('run_jobs', '--once', stdout=StringIO())
+        self.assertEqual(Job.objects.get().payload, {'prescription': second.prescription.pk})
+        Job.objects.update(run_at=timezone.now())
+        call_command('run_jobs', '--once', stdout=StringIO())
+        self.assertEqual([message.to for message in mail.outbox], [['other@example.com']])
+
+    def test_bulk_updates_queue_one_email_per_changed_appointment(self):
+        other = Appointment.objects.create(doctor=self.doctor, patient=make_patient('nomail'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('appointment-bulk-update'), [
+                {'id': self.appointment.pk, 'status': 'completed'}, {'id': other.pk, 'status': 'completed'},
+            ], format='json')
+        self.assertEqual(Job.objects.count(), 2)
+        call_command('run_jobs', '--once', stdout=StringIO())
+        # Patients without an email address are skipped.
+        self.assertEqual([message.to for message in mail.outbox], [['pat@example.com']])
+
+
+class AuditLogTests(TestCase):
+    def setUp(self):
+        audit.reset()
+        self.addCleanup(audit.reset)
+        self.client = APIClient()
+        self.doctor = make_doctor('doc')
+        self.patient = make_patient('pat')
+        self.other = make_patient('other')
+        self.appointments = [
+            Appointment.objects.create(doctor=self.doctor, patient=patient) for patient in (self.patient, self.other)
+        ]
+        self.client.force_authenticate(self.doctor)
+
+    def trail(self, patient):
+        start = timezone.now() - datetime.timedelta(days=1)
+        return [
+            (event.actor_id, event.action, event.kind, event.object_ids)
+            for event in audit.events(patient.id, start, start + datetime.timedelta(days=2))
+        ]
+
+    def test_reads_are_buffered_and_written_per_patient(self):
+        with override_settings(AUDIT_LOG=False), CaptureQueriesContext(connection) as unaudited:
+            self.client.get(reverse('appointment-list'))
+        with CaptureQueriesContext(connection) as audited:
+            self.client.get(reverse('appointment-list'))
+        # Recording costs the request nothing.
+        self.assertEqual(len(audited), len(unaudited))
+        self.assertFalse(AuditEvent.objects.exists())
+
+        with self.assertNumQueries(2):  # patients of the appointments, one insert
+            self.assertEqual(audit.flush(), 2)
+        first, second = self.appointments
+        self.assertEqual(self.trail(self.patient), [(self.doctor.id, 'read', 'appointment', [first.id])])
+        self.assertEqual(self.trail(self.other), [(self.doctor.id, 'read', 'appointment', [second.id])])
+        self.assertEqual(audit.flush(), 0)
+
+    def test_failed_flush_keeps_the_events(self):
+        first, second = self.appointments
+        audit.record(self.doctor.id, 'appointment', 'read', [first.id])
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertRaises(DatabaseError):
+                audit.flush()
+        audit.record(self.doctor.id, 'appointment', 'read', [second.id])
+        self.assertEqual(audit.flush(), 2)
+        self.assertEqual(self.trail(self.patient), [(self.doctor.id, 'read', 'appointment', [first.id])])
+
+    @override_settings(AUDIT_BUFFER_SIZE=1)
+    def test_failed_write_in_a_request_is_logged(self):
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertLogs('api.audit', 'ERROR'):
+                self.assertEqual(self.client.get(reverse('appointment-list')).status_code, 200)
+        self.assertEqual(audit.flush(), 2)
+
+    @override_settings(AUDIT_BUFFER_SIZE=1, AUDIT_BUFFER_MAX=2)
+    def test_buffer_is_capped_while_writes_fail(self):
+        ids = [appointment.id for appointment in self.appointments]
+        with mock.patch.object(AuditEvent.objects, 'bulk_create', side_effect=DatabaseError('down')):
+            with self.assertLogs('api.audit', 'ERROR') as logs:
+                for object_id in ids * 2:
+                    audit.record(self.doctor.id, 'appointment', 'read', [object_id])
+        self.assertEqual(audit.dropped, 2)
+        self.assertEqual(sum('buffer full' in line for line in logs.output), 1)
+        with self.assertLogs('api.audit', 'WARNING'):
+            self.assertEqual(audit.flush(), 2)
+        self.assertEqual(self.trail(self.patient), [(self.doctor.id, 'read', 'appointment', [ids[0]])])
+
+    @override_settings(AUDIT_BUFFER_SIZE=2)
+    def test_full_buffer_is_written_without_a_flusher(self):
+        self.client.get(reverse('appointment-list'))
+        self.assertFalse(AuditEvent.objects.exists())
+        self.client.get(reverse('appointment-list'))
+        self.assertEqual(AuditEvent.objects.count(), 4)
+        self.assertEqual(audit.flush(), 0)
+
+    def test_writes_and_exports(self):
+        appointment = self.appointments[0]
+        self.client.patch(reverse('appointment-update', args=[appointment.pk]), {'status': 'completed'}, format='json')
+        self.client.post(reverse('appointment-bulk-update'), [{'id': appointment.pk, 'status': 'cancelled'}], format='json')
+        response = self.client.post(reverse('prescription-create'), {
+            'appointment': appointment.pk, 'medicine_name': 'Rx', 'dosage': '1', 'instructions': '-',
+        }, format='json')
+        self.client.get(reverse('patient-export', args=[self.patient.patient_profile.pk]))
+        # Failed requests read nothing.
+        self.client.patch(reverse('appointment-update', args=[appointment.pk]), {'status': 'bogus'}, format='json')
+        self.client.force_authenticate(self.patient)
+        self.client.post(reverse('appointment-request'), {'doctor': self.doctor.doctor_profile.pk}, format='json')
+        self.client.get(reverse('patient-detail', args=[self.patient.patient_profile.pk]))
+        audit.flush()
+
+        requested = Appointment.objects.latest('id')
+        self.assertEqual(self.trail(self.patient), [
+            (self.doctor.id, 'update', 'appointment', [appointment.id]),
+            (self.doctor.id, 'update', 'appointment', [appointment.id]),
+            (self.doctor.id, 'create', 'prescription', [response.data['id']]),
+            (self.doctor.id, 'export', 'patient', [self.patient.patient_profile.pk]),
+            (self.patient.id, 'create', 'appointment', [requested.id]),
+            (self.patient.id, 'read', 'patient', [self.patient.patient_profile.pk]),
+        ])
+
+    def test_async_lists_and_deleted_rows(self):
+        token = ClaimsTokenObtainPairSerializer.get_token(self.doctor).access_token
+        response = self.client.get(reverse('async-appointment-list'), HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        deleted_id = self.appointments[1].id
+        self.appointments[1].delete()  # before the flush: found through its tombstone
+        audit.flush()
+        self.assertEqual(self.trail(self.other), [(self.doctor.id, 'read', 'appointment', [deleted_id])])
+
+    def test_events_are_append_only(self):
+        self.client.get(reverse('appointment-list'))
+        audit.flush()
+        event = AuditEvent.objects.first()
+        for change in (event.save, event.delete, AuditEvent.objects.all().delete, lambda: AuditEvent.objects.update(actor_id=0)):
+            with self.assertRaises(TypeError):
+                change()
+
+    def test_months_and_lookup_plan(self):
+        utc = datetime.timezone.utc
+        self.assertEqual(
+            audit.months(datetime.datetime(2025, 11, 15, tzinfo=utc), datetime.datetime(2026, 2, 1, tzinfo=utc)),
+            [202511, 202512, 202601],
+        )
+        start = timezone.now()
+        plan = audit.events(self.patient.id, start, start + datetime.timedelta(days=40)).explain()
+        self.assertIn('audit_patient_idx', plan)
+
+    def test_lookup_endpoint(self):
+        self.client.get(reverse('appointment-list'))
+        audit.flush()
+        admin = User.objects.create(username='admin', is_staff=True, is_superuser=True)
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('audit-log'), {'patient': self.patient.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(event['actor_id'], event['action'], event['object_ids']) for event in response.data['events']],
+            [(self.doctor.id, 'read', [self.appointments[0].id])],
+        )
+        self.assertFalse(response.data['more'])
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        response = self.client.get(reverse('audit-log'), {'patient': self.patient.id, 'start': yesterday, 'end': yesterday})
+        self.assertEqual(response.data['events'], [])
+        self.assertEqual(self.client.get(reverse('audit-log')).status_code, 400)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command(
+            'benchmark_audit', '--doctors', '2', '--patients', '3', '--appointments', '6', '--requests', '3',
+            '--warmup', '1', stdout=out,
+        )
+        self.assertIn('patient-list        synchronous', out.getvalue())
+        self.assertFalse(AuditEvent.objects.exists())
@@ -0,0 +1,143 @@
+"""
+Token-bucket throttling for expensive endpoints (login, registration, booking).
+
+A view opts in where it is routed in api/urls.py, with the throttle classes of
+a scope (e.g. `TokenObtainPairView.as_view(throttle_classes=token_buckets('login'))`).
+A scope has up to two buckets, each enabled by a rate in
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']:
+`<scope>.user` per authenticated user and `<scope>.ip` per client address. A
+rate 'N/period' is a bucket of N tokens refilled at N per period: clients can
+burst N requests, then sustain the rate.
+
+DRF checks throttles in APIView.initial(), before the handler: a rejected login
+never reaches password hashing and a rejected booking runs none of its queries
+(only authentication precedes the check).
+
+Buckets live in the THROTTLE_CACHE_ALIAS cache, shared by every worker, as one
+timestamp per key: the moment the bucket is full again. The read and write are
+not atomic, so requests racing on different workers can overdraw a bucket by a
+token or two, as with DRF's own throttles. A worker that rejects a request
+remembers until when that bucket stays empty and rejects the key's next requests
+in-process, so a flood costs a dict lookup per request instead of a cache round
+trip.
+"""
+import math
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+# Keys rejected in-process are pruned once this many are remembered.
+MAX_LOCAL_KEYS = 10_000
+
+_lock = threading.Lock()
+_empty_until = {}  # bucket key -> time.time() before which it has no token
+# (bucket, 'local' or 'shared') -> rejected requests in this process
+stats = {}
+
+
+def get_cache():
+    return caches[settings.THROTTLE_CACHE_ALIAS]
+
+
+def _count(bucket, where):
+    with _lock:
+        stats[bucket, where] = stats.get((bucket, where), 0) + 1
+
+
+def _remember_empty(key, until, now):
+    with _lock:
+        if len(_empty_until) >= MAX_LOCAL_KEYS:
+            for stale in [stale for stale, empty_until in _empty_until.items() if empty_until <= now]:
+                del _empty_until[stale]
+        _empty_until[key] = until
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'N/period' (period 's', 'm'/'min', 'h'/'hour', 'd'/'day') -> (N, period in seconds)."""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def take(key, num_requests, duration):
+    """
+    Take a token from bucket `key`. Return (None, None), or the seconds until a
+    token is available and where that was decided ('local' or 'shared').
+    """
+    now = time.time()
+    empty_until = _empty_until.get(key)
+    if empty_until is not None:
+        if empty_until > now:
+            return empty_until - now, 'local'
+        with _lock:
+            _empty_until.pop(key, None)
+
+    cache = get_cache()
+    full_at = max(cache.get(key, now), now) + duration / num_requests
+    if full_at - now > duration:  # the bucket is out of tokens
+        wait = full_at - duration - now
+        _remember_empty(key, now + wait, now)
+        return wait, 'shared'
+    cache.set(key, full_at, timeout=math.ceil(full_at - now))
+    return None, None
+
+
+def reset():
+    """Forget this process's rejected keys and counters (bucket state stays in the cache)."""
+    with _lock:
+        _empty_until.clear()
+        stats.clear()
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+    kind = None
+
+    def get_bucket_ident(self, request):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        bucket = f'{self.scope}.{self.kind}'
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(bucket)
+        ident = rate and self.get_bucket_ident(request)
+        if not ident:
+            return True
+        self.wait_seconds, where = take(f'throttle:{bucket}:{ident}', *parse_rate(rate))
+        if self.wait_seconds is None:
+            return True
+        _count(bucket, where)
+        return False
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class UserTokenBucketThrottle(TokenBucketThrottle):
+    """The `<scope>.user` bucket of the authenticated user (anonymous requests only use the IP bucket)."""
+    kind = 'user'
+
+    def get_bucket_ident(self, request):
+        return request.user.pk if request.user and request.user.is_authenticated else None
+
+
+class IPTokenBucketThrottle(TokenBucketThrottle):
+    """The `<scope>.ip` bucket of the client address (see REST_FRAMEWORK['NUM_PROXIES'])."""
+    kind = 'ip'
+
+    def get_bucket_ident(self, request):
+        return self.get_ident(request)
+
+
+def token_buckets(scope):
+    """The throttle classes of `scope`'s buckets, for a view's `throttle_classes`."""
+    return [
+        type(throttle.__name__, (throttle,), {'scope': scope})
+        for throttle in (UserTokenBucketThrottle, IPTokenBucketThrottle)
+    ]
@@ -1,5 +1,6 @@
 from django.urls import path
-from . import views
+from . import async_views, views
+from .throttling import token_buckets
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -7,27 +8,53 @@ from rest_framework_simplejwt.views import (
 
 urlpatterns = [
     # USER REGISTRATION Endpoint
-    path('register/', views.UserRegistrationView.as_view(), name='user-register'),
+    path('register/', views.UserRegistrationView.as_view(throttle_classes=token_buckets('register')), name='user-register'),
+    path('users/import/', views.UserImportView.as_view(), name='user-import'),
 
     # DOCTOR PROFILE Endpoints
     path('doctors/', views.DoctorProfileListView.as_view(), name='doctor-list'),
     path('doctors/<int:pk>/', views.DoctorProfileDetailView.as_view(), name='doctor-detail'),
+    path('doctors/cache-stats/', views.DirectoryCacheStatsView.as_view(), name='doctor-cache-stats'),
 
     # PATIENT PROFILE Endpoints
     path('patients/', views.PatientProfileListView.as_view(), name='patient-list'),
     path('patients/<int:pk>/', views.PatientProfileDetailView.as_view(), name='patient-detail'),
+    path('patients/<int:pk>/export/', views.PatientExportView.as_view(), name='patient-export'),
     path('doctors/available/', views.AvailableDoctorsView.as_view(), name='available-doctors'),
 
+    # SCHEDULING Endpoints
+    path('doctors/availability/', views.DoctorAvailabilityView.as_view(), name='doctor-availability'),
+    path('doctors/<int:pk>/slots/', views.DoctorSlotsView.as_view(), name='doctor-slots'),
+    path('doctors/slots/', views.SpecialtySlotsView.as_view(), name='specialty-slots'),
+
+    # STATISTICS Endpoints
+    path('doctors/<int:pk>/stats/', views.DoctorStatsView.as_view(), name='doctor-stats'),
+    path('doctors/<int:pk>/calendar.ics', views.DoctorCalendarView.as_view(), name='doctor-calendar'),
+
 
     # APPOINTMENTS Endpoints
-    path('appointments/request/', views.AppointmentRequestView.as_view(), name='appointment-request'),
+    path('appointments/request/', views.AppointmentRequestView.as_view(throttle_classes=token_buckets('booking')), name='appointment-request'),
     path('appointments/', views.AppointmentListView.as_view(), name='appointment-list'),
     path('appointments/<int:pk>/update/', views.AppointmentUpdateView.as_view(), name='appointment-update'),
+    path('appointments/bulk-update/', views.AppointmentBulkUpdateView.as_view(), name='appointment-bulk-update'),
+    path('appointments/timeline/', views.AppointmentTimelineView.as_view(), name='appointment-timeline'),
 
     # PRESCRIPTIONS Endpoints
     path('prescriptions/', views.PrescriptionListView.as_view(), name='prescription-list'),
     path('prescriptions/create/', views.PrescriptionCreateView.as_view(), name='prescription-create'),
+
+    # ASYNC (ASGI) variants of the read-heavy lists
+    path('async/doctors/', async_views.DoctorProfileListView.as_view(), name='async-doctor-list'),
+    path('async/appointments/', async_views.AppointmentListView.as_view(), name='async-appointment-list'),
+    path('async/prescriptions/', async_views.PrescriptionListView.as_view(), name='async-prescription-list'),
+
+    # AUDIT LOG Endpoint
+    path('audit/', views.AuditLogView.as_view(), name='audit-log'),
+
+    # METRICS Endpoint
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
+
     # JWT Authentication Endpoints
-    path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
+    path('token/', TokenObtainPairView.as_view(throttle_classes=token_buckets('login')), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
 ]
@@ -1,18 +1,80 @@
+import datetime
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, permissions, status
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.exceptions import PermissionDenied
 from rest_framework import serializers
-from .models import User, DoctorProfile, PatientProfile, Appointment, Prescription
+from .audit import AuditedMixin, events as audit_events, record as audit
+from .authentication import ClaimsAuthenticationMixin
+from .export import export_lines
+from .ical import CONTENT_TYPE as CALENDAR_CONTENT_TYPE, feed as calendar_feed, schedule_refresh as refresh_calendar
+from .idempotency import IdempotentCreateMixin
+from .jobs import enqueue, enqueue_many
+from .cache import CachedDirectoryMixin, stats as directory_cache_stats
+from .filters import DoctorProfileFilter
+from .importer import import_users, read_rows
+from .metrics import render_prometheus
+from .models import User, DoctorProfile, DoctorAvailability, PatientProfile, Appointment, Prescription
 from .serializers import (
     UserSerializer,
     DoctorProfileSerializer,
+    DoctorAvailabilitySerializer,
     PatientProfileSerializer,
     AppointmentSerializer,
+    AppointmentTimelineSerializer,
     PrescriptionSerializer,
     AppointmentCreateSerializer,
+    AppointmentStatusItemSerializer,
 )
-from .permissions import IsDoctor, IsPatient, IsAppointmentOwnerOrDoctor, IsPrescriptionOwnerOrDoctor
+from .routers import ReplicaReadMixin
+from .row_serializers import compile_serializer
+from .pagination import AppointmentCursorPagination, PrescriptionCursorPagination
+from .permissions import IsDoctor, IsPatient, IsAppointmentOwnerOrDoctor, owned_by
+from .scheduling import MAX_RANGE_DAYS, DoctorCalendar, SlotUnavailable, book_slot, free_slots
+from .stats import STATUSES, daily_counts, record_transitions, stats_key
+from .sync import DeltaSyncMixin
+
+
+# -------------------- QUERY SHAPING --------------------
+class ShapedQuerysetMixin:
+    """Apply the serializer's declared relations to every queryset the view reads."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, 'shape_queryset'):
+            queryset = serializer_class.shape_queryset(queryset)
+        return queryset
+
+
+class CompiledListMixin:
+    """
+    Serve list() through the compiled read path (api/row_serializers.py): rows are
+    read with .values() and turned into the serializer's exact output, without
+    model instances or per-row serializer fields. Falls back to the regular
+    serializer when it can't be compiled or the paginator isn't keyset-based.
+    """
+
+    def list(self, request, *args, **kwargs):
+        compiled = compile_serializer(self.get_serializer_class())
+        paginator = self.paginator
+        if compiled is None or not (paginator is None or hasattr(paginator, 'get_page_queryset')):
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if paginator is None:
+            return Response(compiled.serialize(compiled.fetch(queryset)))
+        page_queryset = paginator.get_page_queryset(queryset, request)
+        ordering = [field.lstrip('-') for field in paginator.ordering]
+        rows = paginator.build_page(compiled.fetch(page_queryset, ordering))
+        return paginator.get_paginated_response(compiled.serialize(rows))
 
 
 # -------------------- USER REGISTRATION --------------------
@@ -21,15 +83,47 @@ class UserRegistrationView(generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
 
+    def perform_create(self, serializer):
+        user = serializer.save()
+        enqueue('welcome-email', {'user': user.pk})
+
+
+class UserImportView(generics.GenericAPIView):
+    """
+    Admin-only bulk onboarding: upload a CSV or JSON Lines `file` of users.
+    The report's `position` is the number of rows committed; re-upload with
+    ?skip=<position> to resume an interrupted import.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"file": "A CSV or JSONL file is required."}, status=status.HTTP_400_BAD_REQUEST)
+        fmt = request.query_params.get('type') or upload.name.rsplit('.', 1)[-1].lower()
+        if fmt not in ('csv', 'jsonl'):
+            return Response({"error": "Unsupported file type; use csv or jsonl."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            skip = int(request.query_params.get('skip', 0))
+        except ValueError:
+            return Response({"error": "skip must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = (line.decode('utf-8') for line in upload)
+        report = import_users(read_rows(lines, fmt), workers=settings.USER_IMPORT_WORKERS, start=skip)
+        return Response(report.as_dict())
+
 
 # -------------------- DOCTOR PROFILE --------------------
-class DoctorProfileListView(generics.ListAPIView):
+class DoctorProfileListView(ClaimsAuthenticationMixin, CachedDirectoryMixin, ReplicaReadMixin, CompiledListMixin, ShapedQuerysetMixin, generics.ListAPIView):
     queryset = DoctorProfile.objects.all()
     serializer_class = DoctorProfileSerializer
     permission_classes = [permissions.IsAuthenticated]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = DoctorProfileFilter
 
 
-class DoctorProfileDetailView(generics.RetrieveUpdateAPIView):
+class DoctorProfileDetailView(ShapedQuerysetMixin, generics.RetrieveUpdateAPIView):
     serializer_class = DoctorProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsDoctor]
 
@@ -37,127 +131,481 @@ class DoctorProfileDetailView(generics.RetrieveUpdateAPIView):
         """Only allow doctors to view or update their own profile."""
         user = self.request.user
         if user.role == 'doctor':
-            return DoctorProfile.objects.filter(user=user)
+            return DoctorProfile.objects.filter(user_id=user.id)
         return DoctorProfile.objects.none()
 
 
 
+class DirectoryCacheStatsView(generics.GenericAPIView):
+    """Hit/miss counters of the doctor directory cache (this process)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(dict(directory_cache_stats))
+
+
+# -------------------- METRICS --------------------
+class MetricsView(generics.GenericAPIView):
+    """Request metrics and cache counters of this process in Prometheus text format."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # -------------------- PATIENT PROFILE --------------------
-class PatientProfileListView(generics.ListAPIView):
+class PatientProfileListView(ClaimsAuthenticationMixin, AuditedMixin, ReplicaReadMixin, CompiledListMixin, ShapedQuerysetMixin, generics.ListAPIView):
+    """Patient directory (with medical history), for doctors only."""
     queryset = PatientProfile.objects.all()
     serializer_class = PatientProfileSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticated, IsDoctor]
+    audit_kind = 'patient'
 
 
-class PatientProfileDetailView(generics.RetrieveUpdateAPIView):
+class PatientProfileDetailView(AuditedMixin, ShapedQuerysetMixin, generics.RetrieveUpdateAPIView):
     serializer_class = PatientProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsPatient]
+    audit_kind = 'patient'
 
     def get_queryset(self):
         """Only allow patients to view or update their own profile."""
         user = self.request.user
         if user.role == 'patient':
-            return PatientProfile.objects.filter(user=user)
+            return PatientProfile.objects.filter(user_id=user.id)
         return PatientProfile.objects.none()
 
-class AvailableDoctorsView(generics.ListAPIView):
-    """List all doctors available for appointment selection."""
+class PatientExportView(ClaimsAuthenticationMixin, generics.GenericAPIView):
+    """A patient's full record as streamed JSON Lines (see api/export.py)."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        profile = get_object_or_404(PatientProfile.objects.select_related('user'), pk=pk)
+        user = request.user
+        # The patient themselves, or a doctor who has an appointment with them
+        if user.id != profile.user_id and not (
+            user.role == 'doctor'
+            and Appointment.objects.filter(doctor_id=user.id, patient_id=profile.user_id).exists()
+        ):
+            raise PermissionDenied("You can only export your own record or that of your patients.")
+        audit(user.id, 'patient', 'export', [profile.pk])
+        response = StreamingHttpResponse(export_lines(profile), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="patient-{profile.pk}.jsonl"'
+        return response
+
+class AvailableDoctorsView(ClaimsAuthenticationMixin, CachedDirectoryMixin, ReplicaReadMixin, CompiledListMixin, ShapedQuerysetMixin, generics.ListAPIView):
+    """List doctors available for appointment selection (?specialty=, ?tag=, ?q=)."""
     serializer_class = DoctorProfileSerializer
     permission_classes = [permissions.IsAuthenticated, IsPatient]
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = DoctorProfileFilter
 
     def get_queryset(self):
         return DoctorProfile.objects.all()
 
 
 # -------------------- APPOINTMENT --------------------
-class AppointmentRequestView(generics.CreateAPIView):
+class AppointmentRequestView(AuditedMixin, IdempotentCreateMixin, generics.CreateAPIView):
+    """Patients request appointments; retries carrying the same Idempotency-Key are answered once."""
     serializer_class = AppointmentCreateSerializer
     permission_classes = [IsPatient, permissions.IsAuthenticated]
+    audit_kind = 'appointment'
+
+    def get_audit_ids(self, response):
+        # The response has no id; a replayed response created nothing.
+        return [self.created.pk] if hasattr(self, 'created') else []
 
     def perform_create(self, serializer):
         """Allow only patients to request appointments (pending by default)."""
-        doctor_id = self.request.data.get('doctor')
-        if not doctor_id:
-            raise serializers.ValidationError({"doctor": "Doctor ID is required."})
-
-        try:
-            doctor_profile = DoctorProfile.objects.get(id=doctor_id)
-        except DoctorProfile.DoesNotExist:
-            raise serializers.ValidationError({"doctor": "Invalid doctor ID."})
-
-        serializer.save(
-            patient=self.request.user,
-            doctor=doctor_profile.user,
-            status='pending'
-        )
-
-
-class AppointmentListView(generics.ListAPIView):
+        # The serializer validated the doctor profile (with its user) in one query.
+        doctor_profile = serializer.validated_data['doctor']
+        with transaction.atomic():
+            appointment = serializer.save(
+                patient=self.request.user,
+                doctor=doctor_profile.user,
+                status='pending'
+            )
+            record_transitions([(None, stats_key(appointment))])
+        self.created = appointment
+
+
+# DeltaSyncMixin precedes ReplicaReadMixin: the ?since= feed reads the primary (see api/sync.py).
+class AppointmentListView(ClaimsAuthenticationMixin, AuditedMixin, DeltaSyncMixin, ReplicaReadMixin, CompiledListMixin, ShapedQuerysetMixin, generics.ListAPIView):
     serializer_class = AppointmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AppointmentCursorPagination
+    sync_kind = 'appointment'
+    sync_filters = ('status',)
+    audit_kind = 'appointment'
 
-    def get_queryset(self):
+    def get_sync_queryset(self):
         """Return only appointments relevant to the logged-in user."""
-        user = self.request.user
-        if user.role == 'doctor':
-            return Appointment.objects.filter(doctor=user).order_by('-date')
-        elif user.role == 'patient':
-            return Appointment.objects.filter(patient=user).order_by('-date')
-        return Appointment.objects.none()
+        return owned_by(Appointment.objects.order_by('-date'), self.request.user)
+
+    def get_queryset(self):
+        queryset = self.get_sync_queryset()
 
+        # Optional ?status= filter, e.g. a doctor's pending queue
+        status_filter = self.request.query_params.get('status')
+        if status_filter:
+            queryset = queryset.filter(status=status_filter)
+        return queryset
 
-class AppointmentUpdateView(generics.UpdateAPIView):
-    queryset = Appointment.objects.all()
+
+class AppointmentUpdateView(AuditedMixin, ShapedQuerysetMixin, generics.UpdateAPIView):
     serializer_class = AppointmentSerializer
-    permission_classes = [permissions.IsAuthenticated, IsDoctor]
+    permission_classes = [permissions.IsAuthenticated, IsDoctor, IsAppointmentOwnerOrDoctor]
+    audit_kind = 'appointment'
 
+    def get_queryset(self):
+        """Only the doctor's own appointments; any other id is a 404 without loading the row."""
+        return owned_by(Appointment.objects.all(), self.request.user)
 
     def update(self, request, *args, **kwargs):
         """Allow doctor to confirm, cancel, or complete appointment."""
         appointment = self.get_object()
+        before = stats_key(appointment)
         status_choice = request.data.get('status')
 
-        if status_choice not in ['confirmed', 'cancelled', 'completed']:
+        if status_choice not in Appointment.DOCTOR_STATUSES:
             return Response({"error": "Invalid status update."}, status=status.HTTP_400_BAD_REQUEST)
 
         # Allow doctor to set date/time when confirming
         if status_choice == 'confirmed':
-            appointment.date = request.data.get('date', appointment.date)
-            appointment.time = request.data.get('time', appointment.time)
+            serializer = self.get_serializer(appointment, data=request.data, partial=True)
+            serializer.is_valid(raise_exception=True)
+            appointment.date = serializer.validated_data.get('date', appointment.date)
+            appointment.time = serializer.validated_data.get('time', appointment.time)
 
         appointment.status = status_choice
-        appointment.save()
+        try:
+            with transaction.atomic():
+                if status_choice == 'confirmed' and appointment.date and appointment.time:
+                    book_slot(appointment)
+                appointment.save()
+                record_transitions([(before, stats_key(appointment))])
+                if before[2] != status_choice:
+                    enqueue('appointment-status-email', {'appointment': appointment.pk, 'status': status_choice})
+        except SlotUnavailable as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        except IntegrityError:
+            return Response(
+                {"error": "The doctor already has a confirmed appointment at this time."},
+                status=status.HTTP_409_CONFLICT,
+            )
         return Response(AppointmentSerializer(appointment).data)
 
 
+class AppointmentBulkUpdateView(AuditedMixin, generics.GenericAPIView):
+    """
+    Apply many status transitions in one request, with the same rules as
+    AppointmentUpdateView: ownership is checked in one query, slots are checked
+    in memory and all rows are written with one bulk_update in one transaction.
+    Cancellations, completions and moves free their slots before any booking is
+    checked, so the outcome doesn't depend on the order of the items.
+    """
+    serializer_class = AppointmentStatusItemSerializer
+    permission_classes = [permissions.IsAuthenticated, IsDoctor]
+    max_items = 500
+    audit_kind = 'appointment'
+    audit_action = 'update'
+
+    def get_audit_ids(self, response):
+        return [result['id'] for result in response.data['results'] if result['ok']]
+
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not 1 <= len(items) <= self.max_items:
+            return Response(
+                {"error": f"Expected a list of 1 to {self.max_items} items."}, status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = [None] * len(items)
+        valid = {}  # appointment id -> (position, validated item)
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if not serializer.is_valid():
+                item_id = item.get('id') if isinstance(item, dict) else None
+                results[index] = {"id": item_id, "ok": False, "errors": serializer.errors}
+            elif serializer.validated_data['id'] in valid:
+                results[index] = {"id": serializer.validated_data['id'], "ok": False, "errors": {"id": "Duplicate id."}}
+            else:
+                valid[serializer.validated_data['id']] = (index, serializer.validated_data)
+
+        changed, transitions = [], []
+        now = timezone.now()
+        with transaction.atomic():
+            appointments = (
+                Appointment.objects.select_related('doctor', 'patient')
+                .filter(doctor_id=request.user.id)
+                .in_bulk(list(valid))
+            )
+            dates = {data['date'] for _, data in valid.values() if data.get('date')}
+            dates.update(appointment.date for appointment in appointments.values() if appointment.date)
+            calendar = DoctorCalendar(request.user.id, dates)
+
+            def apply(index, appointment, data, day, time):
+                before = stats_key(appointment)
+                appointment.date, appointment.time = day, time
+                appointment.status = data['status']
+                appointment.updated_at = now  # bulk_update() skips auto_now
+                changed.append(appointment)
+                transitions.append((before, stats_key(appointment)))
+                results[index] = {"id": appointment.pk, "ok": True, "appointment": appointment}
+
+            # Releases first, so a confirmation into a slot that another item frees succeeds whatever the item order.
+            bookings = []
+            for pk, (index, data) in valid.items():
+                appointment = appointments.get(pk)
+                if appointment is None:
+                    results[index] = {"id": pk, "ok": False, "errors": {"id": "Appointment not found."}}
+                elif data['status'] == 'confirmed':
+                    bookings.append((index, appointment, data))
+                else:
+                    calendar.release(pk)
+                    apply(index, appointment, data, appointment.date, appointment.time)
+
+            # A booking that moves an appointment frees its old slot, which a booking tried before it may want:
+            # retry the ones that failed until a round books nothing more.
+            while bookings:
+                failed = []
+                for index, appointment, data in bookings:
+                    day, time = data.get('date', appointment.date), data.get('time', appointment.time)
+                    if day and time:
+                        try:
+                            calendar.book(appointment.pk, day, time)
+                        except SlotUnavailable as exc:
+                            failed.append((index, appointment, data, exc))
+                            continue
+                    apply(index, appointment, data, day, time)
+                if len(failed) == len(bookings):
+                    for index, appointment, _, exc in failed:
+                        results[index] = {"id": appointment.pk, "ok": False, "errors": {"time": str(exc)}}
+                    break
+                bookings = [(index, appointment, data) for index, appointment, data, _ in failed]
+
+            try:
+                with transaction.atomic():
+                    Appointment.objects.bulk_update(changed, ['status', 'date', 'time', 'updated_at'])
+                    record_transitions(transitions)
+                    enqueue_many('appointment-status-email', [
+                        {'appointment': appointment.pk, 'status': appointment.status}
+                        for appointment, (before, _) in zip(changed, transitions)
+                        if before[2] != appointment.status
+                    ])
+                    # bulk_update() sends no post_save: patch the calendar feed here (api/ical.py).
+                    refresh_calendar(request.user.id, [appointment.pk for appointment in changed])
+            except IntegrityError:
+                return Response(
+                    {"error": "The doctor already has a confirmed appointment at one of these times."},
+                    status=status.HTTP_409_CONFLICT,
+                )
+
+        for result in results:
+            if result['ok']:
+                result['appointment'] = AppointmentSerializer(result['appointment']).data
+        return Response({"updated": len(changed), "failed": len(items) - len(changed), "results": results})
+
+
+class AppointmentTimelineView(ClaimsAuthenticationMixin, AuditedMixin, ReplicaReadMixin, generics.ListAPIView):
+    """
+    The user's appointments with their prescription embedded, newest first, in
+    a constant number of queries; doctors can narrow it to one patient with
+    ?patient=<user id>. Cursor-paged like the appointment list; ?fields= picks
+    the keys to return (see AppointmentTimelineSerializer).
+    """
+    serializer_class = AppointmentTimelineSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AppointmentCursorPagination
+    audit_kind = 'appointment'
+
+    def get_queryset(self):
+        queryset = owned_by(Appointment.objects.all(), self.request.user)
+        patient = self.request.query_params.get('patient')
+        if patient:
+            if not patient.isdigit():
+                raise serializers.ValidationError({"patient": "Must be a user id."})
+            queryset = queryset.filter(patient_id=int(patient))
+        return queryset
+
+    def filter_queryset(self, queryset):
+        fields = self.serializer_class.selected_fields(self.request)
+        return self.serializer_class.shape_queryset(super().filter_queryset(queryset), fields)
+
+    def get_audit_ids(self, response):
+        return [appointment.pk for appointment in self.paginator.page]  # ?fields= may leave out "id"
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code == 200:
+            prescriptions = [row['prescription'] for row in response.data['results'] if row.get('prescription')]
+            audit(request.user.id, 'prescription', 'read', [prescription['id'] for prescription in prescriptions])
+        return response
+
+
+# -------------------- SCHEDULING --------------------
+class DoctorAvailabilityView(generics.ListCreateAPIView):
+    """Doctors manage the weekly working hours their slots are generated from."""
+    serializer_class = DoctorAvailabilitySerializer
+    permission_classes = [permissions.IsAuthenticated, IsDoctor]
+
+    def get_queryset(self):
+        return DoctorAvailability.objects.filter(doctor__user_id=self.request.user.id)
+
+    def perform_create(self, serializer):
+        serializer.save(doctor=get_object_or_404(DoctorProfile, user=self.request.user))
+
+
+def _date_range(request, default_start, default_days, max_days):
+    """Parse ?start=&end= (YYYY-MM-DD, inclusive); `end` defaults to `default_days` after `start`."""
+    try:
+        start = request.query_params.get('start')
+        start = datetime.date.fromisoformat(start) if start else default_start
+        end = request.query_params.get('end')
+        end = datetime.date.fromisoformat(end) if end else start + datetime.timedelta(days=default_days - 1)
+    except ValueError:
+        raise serializers.ValidationError({"error": "Dates must be in YYYY-MM-DD format."})
+    if end < start or (end - start).days >= max_days:
+        raise serializers.ValidationError({"error": f"Range must be 1 to {max_days} days."})
+    return start, end
+
+
+def _slot_range(request):
+    """?start=&end= of the slot views; defaults to the coming week."""
+    return _date_range(request, timezone.localdate(), 7, MAX_RANGE_DAYS)
+
+
+def _format_slots(days):
+    return [{"date": day, "times": times} for day, times in days]
+
+
+class DoctorSlotsView(ClaimsAuthenticationMixin, generics.GenericAPIView):
+    """Free appointment slots of one doctor over a date range."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        profile = get_object_or_404(DoctorProfile.objects.only('id', 'user_id'), pk=pk)
+        start, end = _slot_range(request)
+        slots = free_slots([profile], start, end)[profile.id]
+        return Response({"doctor": profile.id, "start": start, "end": end, "slots": _format_slots(slots)})
+
+
+class SpecialtySlotsView(ClaimsAuthenticationMixin, generics.GenericAPIView):
+    """Free appointment slots of every doctor in a specialty over a date range."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        specialty = request.query_params.get('specialty')
+        if not specialty:
+            raise serializers.ValidationError({"specialty": "This query parameter is required."})
+        start, end = _slot_range(request)
+        profiles = list(DoctorProfile.objects.filter(specialty=specialty).only('id', 'user_id'))
+        slots = free_slots(profiles, start, end)
+        return Response({
+            "specialty": specialty,
+            "start": start,
+            "end": end,
+            "doctors": [{"doctor": profile.id, "slots": _format_slots(slots[profile.id])} for profile in profiles],
+        })
+
+
+# -------------------- STATISTICS --------------------
+class DoctorStatsView(ClaimsAuthenticationMixin, generics.GenericAPIView):
+    """Per-day appointment counts of one doctor (?start=&end=, default the last 30 days); see api/stats.py."""
+    permission_classes = [permissions.IsAuthenticated]
+    max_days = 366
+
+    def get(self, request, pk):
+        profile = get_object_or_404(DoctorProfile.objects.only('id', 'user_id'), pk=pk)
+        if request.user.id != profile.user_id and not request.user.is_staff:
+            raise PermissionDenied("You can only view your own statistics.")
+        start, end = _date_range(request, timezone.localdate() - datetime.timedelta(days=29), 30, self.max_days)
+        days = daily_counts(profile.user_id, start, end)
+        totals = {status: sum(day[status] for day in days) for status in STATUSES}
+        return Response({"doctor": profile.id, "start": start, "end": end, "totals": totals, "days": days})
+
+
+# -------------------- CALENDAR FEED --------------------
+class DoctorCalendarView(ClaimsAuthenticationMixin, generics.GenericAPIView):
+    """
+    iCalendar feed of a doctor's confirmed appointments, for the doctor and
+    staff; cached per doctor and answered 304 while unchanged (api/ical.py).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, pk):
+        if request.user.role == 'doctor' and getattr(request.user, 'profile_id', None) == pk:
+            doctor_id = request.user.id  # own feed, known from the token's claims: no query
+        else:
+            profile = get_object_or_404(DoctorProfile.objects.only('id', 'user_id'), pk=pk)
+            if request.user.id != profile.user_id and not request.user.is_staff:
+                raise PermissionDenied("You can only view your own calendar.")
+            doctor_id = profile.user_id
+        status_code, headers, body, appointment_ids = calendar_feed(request, doctor_id)
+        if appointment_ids:
+            audit(request.user.id, 'appointment', 'read', appointment_ids)
+        return HttpResponse(body, status=status_code, content_type=CALENDAR_CONTENT_TYPE, headers=headers)
+
+
 # -------------------- PRESCRIPTION --------------------
-class PrescriptionListView(generics.ListAPIView):
+class PrescriptionListView(ClaimsAuthenticationMixin, AuditedMixin, DeltaSyncMixin, ReplicaReadMixin, CompiledListMixin, ShapedQuerysetMixin, generics.ListAPIView):
     """Doctors see all they issued; patients see only theirs."""
     serializer_class = PrescriptionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = PrescriptionCursorPagination
+    sync_kind = 'prescription'
+    audit_kind = 'prescription'
 
     def get_queryset(self):
-        user = self.request.user
-        if user.role == 'doctor':
-            return Prescription.objects.filter(appointment__doctor=user)
-        elif user.role == 'patient':
-            return Prescription.objects.filter(appointment__patient=user)
-        return Prescription.objects.none()
+        return owned_by(Prescription.objects.all(), self.request.user)
 
 
-class PrescriptionCreateView(generics.CreateAPIView):
-    """Only doctors can create prescriptions."""
+class PrescriptionCreateView(AuditedMixin, IdempotentCreateMixin, generics.CreateAPIView):
+    """Only doctors can create prescriptions; retries carrying the same Idempotency-Key are answered once."""
     serializer_class = PrescriptionSerializer
     permission_classes = [IsDoctor]
+    audit_kind = 'prescription'
 
     def perform_create(self, serializer):
-        """Ensure doctor can only prescribe for their own appointments."""
-        appointment_id = self.request.data.get('appointment')
-        appointment = get_object_or_404(Appointment, id=appointment_id)
-
-        if appointment.doctor != self.request.user:
-            raise PermissionDenied("You can only prescribe for your own appointments.")
-
-        serializer.save(appointment=appointment)
-
-
+        """Doctors can only prescribe for their own appointments."""
+        # The serializer's appointment field only accepts the doctor's own appointments
+        # (looked up by doctor_id), so other ids fail validation before anything is written.
+        try:
+            with transaction.atomic():
+                prescription = serializer.save()
+                enqueue('prescription-email', {'prescription': prescription.pk})
+        except IntegrityError:
+            # One prescription per appointment; a concurrent create got there first.
+            raise serializers.ValidationError({"appointment": "This appointment already has a prescription."})
+
+
+# -------------------- AUDIT LOG --------------------
+class AuditLogView(generics.GenericAPIView):
+    """
+    Compliance lookup: who read or changed a patient's records (?patient=<user id>,
+    ?start=&end=, default the last 30 days), oldest first; see api/audit.py.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    max_days = 366
+    max_events = 1000
+
+    def get(self, request, *args, **kwargs):
+        try:
+            patient = int(request.query_params.get('patient', ''))
+        except ValueError:
+            raise serializers.ValidationError({"patient": "A patient user id is required."})
+        start, end = _date_range(request, timezone.localdate() - datetime.timedelta(days=29), 30, self.max_days)
+        events = list(
+            audit_events(
+                patient,
+                timezone.make_aware(datetime.datetime.combine(start, datetime.time.min)),
+                timezone.make_aware(datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)),
+            ).values('at', 'actor_id', 'action', 'kind', 'object_ids')[:self.max_events + 1]
+        )
+        # A longer trail is read over shorter ranges.
+        return Response({
+            "patient": patient,
+            "start": start,
+            "end": end,
+            "events": events[:self.max_events],
+            "more": len(events) > self.max_events,
+        })
@@ -12,5 +12,11 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
+os.environ.setdefault('DJANGO_ASGI', 'True')
 
 application = get_asgi_application()
+
+# Write the medical-record audit log from a background thread in each worker (see api/audit.py).
+from api import audit  # noqa: E402
+
+audit.start()
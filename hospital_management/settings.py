@@ -12,19 +12,21 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
+import importlib.util
 import os
-import dj_database_url
-from dotenv import load_dotenv
-
-load_dotenv()
-print("✅ DATABASE_URL:", os.getenv("DATABASE_URL"))
-print("✅ POSTGRES_LOCALLY:", os.getenv("POSTGRES_LOCALLY"))
-
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Settings are imported by every process (each gunicorn worker, every manage.py command), so
+# optional dependencies are only imported when they're used: python-dotenv when there's a
+# .env file, dj-database-url when a database URL is set.
+if (BASE_DIR / '.env').is_file():
+    from dotenv import load_dotenv
+
+    load_dotenv(BASE_DIR / '.env')
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.2/howto/deployment/checklist/
@@ -59,11 +61,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'django_filters',
+    'taggit',
     'api',
     'rest_framework_simplejwt',
 ]
 
 MIDDLEWARE = [
+    'api.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -71,6 +76,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ReplicaPinMiddleware',
 ]
 
 ROOT_URLCONF = 'hospital_management.urls'
@@ -96,24 +102,21 @@ WSGI_APPLICATION = 'hospital_management.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-import os
-import dj_database_url
-from pathlib import Path
-
-BASE_DIR = Path(__file__).resolve().parent.parent
-
 # Get environment and database URL
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Optional flag — if you want to always use Postgres locally
+POSTGRES_LOCALLY = True  # set to False if you want to switch back to SQLite
+# Only require SSL in production; disabled when using Postgres locally to avoid psycopg2 SSL errors
+DATABASE_SSL_REQUIRE = ENVIRONMENT == 'production' and not POSTGRES_LOCALLY
+
 # If DATABASE_URL exists (either from Railway or your local .env), use Postgres
 if DATABASE_URL:
+    import dj_database_url
+
     DATABASES = {
-        'default': dj_database_url.config(
-            default=DATABASE_URL,
-            conn_max_age=600,
-            ssl_require=ENVIRONMENT == 'production'  # Only require SSL in production
-        )
+        'default': dj_database_url.parse(DATABASE_URL, conn_max_age=600, ssl_require=DATABASE_SSL_REQUIRE)
     }
 else:
     # Fallback to SQLite for local development when no DATABASE_URL is set
@@ -124,15 +127,82 @@ else:
         }
     }
 
-# Optional flag — if you want to always use Postgres locally
-POSTGRES_LOCALLY = True  # set to False if you want to switch back to SQLite
 
-if POSTGRES_LOCALLY and DATABASE_URL:
-    DATABASES['default'] = dj_database_url.config(
-        default=DATABASE_URL,
-        conn_max_age=600,
-        ssl_require=False  # Disable SSL locally to avoid psycopg2 SSL errors
-    )
+# Native connection pooling for PostgreSQL (requires psycopg 3: pip install "psycopg[binary,pool]").
+# The pool replaces persistent connections, so CONN_MAX_AGE is reset to 0.
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", "0"))
+
+
+def _pooled(config):
+    if DATABASE_POOL_MAX_SIZE and config['ENGINE'] == 'django.db.backends.postgresql':
+        # requirements.txt ships psycopg2, which Django only rejects for pooling when it first connects.
+        if importlib.util.find_spec('psycopg') is None or importlib.util.find_spec('psycopg_pool') is None:
+            from django.core.exceptions import ImproperlyConfigured
+
+            raise ImproperlyConfigured(
+                'DATABASE_POOL_MAX_SIZE needs psycopg 3 and its pool: pip install "psycopg[binary,pool]".'
+            )
+        config['CONN_MAX_AGE'] = 0
+        config.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.getenv("DATABASE_POOL_MIN_SIZE", "2")),
+            'max_size': DATABASE_POOL_MAX_SIZE,
+            'timeout': int(os.getenv("DATABASE_POOL_TIMEOUT", "10")),
+        }
+    return config
+
+
+_pooled(DATABASES['default'])
+
+# Read replicas (comma-separated database URLs) for the read-only list views, see api/routers.py.
+# Tests treat each replica as a mirror of the primary.
+DATABASE_REPLICAS = []
+for _number, _url in enumerate(filter(None, os.getenv("DATABASE_REPLICA_URLS", "").split(',')), start=1):
+    import dj_database_url
+
+    DATABASES[f'replica{_number}'] = {
+        **_pooled(dj_database_url.parse(_url.strip(), conn_max_age=600, ssl_require=DATABASE_SSL_REQUIRE)),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{_number}')
+DATABASE_ROUTERS = ['api.routers.ReplicaRouter']
+# Seconds a user's list reads stay on the primary after they write (read-your-writes)
+DATABASE_REPLICA_PIN_SECONDS = int(os.getenv("DATABASE_REPLICA_PIN_SECONDS", "10"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at Redis or Memcached to share across workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv("CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("CACHE_LOCATION", "hospital-management"),
+    }
+}
+
+# Doctor directory response cache (invalidated by signals, so the timeout is only a backstop). Invalidation bumps
+# a version kept in the cache, which every worker must see, so the cache is off with a per-process backend
+# (LocMem) unless DIRECTORY_CACHE=True is set for a single-process deployment.
+DIRECTORY_CACHE_ALIAS = 'default'
+DIRECTORY_CACHE = os.getenv(
+    "DIRECTORY_CACHE", str(CACHES['default']['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'),
+) == "True"
+DIRECTORY_CACHE_TIMEOUT = 60 * 60
+
+# Doctors' iCalendar feeds (api/ical.py; rebuilt or patched on every change, so the timeout is only a backstop).
+# Patches run in the job worker and take a lock in the cache, so they're off with a per-process backend (LocMem),
+# where the worker would patch its own copy, unless CALENDAR_PATCHING=True is set for a single-process deployment.
+CALENDAR_CACHE_ALIAS = 'default'
+CALENDAR_PATCHING = os.getenv(
+    "CALENDAR_PATCHING",
+    str(CACHES[CALENDAR_CACHE_ALIAS]['BACKEND'] != 'django.core.cache.backends.locmem.LocMemCache'),
+) == "True"
+CALENDAR_CACHE_TIMEOUT = int(os.getenv("CALENDAR_CACHE_TIMEOUT", str(24 * 60 * 60)))
+
+# Fraction of requests measured by api.middleware.RequestMetricsMiddleware (0 disables it)
+REQUEST_METRICS_SAMPLE_RATE = float(os.getenv("REQUEST_METRICS_SAMPLE_RATE", "0"))
+# Samples kept per view and metric for the p50/p95/p99 estimates
+REQUEST_METRICS_RESERVOIR_SIZE = 1024
 
 
 # Password validation
@@ -185,23 +255,90 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    # Token buckets of the views throttled in api/urls.py (see api/throttling.py); remove a rate to disable its bucket
+    'DEFAULT_THROTTLE_RATES': {
+        'login.ip': os.getenv("THROTTLE_LOGIN_IP_RATE", "10/min"),
+        'register.ip': os.getenv("THROTTLE_REGISTER_IP_RATE", "20/hour"),
+        'booking.user': os.getenv("THROTTLE_BOOKING_USER_RATE", "30/min"),
+        'booking.ip': os.getenv("THROTTLE_BOOKING_IP_RATE", "120/min"),
+    },
+    # Proxies in front of the app. With 0, X-Forwarded-For (client-controlled) is ignored; deployments
+    # behind a proxy must set it (1 on Railway) or every client shares the proxy's address.
+    'NUM_PROXIES': int(os.getenv("NUM_PROXIES", "0")),
 }
 
+# Cache holding the throttle buckets; must be shared by all workers for the limits to be global
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Processes used to hash passwords during bulk user imports (POST /api/users/import/)
+USER_IMPORT_WORKERS = int(os.getenv("USER_IMPORT_WORKERS", "1"))
 
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
+    # Tokens carry role and profile_id claims (see api/authentication.py)
+    'TOKEN_OBTAIN_SERIALIZER': 'api.authentication.ClaimsTokenObtainPairSerializer',
 }
 
+# Authenticate read-only endpoints from token claims instead of loading the user row
+JWT_CLAIMS_AUTH = os.getenv("JWT_CLAIMS_AUTH", "False") == "True"
+# Seconds a user's is_active/role is trusted before it is re-checked (revocation delay)
+JWT_CLAIMS_REVOCATION_TTL = int(os.getenv("JWT_CLAIMS_REVOCATION_TTL", "30"))
+
+# Seconds a change waits before delta syncs (?since=) report it, covering commit delays (see api/sync.py)
+DELTA_SYNC_SETTLE_SECONDS = int(os.getenv("DELTA_SYNC_SETTLE_SECONDS", "5"))
+
+# Seconds an Idempotency-Key's stored response is replayed (see api/idempotency.py)
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", str(24 * 60 * 60)))
+
+# Audit log of medical-record access (see api/audit.py): buffered in each process and written in
+# batches of AUDIT_BUFFER_SIZE events, or every AUDIT_FLUSH_SECONDS
+AUDIT_LOG = os.getenv("AUDIT_LOG", "True") == "True"
+AUDIT_BUFFER_SIZE = int(os.getenv("AUDIT_BUFFER_SIZE", "500"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "5"))
+# Events a process keeps buffered while writes fail; newer ones are dropped (and logged) beyond it
+AUDIT_BUFFER_MAX = int(os.getenv("AUDIT_BUFFER_MAX", "50000"))
+
+# Background jobs (see api/jobs.py): where enqueued jobs go, how long a worker holds a claimed job
+# and the retry backoff (seconds, doubling per failed attempt up to the maximum)
+JOB_BACKEND = os.getenv("JOB_BACKEND", "api.jobs.DatabaseBackend")
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_RETRY_DELAY = int(os.getenv("JOB_RETRY_DELAY", "10"))
+JOB_MAX_RETRY_DELAY = int(os.getenv("JOB_MAX_RETRY_DELAY", "3600"))
+
+# Notification emails (api/notifications.py); printed to the worker's output unless an SMTP backend is set
+EMAIL_BACKEND = os.getenv("EMAIL_BACKEND", "django.core.mail.backends.console.EmailBackend")
+DEFAULT_FROM_EMAIL = os.getenv("DEFAULT_FROM_EMAIL", "noreply@hospital.local")
+EMAIL_HOST = os.getenv("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", "25"))
+EMAIL_HOST_USER = os.getenv("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.getenv("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "False") == "True"
+# Base URL of the API in links sent by email
+SITE_URL = os.getenv("SITE_URL", "http://localhost:8000")
+
 TIME_ZONE = 'Africa/Lagos'
 USE_TZ = True
 
 STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
-# Whitenoise setup
-MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
+# Served through hospital_management/asgi.py. The middleware stack must then be fully
+# async-capable (one sync middleware funnels every request through a single thread), so
+# WhiteNoise is left out: serve static files from the proxy/CDN instead.
+ASGI_MODE = os.getenv("DJANGO_ASGI", "False") == "True"
+# The ASGI stack, also used by `manage.py benchmark_async` under WSGI settings
+ASGI_MIDDLEWARE = [
+    'api.middleware.AsyncRequestMetricsMiddleware' if path == 'api.middleware.RequestMetricsMiddleware' else path
+    for path in MIDDLEWARE
+]
+
+if ASGI_MODE:
+    MIDDLEWARE = ASGI_MIDDLEWARE
+else:
+    # Whitenoise setup
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1, 'whitenoise.middleware.WhiteNoiseMiddleware')
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
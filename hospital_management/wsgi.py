@@ -10,7 +10,17 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'hospital_management.settings')
 
 application = get_wsgi_application()
+
+# Load the URLconf (and every view module) now rather than on each worker's first request,
+# so with `gunicorn --preload` the master imports it once and forked workers start warm.
+get_resolver().url_patterns
+
+# Write the medical-record audit log from a background thread in each worker (see api/audit.py).
+from api import audit  # noqa: E402
+
+audit.start()